@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+'''Compare reading all the XmlRecords of a sheet row by row (the default)
+and a batch of columns at a time (DataHandler(columnar=True)).
+
+The sheets are made by synthetic.py; the records from both loads are
+checked to be the same.
+
+Run from the top-level directory, eg:
+    python benchmarks/bench_columnar.py --rows 50000 --columns 80
+'''
+import gc
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mods_generator import DataHandler
+from synthetic import FORMATS, KINDS, make_spreadsheet
+
+
+def read_records(path, columnar):
+    '''Returns the time to read the records, and a digest of them to compare.'''
+    gc.collect()
+    start = time.perf_counter()
+    records = DataHandler(path, control_row=1, columnar=columnar).get_xml_records()
+    seconds = time.perf_counter() - start
+    digest = hashlib.sha256()
+    for r in records:
+        digest.update(repr((r.group_id, r.xml_id, [(xml_path, data) for xml_path, data, mapping in r.fields()])).encode('utf8'))
+    return seconds, digest.hexdigest()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--columns', type=int, default=60)
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                    help='comma-separated formats to test (default: %(default)s)')
+    parser.add_argument('--kind', choices=sorted(KINDS), default='mods')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for file_format in args.formats.split(','):
+            path = os.path.join(tmp, 'bench.%s' % file_format)
+            try:
+                make_spreadsheet(path, args.kind, args.rows, args.columns)
+            except ImportError as e:
+                print('skipping %s: %s' % (file_format, e))
+                continue
+            row_time, row_digest = read_records(path, columnar=False)
+            column_time, column_digest = read_records(path, columnar=True)
+            if row_digest != column_digest:
+                raise RuntimeError('the columnar records are different')
+            print('%-5s rows: %.2fs  columns: %.2fs  (%.1fx)' % (file_format, row_time, column_time, row_time / column_time))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+'''Compare process_text_date with the old strptime version on realistic dates.
+
+The dates are drawn from a limited pool (like the dates in a real collection),
+and every result is checked against the old version.
+
+Run from the top-level directory: python benchmarks/bench_dates.py
+'''
+import datetime
+import os
+import random
+import re
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mods_generator import process_text_date
+
+
+def legacy_process_text_date(str_date, force_dates=False):
+    '''process_text_date as it was before the fast normalizer (for comparison).
+        
+    Note: in xx/xx/xx or xx-xx-xx, we assume that year is last, not first.'''
+    #do some checking on str_date - if it's not what we're looking for,
+    #   just return str_date without changing anything
+    if not isinstance(str_date, str):
+        return str_date
+    if len(str_date) == 0:
+        return str_date
+    #Some date formats we could understand:
+    #dd/dd/dddd, dd/dd/dd, d/d/dd, ...
+    mmddyy = re.compile('^\d?\d/\d?\d/\d\d$')
+    mmddyyyy = re.compile('^\d?\d/\d?\d/\d\d\d\d$')
+    mmyyyy = re.compile('^\d?\d/\d\d\d\d$')
+    #dd-dd-dddd, dd-dd-dd, d-d-dd, ...
+    mmddyy2 = re.compile('^\d?\d-\d?\d-\d\d$')
+    mmddyyyy2 = re.compile('^\d?\d-\d?\d-\d\d\d\d$')
+    mmyyyy2 = re.compile('^\d?\d-\d\d\d\d$')
+    format = '' #flag to remember which format we used
+    if mmddyy.search(str_date):
+        try:
+            #try mm/dd/yy first, since that should be more common in the US
+            newDate = datetime.datetime.strptime(str_date, '%m/%d/%y')
+            format = 'mmddyy'
+        except ValueError:
+            try:
+                newDate = datetime.datetime.strptime(str_date, '%d/%m/%y')
+                format = 'ddmmyy'
+            except ValueError:
+                return str_date
+    elif mmddyyyy.search(str_date):
+        try:
+            newDate = datetime.datetime.strptime(str_date, '%m/%d/%Y')
+            format = 'mmddyyyy'
+        except ValueError:
+            try:
+                newDate = datetime.datetime.strptime(str_date, '%d/%m/%Y')
+                format = 'ddmmyyyy'
+            except ValueError:
+                return str_date
+    elif mmyyyy.search(str_date):
+        month, year = str_date.split(u'/')
+        return u'%04d-%02d' % (int(year), int(month))
+    elif mmyyyy2.search(str_date):
+        month, year = str_date.split(u'-')
+        return u'%04d-%02d' % (int(year), int(month))
+    elif mmddyy2.search(str_date):
+        try:
+            #try mm-dd-yy first, since that should be more common
+            newDate = datetime.datetime.strptime(str_date, '%m-%d-%y')
+            format = 'mmddyy'
+        except ValueError:
+            try:
+                newDate = datetime.datetime.strptime(str_date, '%d-%m-%y')
+                format = 'ddmmyy'
+            except ValueError:
+                return str_date
+    elif mmddyyyy2.search(str_date):
+        try:
+            newDate = datetime.datetime.strptime(str_date, '%m-%d-%Y')
+            format = 'mmddyyyy'
+        except ValueError:
+            try:
+                newDate = datetime.datetime.strptime(str_date, '%d-%m-%Y')
+                format = 'ddmmyyyy'
+            except ValueError:
+                return str_date
+    else:
+        return str_date
+    #at this point, we have newDate, but it could still have been ambiguous
+    #day & month are both between 1 and 12 & not equal - ambiguous
+    if newDate.day <= 12 and newDate.day != newDate.month: 
+        if force_dates:
+            return u'%04d-%02d-%02d' % (newDate.year, newDate.month, newDate.day)
+        else:
+            return str_date
+    #year is only two digits - don't know the century, or if year was
+    # interchanged with month or day
+    elif format == 'mmddyy' or format == 'ddmmyy':
+        if force_dates:
+            return u'%04d-%02d-%02d' % (newDate.year, newDate.month, newDate.day)
+        else:
+            return str_date
+    else:
+        return u'%04d-%02d-%02d' % (newDate.year, newDate.month, newDate.day)
+
+
+def make_dates(count, distinct, seed=1):
+    rand = random.Random(seed)
+    pool = []
+    for i in range(distinct):
+        d = datetime.date(1850, 1, 1) + datetime.timedelta(days=rand.randrange(60000))
+        style = rand.randrange(8)
+        if style == 0:
+            pool.append('%s/%s/%s' % (d.month, d.day, d.year))
+        elif style == 1:
+            pool.append('%02d/%02d/%s' % (d.day, d.month, d.year))
+        elif style == 2:
+            pool.append('%s-%s-%02d' % (d.month, d.day, d.year % 100))
+        elif style == 3:
+            pool.append('%02d/%s' % (d.month, d.year))
+        elif style == 4:
+            pool.append(d.isoformat())
+        elif style == 5:
+            pool.append('%s-%s-%s' % (d.day, d.month, d.year))
+        elif style == 6:
+            pool.append('circa %s' % d.year)
+        else:
+            pool.append('')
+    return [rand.choice(pool) for i in range(count)]
+
+
+def run(func, dates, force_dates):
+    start = time.perf_counter()
+    results = [func(d, force_dates) for d in dates]
+    return results, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=1000000)
+    parser.add_argument('--distinct', type=int, default=5000)
+    args = parser.parse_args()
+    dates = make_dates(args.count, args.distinct)
+    for force_dates in [False, True]:
+        before, before_time = run(legacy_process_text_date, dates, force_dates)
+        after, after_time = run(process_text_date, dates, force_dates)
+        if before != after:
+            raise RuntimeError('results differ from the old process_text_date')
+        print('force_dates=%s: %s dates (%s distinct)' % (force_dates, args.count, len(set(dates))))
+        print('  before (strptime): %.2fs, %.0f dates/sec' % (before_time, args.count / before_time))
+        print('  after (memoized):  %.2fs, %.0f dates/sec' % (after_time, args.count / after_time))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''Time Mapper.add_data for each MODS and DarwinCore element.
+
+Each mapping is parsed once up front (like DataHandler.mapping_plan), so the
+numbers are the handler lookup plus the eulxml work for that element.
+
+Run from the top-level directory: python benchmarks/bench_element_dispatch.py
+'''
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mods_generator import Mapper, ModsMappingParser
+
+
+MODS_SAMPLES = [
+    ('<mods:mods ID="">', 'mods000'),
+    ('<mods:name type="personal"><mods:namePart>#<mods:role><mods:roleTerm type="text">', 'Smith, Ted#creator'),
+    ('<mods:titleInfo><mods:title>#<mods:partName>', 'Title#part 1'),
+    ('<mods:language><mods:languageTerm authority="iso639-2b" type="code">', 'eng'),
+    ('<mods:genre authority="aat">', 'Programming Tests'),
+    ('<mods:originInfo><mods:dateCreated encoding="w3cdtf">', '2001-01-01'),
+    ('<mods:originInfo><mods:copyrightDate>', '2001'),
+    ('<mods:originInfo><mods:publisher>', 'Publisher'),
+    ('<mods:physicalDescription><mods:extent>', '1 video file'),
+    ('<mods:typeOfResource>', 'video'),
+    ('<mods:targetAudience>', 'adult'),
+    ('<mods:abstract>', 'An abstract'),
+    ('<mods:note displayLabel="note label">', 'A note'),
+    ('<mods:subject><mods:topic>', 'Testing'),
+    ('<mods:identifier type="local">', '1591'),
+    ('<mods:location><mods:url>', 'http://www.example.com'),
+    ('<mods:relatedItem type="related item"><mods:titleInfo><mods:title>', 'Related title'),
+]
+
+
+def time_element(record_type, xml_path, data, iterations):
+    mapping = ModsMappingParser(xml_path)
+    elapsed = 0
+    for i in range(iterations):
+        #use a new record each time, so repeated elements don't pile up
+        mapper = Mapper(record_type, [])
+        start = time.perf_counter()
+        mapper.add_data(xml_path, data, mapping=mapping)
+        elapsed += time.perf_counter() - start
+    return elapsed / iterations * 1000000
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--iterations', type=int, default=500)
+    args = parser.parse_args()
+    print('%-60s %12s' % ('element', 'usec/call'))
+    for xml_path, data in MODS_SAMPLES:
+        print('%-60s %12.1f' % (xml_path[:60], time_element('mods', xml_path, data, args.iterations)))
+    for element in Mapper.dwc_elements:
+        xml_path = '<%s>' % element
+        print('%-60s %12.1f' % (xml_path, time_element('dwc', xml_path, 'value', args.iterations)))
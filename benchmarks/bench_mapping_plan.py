@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''Compare mapping throughput with and without the per-sheet mapping plan.
+
+"before" strips the compiled mapping from each field, so Mapper re-parses the
+control row string for every cell (the old behavior); "after" uses the
+ModsMappingParser objects from DataHandler.mapping_plan.
+
+Run from the top-level directory: python benchmarks/bench_mapping_plan.py
+'''
+import csv
+import io
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mods_generator import DataHandler, Mapper
+
+
+MAPPINGS = [
+    '<mods:titleInfo><mods:title>#<mods:partName>#<mods:partNumber>',
+    '<mods:name type="personal"><mods:namePart>#<mods:namePart type="date">#<mods:role><mods:roleTerm type="text">',
+    '<mods:originInfo><mods:dateCreated encoding="w3cdtf" keyDate="yes">',
+    '<mods:originInfo><mods:publisher>',
+    '<mods:subject><mods:topic>',
+    '<mods:subject authority="local"><mods:topic>#<mods:topic>',
+    '<mods:identifier type="local" displayLabel="PN_DB_id">',
+    '<mods:genre authority="aat">',
+    '<mods:note displayLabel="note label">',
+    '<mods:location><mods:physicalLocation>#<mods:url>',
+]
+
+VALUES = [
+    'Title {0}#part {0}#{0}',
+    'Smith, Ted {0}#1900-2013#creator',
+    '2001-01-01',
+    'Publisher {0}',
+    'Topic {0}',
+    'Local {0}#Other {0}',
+    '{0}',
+    'Genre {0}',
+    'Note {0}',
+    'Library#http://example.com/{0}',
+]
+
+
+def make_wide_csv(rows, columns):
+    control_row = ['mods id']
+    for i in range(columns):
+        control_row.append(MAPPINGS[i % len(MAPPINGS)])
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(control_row)
+    for row_number in range(rows):
+        row = ['id%s' % row_number]
+        for i in range(columns):
+            row.append(VALUES[i % len(VALUES)].format(row_number))
+        writer.writerow(row)
+    return io.BytesIO(out.getvalue().encode('utf8'))
+
+
+def run(records, use_plan):
+    start = time.perf_counter()
+    for record in records:
+        if use_plan:
+            field_data = record.field_data()
+        else:
+            field_data = [{'xml_path': f['xml_path'], 'data': f['data']} for f in record.field_data()]
+        Mapper(record.record_type, field_data)
+    return len(records) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--columns', type=int, default=30)
+    args = parser.parse_args()
+    records = DataHandler(make_wide_csv(args.rows, args.columns), control_row=1).get_xml_records()
+    before = run(records, use_plan=False)
+    after = run(records, use_plan=True)
+    print('%s rows x %s mapped columns' % (args.rows, args.columns))
+    print('before (parse every cell): %.1f rows/sec' % before)
+    print('after (mapping plan):      %.1f rows/sec' % after)
+    print('speedup: %.2fx' % (after / before))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''Measure the memory held by the XmlRecords of a large sheet.
+
+"before" is the old representation (an XmlRecord with a __dict__, holding
+a list of {'xml_path', 'data', 'mapping'} dicts); "after" is the current
+one (__slots__, and the (field index, value) pairs into the sheet's shared
+FieldTable). Memory is what tracemalloc sees still allocated after building
+all the records of a synthetic sheet (see synthetic.py).
+
+Run from the top-level directory: python benchmarks/bench_records.py --rows 200000
+'''
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mods_generator import DataHandler
+from synthetic import KINDS, make_spreadsheet
+
+
+class LegacyXmlRecord:
+
+    def __init__(self, group_id, xml_id, field_data):
+        self.group_id = group_id
+        self.xml_id = xml_id
+        self.record_type = 'mods'
+        self._field_data = field_data
+
+
+def traced_size(build):
+    '''Build the records, returning them & the memory they hold (in bytes).'''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        records = build()
+        gc.collect()
+        return records, tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--columns', type=int, default=30)
+    parser.add_argument('--kind', choices=sorted(KINDS), default='mods')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_spreadsheet(os.path.join(tmp, 'bench.csv'), args.kind, args.rows, args.columns)
+
+        def build_legacy():
+            #the old records held the values read from the sheet, like the new ones
+            return [LegacyXmlRecord(r.group_id, r.xml_id, r.field_data())
+                    for r in DataHandler(path, control_row=1).iter_xml_records()]
+
+        legacy, before = traced_size(build_legacy)
+        del legacy
+        records, after = traced_size(lambda: DataHandler(path, control_row=1).get_xml_records())
+    cells = sum(len(record) for record in records)
+    print('%s rows, %s cells' % (len(records), cells))
+    print('before: %7.1f MB, %5.1f bytes/cell' % (before / 1e6, before / cells))
+    print('after:  %7.1f MB, %5.1f bytes/cell' % (after / 1e6, after / cells))
+    print('saved:  %6.1f%%' % ((1 - after / before) * 100))
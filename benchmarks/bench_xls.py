@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''Measure the per-cell cost of reading a large .xls file.
+
+"before" converts the cells the old way (cell_type() per float cell, and
+xldate_as_tuple for every date cell); "after" is DataHandler's row
+processing (row_types() once per row, and cached date conversion).
+Needs xlwt to write the test spreadsheet.
+
+Run from the top-level directory: python benchmarks/bench_xls.py
+'''
+import datetime
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import xlrd
+try:
+    import xlwt
+except ImportError:
+    sys.exit('xlwt is needed to write the benchmark spreadsheet (pip install xlwt)')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mods_generator import DataHandler
+
+
+def make_xls(path, rows, columns):
+    book = xlwt.Workbook()
+    sheet = book.add_sheet('data')
+    date_style = xlwt.easyxf(num_format_str='YYYY-MM-DD')
+    sheet.write(0, 0, 'mods id')
+    for col in range(1, columns):
+        sheet.write(0, col, '<mods:note>')
+    for row in range(1, rows + 1):
+        sheet.write(row, 0, 'id%s' % row)
+        for col in range(1, columns):
+            kind = col % 4
+            if kind == 0:
+                sheet.write(row, col, row)
+            elif kind == 1:
+                sheet.write(row, col, row + 0.5)
+            elif kind == 2:
+                sheet.write(row, col, datetime.date(2000, 1, 1) + datetime.timedelta(days=row % 365), date_style)
+            else:
+                sheet.write(row, col, 'text %s' % row)
+    book.save(path)
+
+
+def legacy_convert(dataset, datemode, index):
+    row = dataset.row_values(index)
+    for i, v in enumerate(row):
+        if isinstance(v, float):
+            if dataset.cell_type(index, i) == 2 and int(v) == v:
+                row[i] = str(int(v))
+            elif dataset.cell_type(index, i) == 3:
+                tup = xlrd.xldate_as_tuple(v, datemode)
+                d = datetime.datetime(*tup)
+                if tup[3] == 0 and tup[4] == 0 and tup[5] == 0:
+                    row[i] = '{0:%Y-%m-%d}'.format(d)
+                else:
+                    row[i] = '{0:%Y-%m-%d %H:%M:%S}'.format(d)
+    return [v if isinstance(v, str) else str(v) for v in row]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--columns', type=int, default=40)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.xls')
+        make_xls(path, args.rows, args.columns)
+        dh = DataHandler(path, control_row=1)
+        cells = args.rows * args.columns
+        start = time.perf_counter()
+        before = [legacy_convert(dh.dataset, dh.book.datemode, i) for i in range(1, args.rows + 1)]
+        before_time = time.perf_counter() - start
+        start = time.perf_counter()
+        after = [dh._process_row(dh.dataset.row_values(i), i) for i in range(1, args.rows + 1)]
+        after_time = time.perf_counter() - start
+        if before != after:
+            raise RuntimeError('results differ from the old conversion')
+        print('%s rows x %s columns' % (args.rows, args.columns))
+        print('before: %.2fs, %.2f usec/cell' % (before_time, before_time / cells * 1000000))
+        print('after:  %.2fs, %.2f usec/cell' % (after_time, after_time / cells * 1000000))
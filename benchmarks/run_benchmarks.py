@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+'''End-to-end benchmarks on synthetic spreadsheets (see synthetic.py).
+
+For each format (csv, xls, xlsx) and kind of sheet (mods, dwc), this
+measures rows/sec and peak Python memory (tracemalloc) of:
+  - read: DataHandler building all the XmlRecords
+  - map: turning the records into XML bytes, for each renderer
+  - process: the whole process() run, writing files to a temp directory
+Timings are taken without tracemalloc running; peak memory is measured in
+a second, traced run of each stage (skip it with --no-memory).
+
+The results are written to a JSON file; pass an earlier results file with
+--compare to see the change in rows/sec.
+
+Run from the top-level directory, eg:
+    python benchmarks/run_benchmarks.py --rows 20000 --columns 40 -o results.json
+'''
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mods_generator
+from mods_generator import DataHandler, RENDERERS, process, render_record
+from synthetic import FORMATS, KINDS, make_spreadsheet
+
+
+def measure(func, trace_memory=True):
+    '''Run func, returning (seconds, peak traced memory in bytes or None).'''
+    gc.collect()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def read_records(path):
+    return DataHandler(path, control_row=1).get_xml_records()
+
+
+def run_stages(path, rows, args):
+    results = []
+
+    def add_result(stage, seconds, peak, renderer=None):
+        results.append({
+            'stage': stage,
+            'renderer': renderer,
+            'seconds': round(seconds, 4),
+            'rows_per_sec': round(rows / seconds, 1),
+            'peak_memory_bytes': peak,
+        })
+
+    seconds, peak = measure(lambda: read_records(path), not args.no_memory)
+    add_result('read', seconds, peak)
+    records = read_records(path)
+    for renderer in args.renderers:
+        seconds, peak = measure(lambda: [render_record(r, renderer) for r in records], not args.no_memory)
+        add_result('map', seconds, peak, renderer)
+    del records
+    for renderer in args.renderers:
+        def run_process():
+            with tempfile.TemporaryDirectory() as xml_files_dir:
+                process(path, xml_files_dir, control_row=1, renderer=renderer, workers=args.workers)
+        seconds, peak = measure(run_process, not args.no_memory)
+        add_result('process', seconds, peak, renderer)
+    return results
+
+
+def result_key(result):
+    return (result['format'], result['kind'], result['stage'], result['renderer'] or '-')
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'rt', encoding='utf8') as f:
+        baseline = dict((result_key(r), r) for r in json.load(f)['results'])
+    print('\nchange in rows/sec from %s:' % baseline_path)
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old:
+            change = (result['rows_per_sec'] / old['rows_per_sec'] - 1) * 100
+            print('%-5s %-5s %-8s %-7s %+7.1f%%' % (result_key(result) + (change,)))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--columns', type=int, default=30)
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                    help='comma-separated formats to test (default: %(default)s)')
+    parser.add_argument('--kinds', default=','.join(sorted(KINDS)),
+                    help='comma-separated kinds of sheet to test (default: %(default)s)')
+    parser.add_argument('--renderers', default=','.join(RENDERERS),
+                    help='comma-separated renderers to test (default: %(default)s)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                    help='workers for the process stage (default is 1)')
+    parser.add_argument('--no-memory', action='store_true', default=False,
+                    help='don\'t measure peak memory (halves the run time)')
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                    help='JSON file to write the results to (default: %(default)s)')
+    parser.add_argument('--compare', default=None,
+                    help='earlier results file to compare rows/sec against')
+    args = parser.parse_args()
+    args.renderers = args.renderers.split(',')
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for file_format in args.formats.split(','):
+            for kind in args.kinds.split(','):
+                path = os.path.join(tmp, '%s.%s' % (kind, file_format))
+                try:
+                    make_spreadsheet(path, kind, args.rows, args.columns)
+                except ImportError as e:
+                    print('skipping %s: %s' % (file_format, e))
+                    break
+                for result in run_stages(path, args.rows, args):
+                    result.update({'format': file_format, 'kind': kind})
+                    results.append(result)
+                    peak = result['peak_memory_bytes']
+                    print('%-5s %-5s %-8s %-7s %10.1f rows/sec %10s' % (result_key(result) + (result['rows_per_sec'],
+                            '%.1f MB' % (peak / 1e6) if peak is not None else '')))
+    with open(args.output, 'wt', encoding='utf8') as f:
+        json.dump({
+            'date': datetime.datetime.now().isoformat(),
+            'version': mods_generator.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'rows': args.rows,
+            'columns': args.columns,
+            'workers': args.workers,
+            'results': results,
+        }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
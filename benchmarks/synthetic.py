@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+'''Generate synthetic spreadsheets (CSV, XLS or XLSX) for benchmarking.
+
+MODS sheets have names with roles, titles, originInfo dates (some in m/d/y
+form, so date normalization has work to do), subjects, locations,
+identifiers, genres and notes. DarwinCore sheets have the taxonomy
+columns, including the dynamic species/subspecies/variety columns (so they
+always have at least that many columns).
+Row 1 is the control row.
+
+Run from the top-level directory, eg:
+    python benchmarks/synthetic.py --rows 100000 --columns 40 out.csv
+'''
+import csv
+import os
+import sys
+from argparse import ArgumentParser
+
+
+#(control row mapping, value template) - values are formatted with the row number
+MODS_COLUMNS = [
+    ('<mods:titleInfo><mods:title>#<mods:partName>', 'Title {0}#part {0}'),
+    ('<mods:name type="personal"><mods:namePart>#<mods:namePart type="date">#<mods:role><mods:roleTerm type="text">',
+        'Smith, Ted {0}#1900-2013#creator || Jones, Al {0}##contributor'),
+    ('<mods:originInfo><mods:dateCreated encoding="w3cdtf" keyDate="yes">', '{1}/{2}/19{3:02d}'),
+    ('<mods:originInfo><mods:dateIssued encoding="w3cdtf">', '20{3:02d}-{1:02d}-{2:02d}'),
+    ('<mods:originInfo><mods:publisher>', 'Publisher {0}'),
+    ('<mods:subject><mods:topic>', 'Topic {0} || Other topic'),
+    ('<mods:subject authority="local"><mods:topic>#<mods:temporal>', 'Local {0}#1990s'),
+    ('<mods:subject><mods:hierarchicalGeographic><mods:country>United States</mods:country><mods:state>', 'Rhode Island'),
+    ('<mods:location><mods:physicalLocation>#<mods:url>', 'Library#http://example.com/{0}'),
+    ('<mods:identifier type="local" displayLabel="DB id">', '{0}'),
+    ('<mods:genre authority="aat">', 'Genre {0}'),
+    ('<mods:note displayLabel="note label">', 'Note {0} & more'),
+    ('<mods:physicalDescription><mods:extent>#<mods:digitalOrigin>', '{0} pages#reformatted digital'),
+    ('<mods:language><mods:languageTerm authority="iso639-2b" type="code">', 'eng'),
+]
+
+DWC_COLUMNS = [
+    ('<dwc:higherClassification>', 'Plantae | Tracheophyta | Magnoliopsida'),
+    ('<dwc:genus>', 'Genus{0}'),
+    ('<dwc:specificEpithet>', 'species{0}'),
+    ('dwc_species_author', 'Author {0}'),
+    ('dwc_subspecies', 'subspecies{0}'),
+    ('dwc_subspecies_author', 'Other Author'),
+    ('dwc_variety', ''),
+    ('dwc_variety_author', ''),
+    ('<dwc:kingdom>', 'Plantae'),
+    ('<dwc:family>', 'Family{0}'),
+    ('<dwc:recordedBy>', 'Sci Entist || Phy Sycist'),
+    ('<dwc:eventDate>', '{1}/{2}/19{3:02d}'),
+    ('<dwc:locality>', 'Locality {0}'),
+    ('<dwc:catalogNumber>', '{0}'),
+]
+
+KINDS = {'mods': MODS_COLUMNS, 'dwc': DWC_COLUMNS}
+FORMATS = ['csv', 'xls', 'xlsx']
+
+
+def make_rows(kind, rows, columns):
+    '''Yield the control row, then rows of data - the first column is the ID,
+    and the mapped columns repeat the kind's columns until there are enough.'''
+    templates = KINDS[kind]
+    mapped = []
+    for i in range(columns):
+        template = templates[i % len(templates)]
+        #DarwinCore sheets need each of the dynamic (non-<dwc:...>) columns exactly once
+        if template[0].startswith('<') or template not in mapped:
+            mapped.append(template)
+    if kind == 'dwc':
+        mapped.extend(t for t in templates if t not in mapped)
+    yield ['ID'] + [mapping for mapping, template in mapped]
+    for row in range(1, rows + 1):
+        values = (row, row % 12 + 1, row % 28 + 1, row % 100)
+        yield ['id%s' % row] + [template.format(*values) for mapping, template in mapped]
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow(row)
+
+
+def write_xls(path, rows):
+    import xlwt
+    book = xlwt.Workbook()
+    sheet = book.add_sheet('data')
+    for row_index, row in enumerate(rows):
+        if row_index > 65535:
+            raise ValueError('.xls files can only have 65536 rows')
+        for col_index, value in enumerate(row):
+            sheet.write(row_index, col_index, value)
+    book.save(path)
+
+
+def write_xlsx(path, rows):
+    import openpyxl
+    book = openpyxl.Workbook(write_only=True)
+    sheet = book.create_sheet('data')
+    for row in rows:
+        sheet.append(row)
+    book.save(path)
+
+
+WRITERS = {'csv': write_csv, 'xls': write_xls, 'xlsx': write_xlsx}
+
+
+def make_spreadsheet(path, kind='mods', rows=1000, columns=20, file_format=None):
+    '''Write a synthetic spreadsheet; the format comes from the extension if it isn't given.'''
+    if file_format is None:
+        file_format = os.path.splitext(path)[1].lstrip('.').lower()
+    WRITERS[file_format](path, make_rows(kind, rows, columns))
+    return path
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('path', help='output file (.csv, .xls or .xlsx)')
+    parser.add_argument('--kind', choices=sorted(KINDS), default='mods')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--columns', type=int, default=20)
+    args = parser.parse_args()
+    try:
+        make_spreadsheet(args.path, args.kind, args.rows, args.columns)
+    except ImportError as e:
+        sys.exit('%s (xlwt is needed for .xls, openpyxl for .xlsx)' % e)
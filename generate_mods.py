@@ -4,8 +4,13 @@ it will generate individual mods files for each record
 in the mods_files directory, logging the output to dataset_mods.log.
 Run './generate_mods.py --help' to see various options.
 
+To use it in a pipeline, pass '-' to read a CSV file from stdin (with
+--dialect), and --stdout to write the records to stdout, eg:
+    ... | ./generate_mods.py --dialect excel --stdout tar - | gzip > records.tar.gz
+
 Notes: 
-1. The spreadsheet can be any version of Excel, or a CSV file.
+1. The spreadsheet can be any version of Excel, or a CSV file - or a Parquet
+    or Arrow IPC file (with pyarrow installed).
 2. See the test files for the format of the spreadsheet/csv file.
 3. Unicode - all text strings from xlrd (for Excel files) are Unicode. For xlrd
     numbers, we convert those into Unicode, since we're just writing text out
@@ -16,16 +21,18 @@ Notes:
     UnicodeEncodeError will be raised).
 
 '''
+import csv
+import json
 import sys
 import os
 from argparse import ArgumentParser
-from mods_generator import DataHandler, process
+from mods_generator import DataHandler, ProcessStats, process, parse_shard, FSYNC_POLICIES, RENDERERS, STREAM_FORMATS, WRITER_THREADS
 
 
 if __name__ == '__main__':
     XML_FILES_DIR = "xml_files"
     parser = ArgumentParser()
-    parser.add_argument('file_name')
+    parser.add_argument('file_name', help='the spreadsheet, or - to read a CSV file from stdin (needs --dialect)')
     parser.add_argument('-t', '--type',
                     action='store', dest='type', default='parent',
                     help='type of records (parent or child, default is parent)')
@@ -40,13 +47,116 @@ if __name__ == '__main__':
                     help='specify the sheet number (starting at 1) in an Excel spreadsheet')
     parser.add_argument('-r', '--ctrl_row',
                     action='store', dest='row', default=2,
-                    help='specify the control row number (starting at 1) in an Excel spreadsheet')
+                    help='specify the control row number (starting at 1) in an Excel spreadsheet (Parquet & Arrow files find their own)')
     parser.add_argument('-i', '--input-encoding',
                     action='store', dest='in_enc', default='utf-8',
                     help='specify the input encoding for CSV files (default is UTF-8)')
+    parser.add_argument('-w', '--workers',
+                    action='store', dest='workers', default=1, type=int,
+                    help='number of processes to map & serialize records in (default is 1)')
+    parser.add_argument('--archive',
+                    action='store', dest='archive', default=None,
+                    help='write all the records into one .zip or .tar (.tar.gz, ...) file instead of the xml_files directory')
+    parser.add_argument('--dialect',
+                    action='store', dest='dialect', default=None, choices=csv.list_dialects(),
+                    help='read the file as CSV in this dialect, instead of detecting the format')
+    parser.add_argument('--stdout',
+                    action='store', dest='stream_format', default=None, choices=STREAM_FORMATS,
+                    help='write the records to stdout instead of the xml_files directory: NUL-separated (nul), each after '
+                        'a "<length> <filename>" line (length), or as a tar stream (tar)')
+    parser.add_argument('--compress',
+                    action='store_true', dest='compress', default=False,
+                    help='compress the records in the archive (or the tar stream)')
+    parser.add_argument('--check-duplicates',
+                    action='store_true', dest='check_duplicates', default=False,
+                    help='check all the records for duplicate IDs before writing anything')
+    parser.add_argument('--manifest',
+                    action='store', dest='manifest', default=None,
+                    help='only rebuild the records that changed since the run that wrote this manifest file (which is then updated)')
+    parser.add_argument('--delete-vanished',
+                    action='store_true', dest='delete_vanished', default=False,
+                    help='with --manifest, delete the files of records that are no longer in the spreadsheet')
+    parser.add_argument('--renderer',
+                    action='store', dest='renderer', default='eulxml', choices=RENDERERS,
+                    help='how to build the XML: eulxml (default) or lxml (same output, faster)')
+    parser.add_argument('--validate',
+                    action='store_true', dest='validate', default=False,
+                    help='check each MODS record against the MODS schema, and don\'t write invalid ones')
+    parser.add_argument('--validation-report',
+                    action='store', dest='validation_report', default=None,
+                    help='with --validate, write the invalid records and their errors to this JSON file')
+    parser.add_argument('--writer-threads',
+                    action='store', dest='writer_threads', default=WRITER_THREADS,
+                    help='number of threads writing the files in the background (default is %(default)s, 0 to write them in the main loop)')
+    parser.add_argument('--fsync',
+                    action='store', dest='fsync', default='none', choices=FSYNC_POLICIES,
+                    help='fsync each file as it\'s written, or all of them at the end (close) - default is none')
+    parser.add_argument('--columnar',
+                    action='store_true', dest='columnar', default=False,
+                    help='read the spreadsheet a batch of columns at a time (faster for wide sheets)')
+    parser.add_argument('--shard',
+                    action='store', dest='shard', default=None,
+                    help='only process shard INDEX/COUNT of the records (eg. 0/4 - families are kept together), to split a run across several nodes')
+    parser.add_argument('--shard-manifest',
+                    action='store', dest='shard_manifest', default=None,
+                    help='with --shard, list the shard\'s records in this JSON file (default is shard-INDEX-of-COUNT.json) - check the shards with merge_shards.py')
+    parser.add_argument('--profile',
+                    action='store', dest='profile', default=None,
+                    help='write the time spent in each stage (and on each element), and counts of records, cells & bytes written, to this JSON file')
     args = parser.parse_args()
-    process(file_name=args.file_name, xml_files_dir=XML_FILES_DIR, sheet=int(args.sheet),
+    #the options process() can't use together
+    output = '--archive' if args.archive else '--stdout' if args.stream_format else None
+    if args.workers > 1 and args.copy_parent_to_children:
+        parser.error('--copy-parent-to-children can only be used with one worker')
+    if args.archive and args.stream_format:
+        parser.error('the records can be written to --archive or --stdout, not both')
+    if output and args.copy_parent_to_children:
+        parser.error('--copy-parent-to-children needs the records written to the xml_files directory, not %s' % output)
+    if output and args.manifest:
+        parser.error('--manifest needs the records written to the xml_files directory, not %s' % output)
+    if output and args.fsync != 'none':
+        parser.error('--fsync is for the records written to the xml_files directory, not %s' % output)
+    if args.shard_manifest and not args.shard:
+        parser.error('--shard-manifest needs a --shard')
+    spreadsheet = args.file_name
+    if spreadsheet == '-':
+        if not args.dialect:
+            parser.error('reading from stdin needs a --dialect')
+        if args.check_duplicates:
+            parser.error('--check-duplicates needs to read the file twice, so it can\'t be used with stdin')
+        spreadsheet = sys.stdin.buffer
+    if args.stream_format and args.stream_format != 'tar' and args.compress:
+        parser.error('--compress only works with an archive or --stdout tar, not --stdout %s' % args.stream_format)
+    stream = sys.stdout.buffer if args.stream_format else None
+    #keep stdout for the records
+    report_file = sys.stderr if stream else sys.stdout
+    stats = ProcessStats() if args.profile else None
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        if not args.shard_manifest:
+            args.shard_manifest = 'shard-%s-of-%s.json' % shard
+    invalid = process(spreadsheet=spreadsheet, xml_files_dir=XML_FILES_DIR, sheet=int(args.sheet),
             control_row=int(args.row), force_dates=args.force_dates, object_type=args.type, input_encoding=args.in_enc,
-            copy_parent_to_children=args.copy_parent_to_children)
+            copy_parent_to_children=args.copy_parent_to_children, workers=args.workers,
+            archive=args.archive, compress=args.compress, check_duplicates=args.check_duplicates,
+            manifest=args.manifest, delete_vanished=args.delete_vanished, renderer=args.renderer,
+            validate=args.validate, stats=stats, writer_threads=int(args.writer_threads), fsync=args.fsync,
+            columnar=args.columnar, shard=shard, shard_manifest=args.shard_manifest, csv_dialect=args.dialect,
+            stream=stream, stream_format=args.stream_format)
+    if stats:
+        stats.save(args.profile)
+    if args.validation_report:
+        with open(args.validation_report, 'wt', encoding='utf8') as f:
+            json.dump(invalid, f, indent=2)
+    if invalid:
+        for record in invalid:
+            for error in record['errors']:
+                print('%s:%s:%s: %s' % (record['file'], error['line'], error['column'], error['message']), file=report_file)
+        print('%s invalid records were not written' % len(invalid), file=report_file)
+        sys.exit(1)
     sys.exit()
 
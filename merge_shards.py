@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+'''Check the shard manifests written by 'generate_mods.py --shard INDEX/COUNT'
+runs: all the shards have to be there, and each xml_id can only be in one
+record across all of them.
+
+Pass the shard manifests (eg. shard-*-of-4.json). Exits with an error if
+there's a problem. Run './merge_shards.py --help' to see the options.
+'''
+import json
+import sys
+from argparse import ArgumentParser
+from mods_generator import DataError, merge_shard_manifests
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('manifests', nargs='+', help='shard manifest files')
+    parser.add_argument('--report',
+                    action='store', dest='report', default=None,
+                    help='write the result of the checks to this JSON file')
+    args = parser.parse_args()
+    try:
+        result = merge_shard_manifests(args.manifests)
+    except DataError as e:
+        sys.exit(str(e))
+    if args.report:
+        with open(args.report, 'wt', encoding='utf8') as f:
+            json.dump(result, f, indent=2)
+    for filename, shards in sorted(result['duplicates'].items()):
+        print('%s is in shards %s' % (filename, ', '.join(str(shard) for shard in shards)))
+    if result['missing_shards']:
+        print('missing shards: %s' % ', '.join(str(shard) for shard in result['missing_shards']))
+    print('%s records in %s of %s shards, %s duplicate IDs' % (result['records'],
+            result['shard_count'] - len(result['missing_shards']), result['shard_count'], len(result['duplicates'])))
+    if result['duplicates'] or result['missing_shards']:
+        sys.exit(1)
+    sys.exit()
@@ -1,15 +1,87 @@
+import calendar
+import collections
+import concurrent.futures
+import copy
 import csv
 import datetime
+import functools
+import hashlib
 import io
+import itertools
+import json
 import os
 import re
+import tarfile
 import tempfile
+import time
+import zipfile
 
 import xlrd
+from lxml import etree
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 from eulxml.xmlmap import load_xmlobject_from_file
 from bdrxml import mods, darwincore
 
 
+__version__ = '0.1'
+
+#number of records sent to a worker process at a time
+WORKER_CHUNK_SIZE = 50
+
+#number of distinct sets of filled-in columns a FieldTable shares between records
+COLUMN_SETS_SIZE = 1024
+
+#number of parsed parent records kept in memory for copy_parent_to_children
+PARENT_CACHE_SIZE = 256
+
+#threads writing the records to xml_files_dir in the background (0 writes them in the main loop)
+WRITER_THREADS = 4
+
+#number of records that can be waiting to be written, before the main loop waits for the writer
+WRITER_QUEUE_SIZE = 64
+
+#none: leave it to the OS; file: fsync each file as it's written; close: fsync all the files at the end
+FSYNC_POLICIES = ('none', 'file', 'close')
+
+#how records are written to a stream (see open_stream_writer())
+STREAM_FORMATS = ('nul', 'length', 'tar')
+
+
+#.xlsx files are zip files
+XLSX_SIGNATURE = b'PK\x03\x04'
+PARQUET_SIGNATURE = b'PAR1'
+#Arrow IPC files (not the IPC stream format, which has no signature)
+ARROW_SIGNATURE = b'ARROW1'
+
+#schema metadata key for the control row of a Parquet/Arrow file - a JSON
+#   list (one value per column) or object (column name -> value)
+ARROW_CONTROL_ROW_KEY = b'mods_generator.control_row'
+
+
+def _read_signature(spreadsheet, size=8):
+    '''Get the first bytes of a file (path or binary file object), to check the file type.'''
+    try:
+        with open(spreadsheet, 'rb') as f:
+            return f.read(size)
+    except TypeError:
+        #got a file object - leave it at the start
+        spreadsheet.seek(0)
+        signature = spreadsheet.read(size)
+        spreadsheet.seek(0)
+        if not isinstance(signature, bytes):
+            return b''
+        return signature
+
+
 class ControlRowError(RuntimeError):
     pass
 
@@ -19,23 +91,99 @@ class ModsMappingError(RuntimeError):
 class DataError(RuntimeError):
     pass
 
+class UnsupportedByLxml(NotImplementedError):
+    '''Raised by LxmlMapper for anything it has no handler for (build_record() uses Mapper instead).'''
+    pass
+
+
+class FieldTable:
+    '''The fields of a sheet, shared by all the XmlRecords read from it.
+
+    Each field is (xml_path, ModsMappingParser): a mapped column's field is
+    at the column's index, and the generated DarwinCore fields (which aren't
+    in a column) are added after the last column.'''
+
+    def __init__(self, cols_to_map=None, mapping_plan=None):
+        cols_to_map = cols_to_map or {}
+        self._fields = [None] * (max(cols_to_map) + 1 if cols_to_map else 0)
+        for i, xml_path in cols_to_map.items():
+            self._fields[i] = (xml_path, mapping_plan[i])
+        self._generated = {}
+        self._column_sets = {}
+
+    def __getitem__(self, index):
+        return self._fields[index]
+
+    def get_index(self, xml_path):
+        '''The index of a field that isn't in a column (adding it the first time).'''
+        try:
+            return self._generated[xml_path]
+        except KeyError:
+            index = self._generated[xml_path] = len(self._fields)
+            self._fields.append((xml_path, ModsMappingParser(xml_path)))
+            return index
+
+    def share(self, indexes):
+        '''A shared copy of a tuple of field indexes, so all the records with
+        the same fields filled in keep one tuple between them.'''
+        shared = self._column_sets.get(indexes)
+        if shared is None:
+            shared = indexes
+            if len(self._column_sets) < COLUMN_SETS_SIZE:
+                self._column_sets[indexes] = indexes
+        return shared
+
+    def __getstate__(self):
+        #records are pickled with their table for the worker processes - they don't need the shared sets
+        state = self.__dict__.copy()
+        state['_column_sets'] = {}
+        return state
+
 
 class XmlRecord:
+    '''One row of data to turn into a record.
+
+    The fields are kept as the index of each field in the sheet's FieldTable,
+    and its value - field_data() builds the dicts for them.'''
 
-    def __init__(self, group_id, xml_id, field_data):
+    __slots__ = ('group_id', 'xml_id', 'record_type', '_table', '_indexes', '_values')
+
+    def __init__(self, group_id, xml_id, fields, table=None):
+        '''fields is a list of (index in table, value) pairs - or without a
+        table, a list of {'xml_path': xxx, 'data': xxx} dicts.'''
         self.group_id = group_id #this is what ties parent records to children
         self.xml_id = xml_id
-        if not field_data:
+        if not fields:
             raise DataError('no metadata for %s: %s' % (group_id, xml_id))
-        if u'<dc' in field_data[0]['xml_path'] or u'<dwc' in field_data[0]['xml_path']:
+        if table is None:
+            table = FieldTable()
+            fields = [(table.get_index(field['xml_path']), field['data']) for field in fields]
+        first_xml_path = table[fields[0][0]][0]
+        if u'<dc' in first_xml_path or u'<dwc' in first_xml_path:
             self.record_type = 'dwc'
         else:
             self.record_type = 'mods'
-        self._field_data = field_data
+        indexes, self._values = zip(*fields)
+        self._indexes = table.share(indexes)
+        self._table = table
+
+    def __len__(self):
+        return len(self._values)
+
+    def fields(self):
+        '''Generate (xml_path, data, mapping) for each field.'''
+        table = self._table
+        for index, data in zip(self._indexes, self._values):
+            xml_path, mapping = table[index]
+            yield xml_path, data, mapping
 
     def field_data(self):
-        #return list of {'xml_path': xxx, 'data': xxx}
-        return self._field_data
+        #return list of {'xml_path': xxx, 'data': xxx, 'mapping': <ModsMappingParser for xml_path>}
+        return [{'xml_path': xml_path, 'data': data, 'mapping': mapping} for xml_path, data, mapping in self.fields()]
+
+
+#xlrd cell types that always have str values
+TEXT_CELL_TYPES = frozenset([xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_TEXT, xlrd.XL_CELL_BLANK])
 
 
 class DataHandler:
@@ -47,17 +195,48 @@ class DataHandler:
     as well.
     '''
 
-    def __init__(self, spreadsheet, input_encoding='utf-8', sheet=1, control_row=None, force_dates=False, object_type='parent'):
+    def __init__(self, spreadsheet, input_encoding='utf-8', sheet=1, control_row=None, force_dates=False, object_type='parent',
+            columnar=False, csv_dialect=None):
         '''Open file and get data from correct sheet.
         
-        First, try opening the file as an excel spreadsheet.
+        With csv_dialect, the file is read as CSV in that dialect, without
+        sniffing the format (see _open_csv_stream for a stream, like stdin).
+        .xlsx files are streamed with openpyxl, if it's installed, and
+        Parquet & Arrow IPC files with pyarrow (see _open_arrow_file).
+        Otherwise, try opening the file as an excel spreadsheet.
         If that fails, try opening it as a CSV file.
         Exit with error if CSV doesn't work.
+        With columnar, the data rows are read a batch at a time and turned
+        into columns, which are converted a column at a time (see
+        _get_column_batch_rows).
         '''
         self.obj_type = object_type
+        self.columnar = columnar
         self._force_dates = force_dates
         self._input_encoding = input_encoding
         self._user_ctrl_row_number = control_row
+        self.mapping_plan = {}
+        self.field_table = None
+        self._date_cols_control_row = None
+        self._date_cols = []
+        #a ProcessStats to add the date normalization time to (see process())
+        self.stats = None
+        self._csv_stream = None
+        #the memory map of an Arrow file opened from a path (see close())
+        self._arrow_file = None
+        if csv_dialect is not None:
+            self._open_csv_stream(spreadsheet, csv_dialect)
+            return
+        signature = _read_signature(spreadsheet)
+        if pyarrow is not None and signature.startswith((PARQUET_SIGNATURE, ARROW_SIGNATURE)):
+            self._open_arrow_file(spreadsheet, signature)
+            return
+        if openpyxl is not None and signature.startswith(XLSX_SIGNATURE):
+            #stream .xlsx rows in read-only mode, instead of loading the whole workbook
+            self.book = openpyxl.load_workbook(spreadsheet, read_only=True, data_only=True)
+            self.dataset = self.book.worksheets[int(sheet)-1]
+            self.data_type = 'xlsx'
+            return
         try:
             try:
                 self.book = xlrd.open_workbook(spreadsheet)
@@ -67,33 +246,163 @@ class DataHandler:
             self.data_type = 'xlrd'
         except xlrd.XLRDError as xerr:
             #if it's not excel, try csv
+            self._csv_source = spreadsheet
             try:
-                with open(spreadsheet, 'rt', encoding=self._input_encoding) as csv_file:
-                    self._process_csv_file(csv_file)
-            except TypeError:
-                #got a file object, which might have been opened in binary format
-                spreadsheet.seek(0)
-                spreadsheet_bytes = spreadsheet.read()
-                spreadsheet_text = spreadsheet_bytes.decode(self._input_encoding)
-                spreadsheet_file = io.StringIO(spreadsheet_text)
-                self._process_csv_file(spreadsheet_file)
+                self._process_csv_file()
             except RuntimeError:
-                raise RuntimeError('Could not recognize file format - must be .xls, .xlsx, or .csv.')
+                raise RuntimeError('Could not recognize file format - must be .xls, .xlsx, .csv, Parquet or Arrow.')
+
+    def close(self):
+        '''Close the files kept open for reading: a read-only .xlsx workbook,
+        or the memory map of an Arrow file. (xlrd & CSV files aren't kept open.)'''
+        if self.data_type == 'xlsx':
+            self.book.close()
+        elif self._arrow_file is not None:
+            self._arrow_file.close()
+
+    def _open_arrow_file(self, spreadsheet, signature):
+        '''Open a Parquet or Arrow IPC file - Arrow files are memory-mapped, so
+        their record batches are read without copying.
+
+        The control row comes from the ARROW_CONTROL_ROW_KEY schema metadata,
+        as row 1 (followed by the data); without it, row 1 is the column names,
+        and the control row can be row 1 or the first row of data. Either way,
+        the control row is found like it is without a control_row - the one
+        asked for is ignored, since it can't match the layout of another format.'''
+        if isinstance(spreadsheet, str):
+            spreadsheet = self._arrow_file = pyarrow.memory_map(spreadsheet)
+        if signature.startswith(PARQUET_SIGNATURE):
+            self.dataset = pyarrow.parquet.ParquetFile(spreadsheet)
+            schema = self.dataset.schema_arrow
+        else:
+            self.dataset = pyarrow.ipc.open_file(spreadsheet)
+            schema = self.dataset.schema
+        metadata = schema.metadata or {}
+        if ARROW_CONTROL_ROW_KEY in metadata:
+            control_row = json.loads(metadata[ARROW_CONTROL_ROW_KEY].decode('utf8'))
+            if isinstance(control_row, dict):
+                control_row = [control_row.get(name, '') for name in schema.names]
+            self._arrow_header_rows = [control_row]
+        else:
+            self._arrow_header_rows = [list(schema.names)]
+        self.data_type = 'arrow'
+
+    def _iter_arrow_batches(self):
+        if isinstance(self.dataset, pyarrow.parquet.ParquetFile):
+            yield from self.dataset.iter_batches(batch_size=DATE_BATCH_SIZE)
+        else:
+            for i in range(self.dataset.num_record_batches):
+                yield self.dataset.get_batch(i)
+
+    def _iter_arrow_rows(self, index=0):
+        '''Generate the rows as lists (the header row, then the data), starting at the 0-based index.'''
+        for row in self._arrow_header_rows[index:]:
+            yield list(row)
+        skip = max(index - len(self._arrow_header_rows), 0)
+        for batch in self._iter_arrow_batches():
+            if skip >= batch.num_rows:
+                skip -= batch.num_rows
+                continue
+            if skip:
+                #slicing a batch doesn't copy it
+                batch = batch.slice(skip)
+                skip = 0
+            for row in zip(*[column.to_pylist() for column in batch.columns]):
+                yield list(row)
+
+    def _get_arrow_row(self, index):
+        rows = self._iter_arrow_rows(index)
+        try:
+            for row in rows:
+                return row
+        finally:
+            rows.close()
+        raise IndexError('list index out of range')
 
-    def _process_csv_file(self, csv_file):
+    def _open_csv_stream(self, spreadsheet, dialect):
+        '''Read the spreadsheet as CSV in dialect (a csv.Dialect, or the name of
+        one registered with the csv module - eg. 'excel', 'excel-tab' or 'unix').
+
+        A binary file object that can't seek (eg. stdin) is read as a stream:
+        the rows read before the data rows (for the control row) are kept, and
+        the data rows can only be read once.'''
+        if isinstance(dialect, str):
+            dialect = csv.get_dialect(dialect)
+        self._csv_source = spreadsheet
+        self._csv_dialect = dialect
+        self.data_type = 'csv'
+        if hasattr(spreadsheet, 'read') and not spreadsheet.seekable():
+            text = io.TextIOWrapper(spreadsheet, encoding=self._input_encoding, newline='')
+            self._csv_stream = (row for row in csv.reader(text, dialect) if len(row) > 0)
+            self._csv_head = []
+
+    def _check_csv_stream(self):
+        if self._csv_head is None:
+            raise RuntimeError('the CSV stream has already been read - it can only be read once')
+
+    def _open_csv_file(self):
+        '''Open the CSV data as text, positioned at the start of the file.
+
+        Returns the text file and whether we opened it (and should close it).'''
+        try:
+            return open(self._csv_source, 'rt', encoding=self._input_encoding), True
+        except TypeError:
+            #got a file object, which might have been opened in binary format
+            self._csv_source.seek(0)
+            return io.TextIOWrapper(self._csv_source, encoding=self._input_encoding, newline=''), False
+
+    def _close_csv_file(self, csv_file, opened):
+        if opened:
+            csv_file.close()
+        else:
+            #don't let the wrapper close the file object we were given
+            csv_file.detach()
+
+    def _process_csv_file(self):
         #read some test data to pass to sniffer for checking the dialect
-        data = csv_file.read(4096)
-        csv_file.seek(0)
+        csv_file, opened = self._open_csv_file()
+        try:
+            data = csv_file.read(4096)
+        finally:
+            self._close_csv_file(csv_file, opened)
         dialect = csv.Sniffer().sniff(data)
         #set doublequote to true because that's the default and the Sniffer doesn't
         #   seem to pick it up right
         dialect.doublequote = True
+        self._csv_dialect = dialect
         self.data_type = 'csv'
-        csv_reader = csv.reader(csv_file, dialect)
-        self.csvData = []
-        for row in csv_reader:
-            if len(row) > 0:
-                self.csvData.append(row)
+
+    def _iter_csv_rows(self):
+        '''Read the (non-empty) CSV rows on demand, from the top of the file.
+
+        The file is re-read for each pass, so the whole CSV never has to be in memory.'''
+        if self._csv_stream is not None:
+            self._check_csv_stream()
+            head, self._csv_head = self._csv_head, None
+            yield from head
+            yield from self._csv_stream
+            return
+        csv_file, opened = self._open_csv_file()
+        try:
+            for row in csv.reader(csv_file, self._csv_dialect):
+                if len(row) > 0:
+                    yield row
+        finally:
+            self._close_csv_file(csv_file, opened)
+
+    def _get_csv_row(self, index):
+        '''Get a CSV row by 0-based index (reads from the top, so only use it for the first rows).'''
+        if self._csv_stream is not None:
+            self._check_csv_stream()
+            self._csv_head.extend(itertools.islice(self._csv_stream, max(index + 1 - len(self._csv_head), 0)))
+            return list(self._csv_head[index])
+        rows = self._iter_csv_rows()
+        try:
+            for row in itertools.islice(rows, index, None):
+                return row
+        finally:
+            rows.close()
+        raise IndexError('list index out of range')
 
     def _get_cols_to_map(self, control_row_number):
         '''Get a dict of columns & values in dataset that should be mapped to XML
@@ -109,7 +418,8 @@ class DataHandler:
         return cols, ctrl_row
 
     def _parse_control_row(self):
-        if self._user_ctrl_row_number:
+        #a Parquet/Arrow file's control row is always found automatically (see _open_arrow_file)
+        if self._user_ctrl_row_number and self.data_type != 'arrow':
             cols_to_map, ctrl_row_values = self._get_cols_to_map(self._user_ctrl_row_number)
             if cols_to_map:
                 return self._user_ctrl_row_number, ctrl_row_values, cols_to_map
@@ -125,17 +435,30 @@ class DataHandler:
 
     def get_xml_records(self):
         '''skips rows without a group id or xml id'''
+        return list(self.iter_xml_records())
+
+    def iter_xml_records(self):
+        '''Generate XmlRecords one at a time, instead of building the whole list.
+
+        skips rows without a group id or xml id'''
         ctrl_row_number, control_row_values, cols_to_map = self._parse_control_row()
         group_id_col = self._get_column_index_from_id_names(['parent id', 'group id'], control_row_values)
         xml_id_col = self._get_column_index_from_id_names(['id', 'mods id', '<mods:mods id="">'], control_row_values)
         if group_id_col is None and xml_id_col is None:
             msg = 'no ID column (called "ID" or "MODS ID" or mapped as <mods:mods id="">) in control row'
             raise ControlRowError(msg)
-        xml_records = []
+        #parse each column's mapping once, instead of once for every cell
+        self.mapping_plan = self.get_mapping_plan(cols_to_map)
+        self.field_table = FieldTable(cols_to_map, self.mapping_plan)
         xml_ids = {}
         genus_col = self._get_column_index_from_id_names(['<dwc:genus>'], control_row_values)
+        if self.columnar:
+            rows = self._get_column_batch_rows(ctrl_row_number, control_row_values, cols_to_map)
+        else:
+            rows = ((data_row, None) for data_row in
+                    self._get_data_rows(ctrl_row_number=ctrl_row_number, control_row_values=control_row_values))
         index = ctrl_row_number
-        for data_row in self._get_data_rows(ctrl_row_number=ctrl_row_number, control_row_values=control_row_values):
+        for data_row, fields in rows:
             index += 1
             group_id = None
             xml_id = None
@@ -160,16 +483,39 @@ class DataHandler:
             #if we don't have group_id, generate it from xml_id
             if group_id is None:
                 group_id = xml_id.split(u'_')[0]
-            field_data = []
-            for i, val in enumerate(data_row):
-                if i in cols_to_map and len(val) > 0:
-                    field_data.append({'xml_path': cols_to_map[i], 'data': val})
+            if fields is None:
+                fields = [(i, val) for i, val in enumerate(data_row) if i in cols_to_map and len(val) > 0]
             if genus_col:
-                field_data = self._dwc_dynamic_fields(genus_col, data_row, field_data, control_row_values)
-            xml_records.append(XmlRecord(group_id, xml_id, field_data))
-        return xml_records
+                fields = self._dwc_dynamic_fields(genus_col, data_row, fields, control_row_values)
+            yield XmlRecord(group_id, xml_id, fields, self.field_table)
 
-    def _dwc_dynamic_fields(self, genus_col, data_row, field_data, control_row_values):
+    def find_duplicate_ids(self):
+        '''Go through all the records and find the IDs that would be used by more
+        than one record (ie. more than one output file).
+
+        Returns an (ordered) dict of xml_id -> number of records.'''
+        counts = collections.Counter()
+        for record in self.iter_xml_records():
+            counts[(record.xml_id, record.record_type)] += 1
+        duplicates = collections.OrderedDict()
+        for (xml_id, record_type), count in counts.items():
+            if count > 1:
+                duplicates[xml_id] = duplicates.get(xml_id, 0) + count
+        return duplicates
+
+    def get_mapping_plan(self, cols_to_map):
+        '''Compile the mapping for each column to map.
+
+        Returns a dict of column index -> ModsMappingParser, so the base element,
+        sections, and has_sectioned_data only get parsed once per sheet.
+        '''
+        return {i: ModsMappingParser(xml_path) for i, xml_path in cols_to_map.items()}
+
+    def _dwc_dynamic_field(self, xml_path, data):
+        #the generated dwc fields aren't in a column, so they're added to the end of the field table
+        return (self.field_table.get_index(xml_path), data)
+
+    def _dwc_dynamic_fields(self, genus_col, data_row, fields, control_row_values):
         #sets scientificNameAuthorship, acceptedNameUsage, infraspecificEpithet, and taxonRank
         species_col = self._get_column_index_from_id_names(['<dwc:specificEpithet>'], control_row_values)
         species_author_col = self._get_column_index_from_id_names(['dwc_species_author'], control_row_values)
@@ -196,19 +542,138 @@ class DataHandler:
                     scientific_name_authorship = data_row[subspecies_author_col]
         if infraspecific_epithet:
             accepted_name_usage = u'%s %s %s' % (accepted_name_usage, taxon_rank_abbr, infraspecific_epithet)
-            field_data.append({'xml_path': '<dwc:infraspecificEpithet>', 'data': infraspecific_epithet})
-            field_data.append({'xml_path': '<dwc:taxonRank>', 'data': taxon_rank})
+            fields.append(self._dwc_dynamic_field('<dwc:infraspecificEpithet>', infraspecific_epithet))
+            fields.append(self._dwc_dynamic_field('<dwc:taxonRank>', taxon_rank))
         accepted_name_usage = u'%s %s' % (accepted_name_usage, scientific_name_authorship)
         if scientific_name_authorship.strip():
-            field_data.append({'xml_path': '<dwc:scientificNameAuthorship>', 'data': scientific_name_authorship.strip()})
+            fields.append(self._dwc_dynamic_field('<dwc:scientificNameAuthorship>', scientific_name_authorship.strip()))
         if accepted_name_usage.strip():
-            field_data.append({'xml_path': '<dwc:acceptedNameUsage>', 'data': accepted_name_usage.strip()})
-        return field_data
+            fields.append(self._dwc_dynamic_field('<dwc:acceptedNameUsage>', accepted_name_usage.strip()))
+        return fields
 
     def _get_data_rows(self, ctrl_row_number, control_row_values):
-        '''data rows will be all the rows after the control row'''
-        for i in range(ctrl_row_number+1, self._get_total_rows()+1):
-            yield self.get_row(i, control_row_values=control_row_values)
+        '''data rows will be all the rows after the control row
+
+        The rows are read in batches, so each date column can be normalized
+        one batch at a time (only converting each distinct value once).'''
+        raw_rows = self._get_raw_data_rows(ctrl_row_number, len(control_row_values))
+        while True:
+            batch = list(itertools.islice(raw_rows, DATE_BATCH_SIZE))
+            if not batch:
+                break
+            yield from self._process_row_batch(batch, control_row_values)
+
+    def _process_row_batch(self, batch, control_row_values):
+        '''Process a list of (0-based index, raw row), normalizing the date columns for all of them at once.'''
+        date_cols = self._get_date_columns(control_row_values)
+        #a row that's too short gets the usual per-row handling (and error)
+        width = date_cols[-1] + 1 if date_cols else 0
+        if self.stats is not None:
+            start = time.perf_counter()
+        self._process_date_columns([row for index, row in batch if len(row) >= width], date_cols)
+        if self.stats is not None:
+            self.stats.add_time('dates', time.perf_counter() - start)
+        for index, row in batch:
+            if len(row) >= width:
+                yield self._process_row(row, index)
+            else:
+                yield self._process_row(row, index, control_row_values)
+
+    def _get_column_batch_rows(self, ctrl_row_number, control_row_values, cols_to_map):
+        '''Like _get_data_rows, but each batch of rows is turned into columns,
+        so the conversion to str, date normalization and dropping of empty
+        cells happen a column at a time. Only the columns with something in the
+        control row are converted - the others are left empty.
+
+        Generates (row, fields) - the row is a tuple of the converted values,
+        and fields the (column index, value) pairs of the row's non-empty
+        mapped cells.'''
+        columns_to_load = [i for i, v in enumerate(control_row_values) if v.strip()]
+        width = columns_to_load[-1] + 1 if columns_to_load else 0
+        date_cols = self._get_date_columns(control_row_values)
+        mapped_cols = sorted(cols_to_map)
+        raw_rows = self._get_raw_data_rows(ctrl_row_number, len(control_row_values))
+        while True:
+            batch = list(itertools.islice(raw_rows, DATE_BATCH_SIZE))
+            if not batch:
+                break
+            if min(len(row) for index, row in batch) < width:
+                #some rows are too short - give them the usual per-row handling (and errors)
+                for data_row in self._process_row_batch(batch, control_row_values):
+                    yield data_row, None
+                continue
+            columns = self._get_columns(batch, columns_to_load, width)
+            if self.stats is not None:
+                start = time.perf_counter()
+            for i in date_cols:
+                columns[i] = process_text_dates(columns[i], self._force_dates)
+            if self.stats is not None:
+                self.stats.add_time('dates', time.perf_counter() - start)
+            mapped_rows = zip(*[columns[i] for i in mapped_cols])
+            for data_row, values in zip(zip(*columns), mapped_rows):
+                #compress() drops the empty cells without a python-level test for each one
+                yield data_row, list(itertools.compress(zip(mapped_cols, values), values))
+
+    def _get_columns(self, batch, columns_to_load, width):
+        '''Transpose a batch of (0-based index, raw row) into a list of the
+        first width columns, converting the columns to load into str values.'''
+        raw_columns = list(zip(*[row for index, row in batch]))
+        if self.data_type == 'xlrd':
+            type_columns = list(zip(*[self.dataset.row_types(index, 0, width) for index, row in batch]))
+        empty_column = ('',) * len(batch)
+        columns = [empty_column] * width
+        for i in columns_to_load:
+            column = raw_columns[i]
+            if self.data_type == 'xlrd':
+                if not TEXT_CELL_TYPES.issuperset(type_columns[i]):
+                    column = self._process_xlrd_column(column, type_columns[i])
+            elif self.data_type in ('xlsx', 'arrow') and set(map(type, column)) != {str}:
+                #.xlsx & Arrow cells are converted one at a time, so a column can be processed like a row
+                column = self._process_row(list(column), None)
+            columns[i] = column
+        return columns
+
+    def _process_xlrd_column(self, values, cell_types):
+        '''Convert a column of xlrd values into str values, the same way as _process_row.'''
+        if TEXT_CELL_TYPES.issuperset(cell_types):
+            return values
+        column = []
+        for v, cell_type in zip(values, cell_types):
+            if isinstance(v, float):
+                if cell_type == xlrd.XL_CELL_NUMBER and v.is_integer():
+                    v = str(int(v))
+                elif cell_type == xlrd.XL_CELL_DATE:
+                    v = format_xldate(v, self.book.datemode)
+            if not isinstance(v, str):
+                v = str(v)
+            column.append(v)
+        return column
+
+    def _get_raw_data_rows(self, ctrl_row_number, width=0):
+        '''Generate (0-based index, unprocessed row) for the rows after the control row
+
+        .xlsx rows are padded to at least width (the width of the control row).'''
+        if self.data_type == 'csv':
+            #stream the CSV rows from the control row on, instead of indexing them
+            rows = self._iter_csv_rows()
+            for index, row in enumerate(itertools.islice(rows, ctrl_row_number, None), start=ctrl_row_number):
+                yield index, row
+        elif self.data_type == 'xlsx':
+            for index, row in enumerate(self._iter_xlsx_rows(ctrl_row_number, width), start=ctrl_row_number):
+                yield index, row
+        elif self.data_type == 'arrow':
+            for index, row in enumerate(self._iter_arrow_rows(ctrl_row_number), start=ctrl_row_number):
+                yield index, row
+        else:
+            for index in range(ctrl_row_number, self._get_total_rows()):
+                yield index, self.dataset.row_values(index)
+
+    def _process_date_columns(self, rows, date_cols):
+        '''Normalize the text dates in the date columns of a list of rows, in place.'''
+        for i in date_cols:
+            dates = process_text_dates([row[i] for row in rows], self._force_dates)
+            for row, date in zip(rows, dates):
+                row[i] = date
 
     def _get_column_index_from_id_names(self, id_names, control_row_values):
         '''Get a column index from set of strings - looking in the control row'''
@@ -221,21 +686,66 @@ class DataHandler:
 
     def get_row(self, index, control_row_values=None):
         '''Retrieve a list of str values (index is 1-based like excel)'''
-        #subtract 1 from index so that it's 0-based like xlrd and csvData list
+        #subtract 1 from index so that it's 0-based like xlrd and the CSV rows
         index = index - 1
         if self.data_type == 'xlrd':
             row = self.dataset.row_values(index)
-            #In a data column that's mapped to a date field, we could find a text
-            #   string that looks like a date - we might want to reformat 
-            #   that as well.
-            if control_row_values:
-                for i, v in enumerate(control_row_values):
-                    if 'date' in v.lower() and 'verbatim' not in v.lower():
-                        if isinstance(row[i], str):
-                            #we may have a text date, so see if we can understand it
-                            # *process_text_date will return a text value of the
-                            #   reformatted date if possible, else the original value
-                            row[i] = process_text_date(row[i], self._force_dates)
+        elif self.data_type == 'xlsx':
+            row = self._get_xlsx_row(index)
+        elif self.data_type == 'arrow':
+            row = self._get_arrow_row(index)
+        elif self.data_type == 'csv':
+            row = self._get_csv_row(index)
+        return self._process_row(row, index, control_row_values)
+
+    def _iter_xlsx_rows(self, index=0, width=0):
+        '''Stream the rows of the worksheet as lists, starting at the 0-based index.
+
+        Rows are padded to the width of the sheet, like xlrd rows - or to at
+        least width, since a sheet without a <dimension> element (which some
+        writers leave out) has no max_column.'''
+        width = max(self.dataset.max_column or 0, width)
+        for values in self.dataset.iter_rows(min_row=index+1, values_only=True):
+            row = list(values)
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+            yield row
+
+    def _get_xlsx_row(self, index):
+        rows = self._iter_xlsx_rows(index)
+        try:
+            for row in rows:
+                return row
+        finally:
+            rows.close()
+        raise IndexError('list index out of range')
+
+    def _get_date_columns(self, control_row_values):
+        '''Get the indexes of the columns mapped to a date (but not a verbatim date).
+
+        This only changes with the control row, so it's worked out once and reused
+        for every data row.'''
+        if control_row_values is not self._date_cols_control_row:
+            self._date_cols = [i for i, v in enumerate(control_row_values)
+                    if 'date' in v.lower() and 'verbatim' not in v.lower()]
+            self._date_cols_control_row = control_row_values
+        return self._date_cols
+
+    def _process_row(self, row, index, control_row_values=None):
+        '''Convert the raw values of a row (index is 0-based) into a list of str values'''
+        #In a data column that's mapped to a date field, we could find a text
+        #   string that looks like a date - we might want to reformat
+        #   that as well.
+        if control_row_values:
+            for i in self._get_date_columns(control_row_values):
+                if isinstance(row[i], str):
+                    #we may have a text date, so see if we can understand it
+                    # *process_text_date will return a text value of the
+                    #   reformatted date if possible, else the original value
+                    row[i] = process_text_date(row[i], self._force_dates)
+        if self.data_type == 'xlrd':
+            #get all the cell types for the row at once, instead of per cell
+            cell_types = self.dataset.row_types(index)
             for i, v in enumerate(row):
                 if isinstance(v, float):
                     #there are some interesting things that happen
@@ -243,7 +753,7 @@ class DataHandler:
                     # is actually stored as a float (and xlrd handles as a float).
                     #http://stackoverflow.com/questions/2739989/reading-numeric-excel-data-as-text-using-xlrd-in-python
                     #if cell is XL_CELL_NUMBER
-                    if self.dataset.cell_type(index, i) == 2 and int(v) == v:
+                    if cell_types[i] == xlrd.XL_CELL_NUMBER and v.is_integer():
                         #convert data into int & then str
                         #Note: if a number was displayed as xxxx.0 in Excel, we
                         #   would lose the .0 here
@@ -251,40 +761,34 @@ class DataHandler:
                     #Dates are also stored as floats in Excel, so we have to do
                     #   some extra processing to get a datetime object
                     #if we have an XL_CELL_DATE
-                    elif self.dataset.cell_type(index, i) == 3:
-                        #try to get an actual date out of it, instead of a float
-                        #Note: we are losing Excel formatting information here,
-                        #   and formatting the date as yyyy-mm-dd.
-                        tup = xlrd.xldate_as_tuple(v, self.book.datemode)
-                        d = datetime.datetime(*tup)
-                        if tup[0] == 0 and tup[1] == 0 and tup[2] == 0:
-                            #just time, no date
-                            row[i] = '{0:%H:%M:%S}'.format(d)
-                        elif tup[3] == 0 and tup[4] == 0 and tup[5] == 0:
-                            #just date, no time
-                            row[i] = '{0:%Y-%m-%d}'.format(d)
-                        else:
-                            #assume full date/time
-                            row[i] = '{0:%Y-%m-%d %H:%M:%S}'.format(d)
-        elif self.data_type == 'csv':
-            row = self.csvData[index]
-            if control_row_values:
-                for i, v in enumerate(control_row_values):
-                    if 'date' in v.lower() and 'verbatim' not in v.lower():
-                        if isinstance(row[i], str):
-                            #we may have a text date, so see if we can understand it
-                            # *process_text_date will return a text value of the
-                            #   reformatted date if possible, else the original value
-                            row[i] = process_text_date(row[i], self._force_dates)
+                    elif cell_types[i] == xlrd.XL_CELL_DATE:
+                        row[i] = format_xldate(v, self.book.datemode)
+        elif self.data_type in ('xlsx', 'arrow'):
+            #openpyxl & pyarrow give us python values - convert them the same way as the
+            #   xlrd cells above
+            for i, v in enumerate(row):
+                if v is None:
+                    row[i] = ''
+                elif isinstance(v, bool):
+                    #xlrd gives booleans as 1 or 0
+                    row[i] = str(int(v))
+                elif isinstance(v, float) and v.is_integer():
+                    row[i] = str(int(v))
+                elif isinstance(v, datetime.datetime):
+                    row[i] = format_datetime(v)
+                elif isinstance(v, datetime.time):
+                    row[i] = '{0:%H:%M:%S}'.format(v)
+                elif isinstance(v, datetime.date):
+                    row[i] = '{0:%Y-%m-%d}'.format(v)
         #this final loop should be unnecessary, but it's a final check to
         #   make sure everything is str.
         for i, v in enumerate(row):
             if not isinstance(v, str):
                 try:
                     row[i] = v.decode(self._input_encoding)
-                #if v isn't a string, we might get this error, so try without
-                #   the encoding
-                except TypeError:
+                #if v isn't a string, we might get one of these errors, so try
+                #   without the encoding
+                except (TypeError, AttributeError):
                     row[i] = str(v)
         return row
 
@@ -293,11 +797,78 @@ class DataHandler:
         total_rows = 0
         if self.data_type == 'xlrd':
             total_rows = self.dataset.nrows
+        elif self.data_type == 'xlsx':
+            total_rows = self.dataset.max_row or sum(1 for row in self._iter_xlsx_rows())
         elif self.data_type == 'csv':
-            total_rows = len(self.csvData)
+            total_rows = sum(1 for row in self._iter_csv_rows())
+        elif self.data_type == 'arrow':
+            if isinstance(self.dataset, pyarrow.parquet.ParquetFile):
+                data_rows = self.dataset.metadata.num_rows
+            else:
+                data_rows = sum(self.dataset.get_batch(i).num_rows for i in range(self.dataset.num_record_batches))
+            total_rows = len(self._arrow_header_rows) + data_rows
         return total_rows
 
 
+#Some date formats we could understand:
+#dd/dd/dddd, dd/dd/dd, d/d/dd, ... and dd-dd-dddd, dd-dd-dd, d-d-dd, ...
+DAY_MONTH_YEAR_RE = re.compile(r'^(\d?\d)([/-])(\d?\d)\2(\d\d|\d\d\d\d)$')
+#dd/dddd, d/dddd, dd-dddd, ...
+MONTH_YEAR_RE = re.compile(r'^(\d?\d)[/-](\d\d\d\d)$')
+#what strptime accepts for %m and %d
+MONTH_RE = re.compile(r'1[0-2]|0[1-9]|[1-9]')
+DAY_RE = re.compile(r'3[01]|[12]\d|0[1-9]|[1-9]')
+#number of data rows to read at a time, for normalizing the date columns
+DATE_BATCH_SIZE = 1000
+#number of distinct (date, force_dates) values to remember
+DATE_CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def format_xldate(xldate, datemode):
+    '''Format an Excel date (a float) as text.
+
+    The same date serial numbers show up over and over, so the results are cached
+    (per datemode, since that changes what the number means).'''
+    #try to get an actual date out of it, instead of a float
+    #Note: we are losing Excel formatting information here,
+    #   and formatting the date as yyyy-mm-dd.
+    tup = xlrd.xldate_as_tuple(xldate, datemode)
+    if tup[0] == 0 and tup[1] == 0 and tup[2] == 0:
+        #just time, no date (year 0 isn't a valid datetime)
+        return '{0:%H:%M:%S}'.format(datetime.time(*tup[3:]))
+    return format_datetime(datetime.datetime(*tup))
+
+
+def format_datetime(d):
+    '''Format a spreadsheet datetime as yyyy-mm-dd, with the time only if there is one.'''
+    if d.hour == 0 and d.minute == 0 and d.second == 0:
+        #just date, no time
+        return '{0:%Y-%m-%d}'.format(d)
+    else:
+        #assume full date/time
+        return '{0:%Y-%m-%d %H:%M:%S}'.format(d)
+
+
+def _get_date_parts(month, day, year):
+    '''Parse the text parts of a date the way strptime would (with %m, %d, and %y or %Y).
+
+    Returns (year, month, day) ints, or None if it's not a valid date.'''
+    if not (MONTH_RE.fullmatch(month) and DAY_RE.fullmatch(day)):
+        return None
+    month = int(month)
+    day = int(day)
+    if len(year) == 2:
+        #same century rule as strptime's %y
+        year = int(year)
+        year += 2000 if year <= 68 else 1900
+    else:
+        year = int(year)
+    if year < 1 or day > calendar.monthrange(year, month)[1]:
+        return None
+    return year, month, day
+
+
 def process_text_date(str_date, force_dates=False):
     '''Take a text-based date and try to reformat it to yyyy-mm-dd if needed.
         
@@ -308,82 +879,49 @@ def process_text_date(str_date, force_dates=False):
         return str_date
     if len(str_date) == 0:
         return str_date
-    #Some date formats we could understand:
-    #dd/dd/dddd, dd/dd/dd, d/d/dd, ...
-    mmddyy = re.compile('^\d?\d/\d?\d/\d\d$')
-    mmddyyyy = re.compile('^\d?\d/\d?\d/\d\d\d\d$')
-    mmyyyy = re.compile('^\d?\d/\d\d\d\d$')
-    #dd-dd-dddd, dd-dd-dd, d-d-dd, ...
-    mmddyy2 = re.compile('^\d?\d-\d?\d-\d\d$')
-    mmddyyyy2 = re.compile('^\d?\d-\d?\d-\d\d\d\d$')
-    mmyyyy2 = re.compile('^\d?\d-\d\d\d\d$')
-    format = '' #flag to remember which format we used
-    if mmddyy.search(str_date):
-        try:
-            #try mm/dd/yy first, since that should be more common in the US
-            newDate = datetime.datetime.strptime(str_date, '%m/%d/%y')
-            format = 'mmddyy'
-        except ValueError:
-            try:
-                newDate = datetime.datetime.strptime(str_date, '%d/%m/%y')
-                format = 'ddmmyy'
-            except ValueError:
-                return str_date
-    elif mmddyyyy.search(str_date):
-        try:
-            newDate = datetime.datetime.strptime(str_date, '%m/%d/%Y')
-            format = 'mmddyyyy'
-        except ValueError:
-            try:
-                newDate = datetime.datetime.strptime(str_date, '%d/%m/%Y')
-                format = 'ddmmyyyy'
-            except ValueError:
-                return str_date
-    elif mmyyyy.search(str_date):
-        month, year = str_date.split(u'/')
-        return u'%04d-%02d' % (int(year), int(month))
-    elif mmyyyy2.search(str_date):
-        month, year = str_date.split(u'-')
-        return u'%04d-%02d' % (int(year), int(month))
-    elif mmddyy2.search(str_date):
-        try:
-            #try mm-dd-yy first, since that should be more common
-            newDate = datetime.datetime.strptime(str_date, '%m-%d-%y')
-            format = 'mmddyy'
-        except ValueError:
-            try:
-                newDate = datetime.datetime.strptime(str_date, '%d-%m-%y')
-                format = 'ddmmyy'
-            except ValueError:
-                return str_date
-    elif mmddyyyy2.search(str_date):
-        try:
-            newDate = datetime.datetime.strptime(str_date, '%m-%d-%Y')
-            format = 'mmddyyyy'
-        except ValueError:
-            try:
-                newDate = datetime.datetime.strptime(str_date, '%d-%m-%Y')
-                format = 'ddmmyyyy'
-            except ValueError:
-                return str_date
-    else:
+    return _process_text_date(str_date, force_dates)
+
+
+def process_text_dates(str_dates, force_dates=False):
+    '''Like process_text_date, for a whole list of values (eg. a date column).
+
+    Each distinct value is only normalized once, and the results are put back in order.'''
+    unique_dates = {}
+    for str_date in set(str_dates):
+        if isinstance(str_date, str):
+            unique_dates[str_date] = process_text_date(str_date, force_dates)
+    return [unique_dates[str_date] if isinstance(str_date, str) else str_date for str_date in str_dates]
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _process_text_date(str_date, force_dates):
+    #date values repeat a lot in a collection, so the results are cached
+    match = MONTH_YEAR_RE.search(str_date)
+    if match:
+        return u'%04d-%02d' % (int(match.group(2)), int(match.group(1)))
+    match = DAY_MONTH_YEAR_RE.search(str_date)
+    #$ also matches before a trailing newline, but strptime wouldn't accept that
+    if not match or str_date.endswith(u'\n'):
         return str_date
-    #at this point, we have newDate, but it could still have been ambiguous
-    #day & month are both between 1 and 12 & not equal - ambiguous
-    if newDate.day <= 12 and newDate.day != newDate.month: 
-        if force_dates:
-            return u'%04d-%02d-%02d' % (newDate.year, newDate.month, newDate.day)
-        else:
+    first, separator, second, year = match.groups()
+    #try mm/dd/yy first, since that should be more common in the US
+    date_parts = _get_date_parts(first, second, year)
+    if date_parts is None:
+        date_parts = _get_date_parts(second, first, year)
+        if date_parts is None:
             return str_date
-    #year is only two digits - don't know the century, or if year was
+    year, month, day = date_parts
+    #at this point, we have the date, but it could still have been ambiguous
+    #day & month are both between 1 and 12 & not equal - ambiguous
+    #or year is only two digits - don't know the century, or if year was
     # interchanged with month or day
-    elif format == 'mmddyy' or format == 'ddmmyy':
+    if (day <= 12 and day != month) or len(match.group(4)) == 2:
         if force_dates:
-            return u'%04d-%02d-%02d' % (newDate.year, newDate.month, newDate.day)
+            return u'%04d-%02d-%02d' % (year, month, day)
         else:
             return str_date
     else:
-        return u'%04d-%02d-%02d' % (newDate.year, newDate.month, newDate.day)
+        return u'%04d-%02d-%02d' % (year, month, day)
 
 
 class Mapper(object):
@@ -406,15 +944,21 @@ class Mapper(object):
             else:
                 self._xml_obj = mods.make_mods()
         for field in field_data:
-            self.add_data(field['xml_path'], field['data'])
+            self.add_data(field['xml_path'], field['data'], mapping=field.get('mapping'))
 
     def get_xml(self):
         return self._xml_obj
 
-    def add_data(self, mods_loc, data):
-        '''Method to actually put the data in the correct place of XML obj.'''
+    def add_data(self, mods_loc, data, mapping=None):
+        '''Method to actually put the data in the correct place of XML obj.
+
+        mapping is an already-parsed ModsMappingParser for mods_loc (eg. from
+        DataHandler.mapping_plan) - if it's not passed in, mods_loc gets parsed here.'''
         #parse location info into elements/attributes
-        loc = ModsMappingParser(mods_loc)
+        if mapping is None:
+            loc = ModsMappingParser(mods_loc)
+        else:
+            loc = mapping
         base_element = loc.get_base_element()
         location_sections = loc.get_sections()
         #Darwin core can't have repeated fields like mods. Some fields are lists, so there can be multiple
@@ -430,247 +974,247 @@ class Mapper(object):
             self._process_mods_element(base_element, location_sections, data_vals)
 
     def _process_dwc_element(self, xml_obj, base_element, location_sections, data):
-        if base_element['element'] == u'dc:type':
-            xml_obj.type = data
-        elif base_element['element'] == u'dc:modified':
-            xml_obj.modified = data
-        elif base_element['element'] == u'dwc:catalogNumber':
-            xml_obj.catalog_number = data
-        elif base_element['element'] == u'dwc:basisOfRecord':
-            xml_obj.basis_of_record = data
-        elif base_element['element'] == u'dwc:recordedBy':
-            xml_obj.recorded_by = data
-        elif base_element['element'] == u'dwc:recordNumber':
-            xml_obj.record_number = data
-        elif base_element['element'] == u'dwc:individualID': #deprecated in DWC
-            xml_obj.individual_id = data
-        elif base_element['element'] == u'dwc:eventDate':
-            xml_obj.event_date = data
-        elif base_element['element'] == u'dwc:verbatimEventDate':
-            xml_obj.verbatim_event_date = data
-        elif base_element['element'] == u'dwc:scientificName':
-            xml_obj.scientific_name = data
-        elif base_element['element'] == u'dwc:higherClassification':
-            xml_obj.higher_classification = data
-        elif base_element['element'] == u'dwc:kingdom':
-            xml_obj.kingdom = data
-        elif base_element['element'] == u'dwc:phylum':
-            xml_obj.phylum = data
-        elif base_element['element'] == u'dwc:class':
-            xml_obj.class_ = data
-        elif base_element['element'] == u'dwc:order':
-            xml_obj.order = data
-        elif base_element['element'] == u'dwc:family':
-            xml_obj.family = data
-        elif base_element['element'] == u'dwc:genus':
-            xml_obj.genus = data
-        elif base_element['element'] == u'dwc:specificEpithet':
-            xml_obj.specific_epithet = data
-        elif base_element['element'] == u'dwc:scientificNameAuthorship':
-            xml_obj.scientific_name_authorship = data
-        elif base_element['element'] == u'dwc:infraspecificEpithet':
-            xml_obj.infraspecific_epithet = data
-        elif base_element['element'] == u'dwc:taxonRank':
-            xml_obj.taxon_rank = data
-        elif base_element['element'] == u'dwc:acceptedNameUsage':
-            xml_obj.accepted_name_usage = data
-        elif base_element['element'] == u'dwc:locality':
-            xml_obj.locality = data
-        elif base_element['element'] == u'dwc:municipality':
-            xml_obj.municipality = data
-        elif base_element['element'] == u'dwc:county':
-            xml_obj.county = data
-        elif base_element['element'] == u'dwc:stateProvince':
-            xml_obj.state_province = data
-        elif base_element['element'] == u'dwc:country':
-            xml_obj.country = data
-        elif base_element['element'] == u'dwc:habitat':
-            xml_obj.habitat = data
-        elif base_element['element'] == u'dwc:identificationID':
-            xml_obj.identification_id = data
-        else:
+        try:
+            attribute = self.dwc_elements[base_element['element']]
+        except KeyError:
             raise RuntimeError('unhandled DarwinCore element: %s' % base_element['element'])
+        setattr(xml_obj, attribute, data)
 
     def _process_mods_element(self, base_element, location_sections, data_vals):
         #handle various MODS elements
-        if base_element['element'] == u'mods:mods':
-            if 'ID' in base_element['attributes']:
-                self._xml_obj.id = data_vals[0][0]
-        elif base_element['element'] == u'mods:name':
-            if not self._cleared_fields.get(u'names', None):
-                self._xml_obj.names = []
-                self._cleared_fields[u'names'] = True
-            self._add_name_data(base_element, location_sections, data_vals)
-        elif base_element['element'] == u'mods:namePart':
-            #grab the last name that was added
-            name = self._xml_obj.names[-1]
-            np = mods.NamePart(text=data_vals[0][0])
-            if u'type' in base_element[u'attributes']:
-                np.type = base_element[u'attributes'][u'type']
-            name.name_parts.append(np)
-        elif base_element[u'element'] == u'mods:titleInfo':
-            if not self._cleared_fields.get(u'title_info_list', None):
-                self._xml_obj.title_info_list = []
-                self._cleared_fields[u'title_info_list'] = True
-            self._add_title_data(base_element, location_sections, data_vals)
-        elif base_element[u'element'] == u'mods:language':
-            if not self._cleared_fields.get(u'languages', None):
-                self._xml_obj.languages = []
-                self._cleared_fields[u'languages'] = True
-            for data in data_vals:
-                language = mods.Language()
-                language_term = mods.LanguageTerm(text=data[0])
-                if u'authority' in location_sections[0][0]['attributes']:
-                    language_term.authority = location_sections[0][0]['attributes']['authority']
-                if u'type' in location_sections[0][0]['attributes']:
-                    language_term.type = location_sections[0][0][u'attributes'][u'type']
-                language.terms.append(language_term)
-                self._xml_obj.languages.append(language)
-        elif base_element[u'element'] == u'mods:genre':
-            if not self._cleared_fields.get(u'genres', None):
-                self._xml_obj.genres = []
-                self._cleared_fields[u'genres'] = True
-            for data in data_vals:
-                genre = mods.Genre(text=data[0])
-                if 'authority' in base_element['attributes']:
-                    genre.authority = base_element['attributes']['authority']
-                self._xml_obj.genres.append(genre)
-        elif base_element['element'] == 'mods:originInfo':
-            if not self._cleared_fields.get(u'origin_info', None):
-                self._xml_obj.origin_info = None
-                self._cleared_fields[u'origin_info'] = True
-                self._xml_obj.create_origin_info()
-            self._add_origin_info_data(base_element, location_sections, data_vals)
-        elif base_element['element'] == 'mods:physicalDescription':
-            if not self._cleared_fields.get(u'physical_description', None):
-                self._xml_obj.physical_description = None
-                self._cleared_fields[u'physical_description'] = True
-                #can only have one physical description currently
-                self._xml_obj.create_physical_description()
-            data_divs = data_vals[0]
-            for index, section in enumerate(location_sections):
-                if section[0][u'element'] == 'mods:extent':
-                    self._xml_obj.physical_description.extent = data_divs[index]
-                elif section[0][u'element'] == 'mods:digitalOrigin':
-                    try:
-                        self._xml_obj.physical_description.digital_origin = data_divs[index]
-                    except:
-                        self._xml_obj.physical_description.digital_origin = section[0][u'data']
-                elif section[0][u'element'] == 'mods:note':
-                    self._xml_obj.physical_description.note = data_divs[index]
-        elif base_element['element'] == 'mods:typeOfResource':
-            if not self._cleared_fields.get(u'typeOfResource', None):
-                self._xml_obj.resource_type = None
-                self._cleared_fields[u'typeOfResource'] = True
-            self._xml_obj.resource_type = data_vals[0][0]
-        elif base_element['element'] == 'mods:targetAudience':
-            if not self._cleared_fields.get(u'targetAudience', None):
-                self._xml_obj.resource_type = None
-                self._cleared_fields[u'targetAudience'] = True
-            ta = mods.TargetAudience(text=data_vals[0][0])
-            self._xml_obj.target_audiences.append(ta)
-        elif base_element['element'] == 'mods:abstract':
-            if not self._cleared_fields.get(u'abstract', None):
-                self._xml_obj.abstract = None
-                self._cleared_fields[u'abstract'] = True
-                #can only have one abstract currently
-                self._xml_obj.create_abstract()
-            self._xml_obj.abstract.text = data_vals[0][0]
-        elif base_element['element'] == 'mods:note':
-            if not self._cleared_fields.get(u'notes', None):
-                self._xml_obj.notes = []
-                self._cleared_fields[u'notes'] = True
-            for data in data_vals:
-                note = mods.Note(text=data[0])
-                if 'type' in base_element['attributes']:
-                    note.type = base_element['attributes']['type']
-                if 'displayLabel' in base_element['attributes']:
-                    note.label = base_element['attributes']['displayLabel']
-                self._xml_obj.notes.append(note)
-        elif base_element['element'] == 'mods:subject':
-            if not self._cleared_fields.get(u'subjects', None):
-                self._xml_obj.subjects = []
-                self._cleared_fields[u'subjects'] = True
-            for data in data_vals:
-                subject = mods.Subject()
-                if 'authority' in base_element['attributes']:
-                    subject.authority = base_element['attributes']['authority']
-                data_divs = data
-                for section, div in zip(location_sections, data_divs):
-                    if section[0]['element'] == 'mods:topic':
-                        topic = mods.Topic(text=div)
-                        subject.topic_list.append(topic)
-                    elif section[0]['element'] == 'mods:temporal':
-                        temporal = mods.Temporal(text=div)
-                        subject.temporal_list.append(temporal)
-                    elif section[0]['element'] == 'mods:geographic':
-                        subject.geographic = div
-                    elif section[0]['element'] == 'mods:hierarchicalGeographic':
-                        hg = mods.HierarchicalGeographic()
-                        if section[1]['element'] == 'mods:country':
-                            if 'data' in section[1]:
-                                hg.country = section[1]['data']
-                                if section[2]['element'] == 'mods:state':
-                                    hg.state = div
-                            else:
-                                hg.country = div
-                        subject.hierarchical_geographic = hg
-                self._xml_obj.subjects.append(subject)
-        elif base_element['element'] == 'mods:identifier':
-            if not self._cleared_fields.get(u'identifiers', None):
-                self._xml_obj.identifiers = []
-                self._cleared_fields[u'identifiers'] = True
-            for data in data_vals:
-                identifier = mods.Identifier(text=data[0])
-                if 'type' in base_element['attributes']:
-                    identifier.type = base_element['attributes']['type']
-                if 'displayLabel' in base_element['attributes']:
-                    identifier.label = base_element['attributes']['displayLabel']
-                self._xml_obj.identifiers.append(identifier)
-        elif base_element['element'] == u'mods:location':
-            if not self._cleared_fields.get(u'locations', None):
-                self._xml_obj.locations = []
-                self._cleared_fields[u'locations'] = True
-            for data in data_vals:
-                loc = mods.Location()
-                data_divs = data
-                for section, div in zip(location_sections, data_divs):
-                    if section[0]['element'] == u'mods:url':
-                        if section[0]['data']:
-                            loc.url = section[0]['data']
-                        else:
-                            loc.url = div
-                    elif section[0]['element'] == u'mods:physicalLocation':
-                        if section[0]['data']:
-                            loc.physical = mods.PhysicalLocation(text=section[0]['data'])
-                        else:
-                            loc.physical = mods.PhysicalLocation(text=div)
-                    elif section[0]['element'] == u'mods:holdingSimple':
-                        hs = mods.HoldingSimple()
-                        if section[1]['element'] == u'mods:copyInformation':
-                            if section[2]['element'] == u'mods:note':
-                                note = mods.Note(text=div)
-                                ci = mods.CopyInformation()
-                                ci.notes.append(note)
-                                hs.copy_information.append(ci)
-                                loc.holding_simple = hs
-                self._xml_obj.locations.append(loc)
-        elif base_element['element'] == u'mods:relatedItem':
-            if not self._cleared_fields.get(u'related', None):
-                self._xml_obj.related_items = []
-                self._cleared_fields[u'related'] = True
-            for data in data_vals:
-                related_item = mods.RelatedItem()
-                if u'type' in base_element[u'attributes']:
-                    related_item.type = base_element[u'attributes'][u'type']
-                if u'displayLabel' in base_element[u'attributes']:
-                    related_item.label = base_element[u'attributes'][u'displayLabel']
-                if location_sections[0][0][u'element'] == u'mods:titleInfo':
-                    if location_sections[0][1][u'element'] == u'mods:title':
-                        related_item.title = data[0]
-                self._xml_obj.related_items.append(related_item)
-        else:
+        try:
+            handler = self.mods_element_handlers[base_element['element']]
+        except KeyError:
             raise RuntimeError('unhandled MODS element: %s' % base_element)
+        self._bind_handler(handler)(base_element, location_sections, data_vals)
+
+    def _bind_handler(self, handler):
+        '''Bind a registered handler to this mapper - the built-in ones are
+        registered by method name, so a subclass can override them.'''
+        if isinstance(handler, str):
+            return getattr(self, handler)
+        return functools.partial(handler, self)
+
+    @classmethod
+    def register_dwc_element(cls, element, attribute):
+        '''Map a DarwinCore element (eg. u'dwc:eventDate') to the SimpleDarwinRecord attribute it sets.'''
+        cls._own_registry('dwc_elements')[element] = attribute
+
+    @classmethod
+    def register_mods_element(cls, element, handler):
+        '''Register a handler for a MODS base element (eg. u'mods:note').
+
+        handler is called as handler(mapper, base_element, location_sections, data_vals),
+        or it's the name of a mapper method, called with the same arguments.'''
+        cls._own_registry('mods_element_handlers')[element] = handler
+
+    @classmethod
+    def register_origin_info_element(cls, element, handler):
+        '''Register a handler for a mods:originInfo sub-element (eg. u'mods:dateIssued').
+
+        handler is called as handler(mapper, section, data), or it's the name
+        of a mapper method, called with the same arguments.'''
+        cls._own_registry('origin_info_handlers')[element] = handler
+
+    @classmethod
+    def _own_registry(cls, name):
+        #copy the registry the first time a subclass registers something, so
+        #   it doesn't change the registry of Mapper itself
+        if name not in cls.__dict__:
+            setattr(cls, name, dict(getattr(cls, name)))
+        return getattr(cls, name)
+
+    def _add_mods_id(self, base_element, location_sections, data_vals):
+        if 'ID' in base_element['attributes']:
+            self._xml_obj.id = data_vals[0][0]
+
+    def _add_name(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'names', None):
+            self._xml_obj.names = []
+            self._cleared_fields[u'names'] = True
+        self._add_name_data(base_element, location_sections, data_vals)
+
+    def _add_name_part(self, base_element, location_sections, data_vals):
+        #grab the last name that was added
+        name = self._xml_obj.names[-1]
+        np = mods.NamePart(text=data_vals[0][0])
+        if u'type' in base_element[u'attributes']:
+            np.type = base_element[u'attributes'][u'type']
+        name.name_parts.append(np)
+
+    def _add_title_info(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'title_info_list', None):
+            self._xml_obj.title_info_list = []
+            self._cleared_fields[u'title_info_list'] = True
+        self._add_title_data(base_element, location_sections, data_vals)
+
+    def _add_language(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'languages', None):
+            self._xml_obj.languages = []
+            self._cleared_fields[u'languages'] = True
+        for data in data_vals:
+            language = mods.Language()
+            language_term = mods.LanguageTerm(text=data[0])
+            if u'authority' in location_sections[0][0]['attributes']:
+                language_term.authority = location_sections[0][0]['attributes']['authority']
+            if u'type' in location_sections[0][0]['attributes']:
+                language_term.type = location_sections[0][0][u'attributes'][u'type']
+            language.terms.append(language_term)
+            self._xml_obj.languages.append(language)
+
+    def _add_genre(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'genres', None):
+            self._xml_obj.genres = []
+            self._cleared_fields[u'genres'] = True
+        for data in data_vals:
+            genre = mods.Genre(text=data[0])
+            if 'authority' in base_element['attributes']:
+                genre.authority = base_element['attributes']['authority']
+            self._xml_obj.genres.append(genre)
+
+    def _add_origin_info(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'origin_info', None):
+            self._xml_obj.origin_info = None
+            self._cleared_fields[u'origin_info'] = True
+            self._xml_obj.create_origin_info()
+        self._add_origin_info_data(base_element, location_sections, data_vals)
+
+    def _add_physical_description(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'physical_description', None):
+            self._xml_obj.physical_description = None
+            self._cleared_fields[u'physical_description'] = True
+            #can only have one physical description currently
+            self._xml_obj.create_physical_description()
+        data_divs = data_vals[0]
+        for index, section in enumerate(location_sections):
+            if section[0][u'element'] == 'mods:extent':
+                self._xml_obj.physical_description.extent = data_divs[index]
+            elif section[0][u'element'] == 'mods:digitalOrigin':
+                try:
+                    self._xml_obj.physical_description.digital_origin = data_divs[index]
+                except:
+                    self._xml_obj.physical_description.digital_origin = section[0][u'data']
+            elif section[0][u'element'] == 'mods:note':
+                self._xml_obj.physical_description.note = data_divs[index]
+
+    def _add_type_of_resource(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'typeOfResource', None):
+            self._xml_obj.resource_type = None
+            self._cleared_fields[u'typeOfResource'] = True
+        self._xml_obj.resource_type = data_vals[0][0]
+
+    def _add_target_audience(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'targetAudience', None):
+            self._xml_obj.resource_type = None
+            self._cleared_fields[u'targetAudience'] = True
+        ta = mods.TargetAudience(text=data_vals[0][0])
+        self._xml_obj.target_audiences.append(ta)
+
+    def _add_abstract(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'abstract', None):
+            self._xml_obj.abstract = None
+            self._cleared_fields[u'abstract'] = True
+            #can only have one abstract currently
+            self._xml_obj.create_abstract()
+        self._xml_obj.abstract.text = data_vals[0][0]
+
+    def _add_note(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'notes', None):
+            self._xml_obj.notes = []
+            self._cleared_fields[u'notes'] = True
+        for data in data_vals:
+            note = mods.Note(text=data[0])
+            if 'type' in base_element['attributes']:
+                note.type = base_element['attributes']['type']
+            if 'displayLabel' in base_element['attributes']:
+                note.label = base_element['attributes']['displayLabel']
+            self._xml_obj.notes.append(note)
+
+    def _add_subject(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'subjects', None):
+            self._xml_obj.subjects = []
+            self._cleared_fields[u'subjects'] = True
+        for data in data_vals:
+            subject = mods.Subject()
+            if 'authority' in base_element['attributes']:
+                subject.authority = base_element['attributes']['authority']
+            data_divs = data
+            for section, div in zip(location_sections, data_divs):
+                if section[0]['element'] == 'mods:topic':
+                    topic = mods.Topic(text=div)
+                    subject.topic_list.append(topic)
+                elif section[0]['element'] == 'mods:temporal':
+                    temporal = mods.Temporal(text=div)
+                    subject.temporal_list.append(temporal)
+                elif section[0]['element'] == 'mods:geographic':
+                    subject.geographic = div
+                elif section[0]['element'] == 'mods:hierarchicalGeographic':
+                    hg = mods.HierarchicalGeographic()
+                    if section[1]['element'] == 'mods:country':
+                        if 'data' in section[1]:
+                            hg.country = section[1]['data']
+                            if section[2]['element'] == 'mods:state':
+                                hg.state = div
+                        else:
+                            hg.country = div
+                    subject.hierarchical_geographic = hg
+            self._xml_obj.subjects.append(subject)
+
+    def _add_identifier(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'identifiers', None):
+            self._xml_obj.identifiers = []
+            self._cleared_fields[u'identifiers'] = True
+        for data in data_vals:
+            identifier = mods.Identifier(text=data[0])
+            if 'type' in base_element['attributes']:
+                identifier.type = base_element['attributes']['type']
+            if 'displayLabel' in base_element['attributes']:
+                identifier.label = base_element['attributes']['displayLabel']
+            self._xml_obj.identifiers.append(identifier)
+
+    def _add_location(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'locations', None):
+            self._xml_obj.locations = []
+            self._cleared_fields[u'locations'] = True
+        for data in data_vals:
+            loc = mods.Location()
+            data_divs = data
+            for section, div in zip(location_sections, data_divs):
+                if section[0]['element'] == u'mods:url':
+                    if section[0]['data']:
+                        loc.url = section[0]['data']
+                    else:
+                        loc.url = div
+                elif section[0]['element'] == u'mods:physicalLocation':
+                    if section[0]['data']:
+                        loc.physical = mods.PhysicalLocation(text=section[0]['data'])
+                    else:
+                        loc.physical = mods.PhysicalLocation(text=div)
+                elif section[0]['element'] == u'mods:holdingSimple':
+                    hs = mods.HoldingSimple()
+                    if section[1]['element'] == u'mods:copyInformation':
+                        if section[2]['element'] == u'mods:note':
+                            note = mods.Note(text=div)
+                            ci = mods.CopyInformation()
+                            ci.notes.append(note)
+                            hs.copy_information.append(ci)
+                            loc.holding_simple = hs
+            self._xml_obj.locations.append(loc)
+
+    def _add_related_item(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'related', None):
+            self._xml_obj.related_items = []
+            self._cleared_fields[u'related'] = True
+        for data in data_vals:
+            related_item = mods.RelatedItem()
+            if u'type' in base_element[u'attributes']:
+                related_item.type = base_element[u'attributes'][u'type']
+            if u'displayLabel' in base_element[u'attributes']:
+                related_item.label = base_element[u'attributes'][u'displayLabel']
+            if location_sections[0][0][u'element'] == u'mods:titleInfo':
+                if location_sections[0][1][u'element'] == u'mods:title':
+                    related_item.title = data[0]
+            self._xml_obj.related_items.append(related_item)
 
     def _add_title_data(self, base_element, location_sections, data_vals):
         for data_divs in data_vals:
@@ -764,43 +1308,20 @@ class Mapper(object):
             for index, section in enumerate(location_sections):
                 if not divs[index]:
                     continue
-                if section[0][u'element'] == u'mods:dateCreated':
-                    date = mods.DateCreated(date=divs[index])
-                    date = self._set_date_attributes(date, section[0][u'attributes'])
-                    self._xml_obj.origin_info.created.append(date)
-                elif section[0][u'element'] == u'mods:dateIssued':
-                    date = mods.DateIssued(date=divs[index])
-                    date = self._set_date_attributes(date, section[0][u'attributes'])
-                    self._xml_obj.origin_info.issued.append(date)
-                elif section[0][u'element'] == u'mods:dateCaptured':
-                    date = mods.DateCaptured(date=divs[index])
-                    date = self._set_date_attributes(date, section[0][u'attributes'])
-                    self._xml_obj.origin_info.captured.append(date)
-                elif section[0][u'element'] == u'mods:dateValid':
-                    date = mods.DateValid(date=divs[index])
-                    date = self._set_date_attributes(date, section[0][u'attributes'])
-                    self._xml_obj.origin_info.valid.append(date)
-                elif section[0][u'element'] == u'mods:dateModified':
-                    date = mods.DateModified(date=divs[index])
-                    date = self._set_date_attributes(date, section[0][u'attributes'])
-                    self._xml_obj.origin_info.modified.append(date)
-                elif section[0][u'element'] == u'mods:copyrightDate':
-                    date = mods.CopyrightDate(date=divs[index])
-                    date = self._set_date_attributes(date, section[0][u'attributes'])
-                    self._xml_obj.origin_info.copyright.append(date)
-                elif section[0][u'element'] == u'mods:dateOther':
-                    date = mods.DateOther(date=divs[index])
-                    date = self._set_date_attributes(date, section[0][u'attributes'])
-                    self._xml_obj.origin_info.other.append(date)
-                elif section[0][u'element'] == u'mods:place':
-                    place = mods.Place()
-                    placeTerm = mods.PlaceTerm(text=divs[index])
-                    place.place_terms.append(placeTerm)
-                    self._xml_obj.origin_info.places.append(place)
-                elif section[0][u'element'] == u'mods:publisher':
-                    self._xml_obj.origin_info.publisher = divs[index]
-                else:
+                try:
+                    handler = self.origin_info_handlers[section[0][u'element']]
+                except KeyError:
                     raise RuntimeError('unhandled originInfo element: %s' % section)
+                self._bind_handler(handler)(section, divs[index])
+
+    def _add_origin_info_place(self, section, data):
+        place = mods.Place()
+        placeTerm = mods.PlaceTerm(text=data)
+        place.place_terms.append(placeTerm)
+        self._xml_obj.origin_info.places.append(place)
+
+    def _add_origin_info_publisher(self, section, data):
+        self._xml_obj.origin_info.publisher = data
 
     def _set_date_attributes(self, date, attributes):
         if u'encoding' in attributes:
@@ -812,6 +1333,82 @@ class Mapper(object):
         return date
 
 
+def _origin_info_date_handler(date_class, list_name):
+    '''Make an originInfo handler that adds a date_class date to the list_name list.'''
+    def add_date(mapper, section, data):
+        date = date_class(date=data)
+        date = mapper._set_date_attributes(date, section[0][u'attributes'])
+        getattr(mapper._xml_obj.origin_info, list_name).append(date)
+    return add_date
+
+
+#DarwinCore element -> SimpleDarwinRecord attribute
+Mapper.dwc_elements = {
+    u'dc:type': 'type',
+    u'dc:modified': 'modified',
+    u'dwc:catalogNumber': 'catalog_number',
+    u'dwc:basisOfRecord': 'basis_of_record',
+    u'dwc:recordedBy': 'recorded_by',
+    u'dwc:recordNumber': 'record_number',
+    u'dwc:individualID': 'individual_id', #deprecated in DWC
+    u'dwc:eventDate': 'event_date',
+    u'dwc:verbatimEventDate': 'verbatim_event_date',
+    u'dwc:scientificName': 'scientific_name',
+    u'dwc:higherClassification': 'higher_classification',
+    u'dwc:kingdom': 'kingdom',
+    u'dwc:phylum': 'phylum',
+    u'dwc:class': 'class_',
+    u'dwc:order': 'order',
+    u'dwc:family': 'family',
+    u'dwc:genus': 'genus',
+    u'dwc:specificEpithet': 'specific_epithet',
+    u'dwc:scientificNameAuthorship': 'scientific_name_authorship',
+    u'dwc:infraspecificEpithet': 'infraspecific_epithet',
+    u'dwc:taxonRank': 'taxon_rank',
+    u'dwc:acceptedNameUsage': 'accepted_name_usage',
+    u'dwc:locality': 'locality',
+    u'dwc:municipality': 'municipality',
+    u'dwc:county': 'county',
+    u'dwc:stateProvince': 'state_province',
+    u'dwc:country': 'country',
+    u'dwc:habitat': 'habitat',
+    u'dwc:identificationID': 'identification_id',
+}
+
+#MODS base element -> handler(mapper, base_element, location_sections, data_vals), or the name of a method
+Mapper.mods_element_handlers = {
+    u'mods:mods': '_add_mods_id',
+    u'mods:name': '_add_name',
+    u'mods:namePart': '_add_name_part',
+    u'mods:titleInfo': '_add_title_info',
+    u'mods:language': '_add_language',
+    u'mods:genre': '_add_genre',
+    u'mods:originInfo': '_add_origin_info',
+    u'mods:physicalDescription': '_add_physical_description',
+    u'mods:typeOfResource': '_add_type_of_resource',
+    u'mods:targetAudience': '_add_target_audience',
+    u'mods:abstract': '_add_abstract',
+    u'mods:note': '_add_note',
+    u'mods:subject': '_add_subject',
+    u'mods:identifier': '_add_identifier',
+    u'mods:location': '_add_location',
+    u'mods:relatedItem': '_add_related_item',
+}
+
+#mods:originInfo sub-element -> handler(mapper, section, data), or the name of a method
+Mapper.origin_info_handlers = {
+    u'mods:dateCreated': _origin_info_date_handler(mods.DateCreated, 'created'),
+    u'mods:dateIssued': _origin_info_date_handler(mods.DateIssued, 'issued'),
+    u'mods:dateCaptured': _origin_info_date_handler(mods.DateCaptured, 'captured'),
+    u'mods:dateValid': _origin_info_date_handler(mods.DateValid, 'valid'),
+    u'mods:dateModified': _origin_info_date_handler(mods.DateModified, 'modified'),
+    u'mods:copyrightDate': _origin_info_date_handler(mods.CopyrightDate, 'copyright'),
+    u'mods:dateOther': _origin_info_date_handler(mods.DateOther, 'other'),
+    u'mods:place': '_add_origin_info_place',
+    u'mods:publisher': '_add_origin_info_publisher',
+}
+
+
 class ModsMappingParser:
     '''class for parsing dataset location instructions (for various XML formats).
     eg. <mods:name type="personal"><mods:namePart>#<mods:namePart type="date">#<mods:namePart type="termsOfAddress">'''
@@ -926,31 +1523,1346 @@ class ModsMappingParser:
         return attributes
 
 
+def _last_child_index(parent, tag):
+    '''Index of the last child of parent with this tag, or None.'''
+    for index in range(len(parent) - 1, -1, -1):
+        if parent[index].tag == tag:
+            return index
+    return None
+
+
+def _append_child(parent, tag):
+    '''Add a child element like an eulxml NodeListField append does: right
+    after the last existing child with the same tag, or at the end.'''
+    index = _last_child_index(parent, tag)
+    if index is None:
+        return etree.SubElement(parent, tag)
+    child = parent.makeelement(tag)
+    parent.insert(index + 1, child)
+    return child
+
+
+def _get_or_create_child(parent, tag):
+    '''First child with this tag (like an eulxml NodeField/StringField),
+    added at the end if there isn't one yet.'''
+    child = parent.find(tag)
+    if child is None:
+        child = etree.SubElement(parent, tag)
+    return child
+
+
+def _set_child_text(parent, tag, text):
+    '''Set the text of a child element like an eulxml StringField: None
+    removes the (first) child.'''
+    if text is None:
+        _remove_child(parent, tag)
+    else:
+        _get_or_create_child(parent, tag).text = text
+
+
+def _remove_child(parent, tag):
+    child = parent.find(tag)
+    if child is not None:
+        parent.remove(child)
+
+
+def _mods_tag(name):
+    #u'mods:note' -> u'{http://www.loc.gov/mods/v3}note'
+    return u'{%s}%s' % (mods.MODS_NAMESPACE, name.split(u':', 1)[1])
+
+
+NAME_TAG = _mods_tag(u'mods:name')
+NAME_PART_TAG = _mods_tag(u'mods:namePart')
+ROLE_TAG = _mods_tag(u'mods:role')
+ROLE_TERM_TAG = _mods_tag(u'mods:roleTerm')
+TITLE_INFO_TAG = _mods_tag(u'mods:titleInfo')
+ORIGIN_INFO_TAG = _mods_tag(u'mods:originInfo')
+PHYSICAL_DESCRIPTION_TAG = _mods_tag(u'mods:physicalDescription')
+TYPE_OF_RESOURCE_TAG = _mods_tag(u'mods:typeOfResource')
+ABSTRACT_TAG = _mods_tag(u'mods:abstract')
+
+
+class LxmlMapper(Mapper):
+    '''Build the same XML as Mapper, but with plain lxml elements instead of
+    eulxml objects (which are most of the cost of mapping a record).
+
+    The output of serializeDocument() is byte-for-byte the same as Mapper's,
+    so the handlers here follow the eulxml rules for where new elements go.
+    Anything without an lxml handler raises UnsupportedByLxml - see
+    build_record(), which falls back to Mapper for those records.
+    Handlers are registered the same way as for Mapper, but in LxmlMapper's
+    own registries.'''
+
+    _templates = {}
+
+    def __init__(self, record_type, field_data, parent_mods=None):
+        if parent_mods is not None:
+            raise UnsupportedByLxml('LxmlMapper can\'t add data to a parent record')
+        self.dataSeparator = u'||'
+        self._cleared_fields = {}
+        self._record_type = record_type
+        self._root = copy.deepcopy(self._get_template(record_type))
+        if record_type == 'dwc':
+            self._record = self._root[0]
+        for field in field_data:
+            self.add_data(field['xml_path'], field['data'], mapping=field.get('mapping'))
+
+    @classmethod
+    def _get_template(cls, record_type):
+        #the empty document Mapper starts from, built by bdrxml once
+        if record_type not in cls._templates:
+            if record_type == 'dwc':
+                xml_obj = darwincore.make_simple_darwin_record_set()
+                xml_obj.create_simple_darwin_record()
+            else:
+                xml_obj = mods.make_mods()
+            cls._templates[record_type] = xml_obj.node
+        return cls._templates[record_type]
+
+    def get_xml(self):
+        return self._root
+
+    def serializeDocument(self, pretty=False):
+        return etree.tostring(self._root.getroottree(), encoding='UTF-8', pretty_print=pretty,
+                xml_declaration=True)
+
+    def add_data(self, mods_loc, data, mapping=None):
+        if mapping is None:
+            loc = ModsMappingParser(mods_loc)
+        else:
+            loc = mapping
+        base_element = loc.get_base_element()
+        location_sections = loc.get_sections()
+        if self._record_type == 'dwc':
+            self._process_dwc_element(self._record, base_element, location_sections, data.replace(u'||', u'|'))
+        else:
+            data_vals = [data.strip() for data in data.split(self.dataSeparator)]
+            data_vals = [self._get_data_divs(data, loc.has_sectioned_data) for data in data_vals if data]
+            self._process_mods_element(base_element, location_sections, data_vals)
+
+    def _process_dwc_element(self, record, base_element, location_sections, data):
+        try:
+            attribute = self.dwc_elements[base_element['element']]
+        except KeyError:
+            raise UnsupportedByLxml('unhandled DarwinCore element: %s' % base_element['element'])
+        field = darwincore.SimpleDarwinRecord._fields.get(attribute)
+        if field is None:
+            #Mapper just sets a python attribute in this case, which doesn't change the XML
+            return
+        prefix, name = field.xpath.split(u':')
+        namespace = darwincore.SimpleDarwinRecordSet.ROOT_NAMESPACES[prefix]
+        _set_child_text(record, u'{%s}%s' % (namespace, name), data)
+
+    def _process_mods_element(self, base_element, location_sections, data_vals):
+        try:
+            handler = self.mods_element_handlers[base_element['element']]
+        except KeyError:
+            raise UnsupportedByLxml('no lxml handler for MODS element: %s' % base_element)
+        self._bind_handler(handler)(base_element, location_sections, data_vals)
+
+    def _clear(self, name, tag):
+        #a list field is emptied the first time a record sets it (there's never
+        #   anything in it yet for a new record, but keep the same behavior)
+        if not self._cleared_fields.get(name, None):
+            for child in self._root.findall(tag):
+                self._root.remove(child)
+            self._cleared_fields[name] = True
+
+    def _add_list_element(self, base_element, data_vals, name, text_attributes):
+        tag = _mods_tag(base_element['element'])
+        self._clear(name, tag)
+        for data in data_vals:
+            element = _append_child(self._root, tag)
+            element.text = data[0]
+            for attribute in text_attributes:
+                if attribute in base_element['attributes']:
+                    element.set(attribute, base_element['attributes'][attribute])
+
+    def _add_mods_id(self, base_element, location_sections, data_vals):
+        if 'ID' in base_element['attributes']:
+            self._root.set('ID', data_vals[0][0])
+
+    def _add_name(self, base_element, location_sections, data_vals):
+        self._clear(u'names', NAME_TAG)
+        self._add_name_data(base_element, location_sections, data_vals)
+
+    def _add_name_part(self, base_element, location_sections, data_vals):
+        name = self._root.findall(NAME_TAG)[-1]
+        np = _append_child(name, NAME_PART_TAG)
+        np.text = data_vals[0][0]
+        if u'type' in base_element[u'attributes']:
+            np.set(u'type', base_element[u'attributes'][u'type'])
+
+    def _add_title_info(self, base_element, location_sections, data_vals):
+        self._clear(u'title_info_list', TITLE_INFO_TAG)
+        self._add_title_data(base_element, location_sections, data_vals)
+
+    def _add_language(self, base_element, location_sections, data_vals):
+        tag = _mods_tag(u'mods:language')
+        self._clear(u'languages', tag)
+        attributes = location_sections[0][0]['attributes']
+        for data in data_vals:
+            language = _append_child(self._root, tag)
+            language_term = _append_child(language, _mods_tag(u'mods:languageTerm'))
+            language_term.text = data[0]
+            if u'authority' in attributes:
+                language_term.set(u'authority', attributes['authority'])
+            if u'type' in attributes:
+                language_term.set(u'type', attributes[u'type'])
+
+    def _add_genre(self, base_element, location_sections, data_vals):
+        self._add_list_element(base_element, data_vals, u'genres', ['authority'])
+
+    def _add_origin_info(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'origin_info', None):
+            _remove_child(self._root, ORIGIN_INFO_TAG)
+            self._cleared_fields[u'origin_info'] = True
+            etree.SubElement(self._root, ORIGIN_INFO_TAG)
+        self._add_origin_info_data(base_element, location_sections, data_vals)
+
+    def _add_physical_description(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'physical_description', None):
+            _remove_child(self._root, PHYSICAL_DESCRIPTION_TAG)
+            self._cleared_fields[u'physical_description'] = True
+            etree.SubElement(self._root, PHYSICAL_DESCRIPTION_TAG)
+        physical_description = self._root.find(PHYSICAL_DESCRIPTION_TAG)
+        data_divs = data_vals[0]
+        for index, section in enumerate(location_sections):
+            if section[0][u'element'] == 'mods:extent':
+                _set_child_text(physical_description, _mods_tag(u'mods:extent'), data_divs[index])
+            elif section[0][u'element'] == 'mods:digitalOrigin':
+                try:
+                    text = data_divs[index]
+                except:
+                    text = section[0][u'data']
+                _set_child_text(physical_description, _mods_tag(u'mods:digitalOrigin'), text)
+            elif section[0][u'element'] == 'mods:note':
+                _set_child_text(physical_description, _mods_tag(u'mods:note'), data_divs[index])
+
+    def _add_type_of_resource(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'typeOfResource', None):
+            _remove_child(self._root, TYPE_OF_RESOURCE_TAG)
+            self._cleared_fields[u'typeOfResource'] = True
+        _set_child_text(self._root, TYPE_OF_RESOURCE_TAG, data_vals[0][0])
+
+    def _add_target_audience(self, base_element, location_sections, data_vals):
+        #Mapper clears typeOfResource here, not targetAudience
+        if not self._cleared_fields.get(u'targetAudience', None):
+            _remove_child(self._root, TYPE_OF_RESOURCE_TAG)
+            self._cleared_fields[u'targetAudience'] = True
+        _append_child(self._root, _mods_tag(u'mods:targetAudience')).text = data_vals[0][0]
+
+    def _add_abstract(self, base_element, location_sections, data_vals):
+        if not self._cleared_fields.get(u'abstract', None):
+            _remove_child(self._root, ABSTRACT_TAG)
+            self._cleared_fields[u'abstract'] = True
+            etree.SubElement(self._root, ABSTRACT_TAG)
+        self._root.find(ABSTRACT_TAG).text = data_vals[0][0]
+
+    def _add_note(self, base_element, location_sections, data_vals):
+        self._add_list_element(base_element, data_vals, u'notes', ['type', 'displayLabel'])
+
+    def _add_subject(self, base_element, location_sections, data_vals):
+        tag = _mods_tag(u'mods:subject')
+        self._clear(u'subjects', tag)
+        for data in data_vals:
+            subject = _append_child(self._root, tag)
+            if 'authority' in base_element['attributes']:
+                subject.set('authority', base_element['attributes']['authority'])
+            for section, div in zip(location_sections, data):
+                if section[0]['element'] == 'mods:topic':
+                    _append_child(subject, _mods_tag(u'mods:topic')).text = div
+                elif section[0]['element'] == 'mods:temporal':
+                    _append_child(subject, _mods_tag(u'mods:temporal')).text = div
+                elif section[0]['element'] == 'mods:geographic':
+                    _set_child_text(subject, _mods_tag(u'mods:geographic'), div)
+                elif section[0]['element'] == 'mods:hierarchicalGeographic':
+                    #setting the NodeField replaces the contents of any existing element
+                    hg = _get_or_create_child(subject, _mods_tag(u'mods:hierarchicalGeographic'))
+                    hg.clear()
+                    if section[1]['element'] == 'mods:country':
+                        if 'data' in section[1]:
+                            _set_child_text(hg, _mods_tag(u'mods:country'), section[1]['data'])
+                            if section[2]['element'] == 'mods:state':
+                                _set_child_text(hg, _mods_tag(u'mods:state'), div)
+                        else:
+                            _set_child_text(hg, _mods_tag(u'mods:country'), div)
+
+    def _add_identifier(self, base_element, location_sections, data_vals):
+        self._add_list_element(base_element, data_vals, u'identifiers', ['type', 'displayLabel'])
+
+    def _add_location(self, base_element, location_sections, data_vals):
+        tag = _mods_tag(u'mods:location')
+        self._clear(u'locations', tag)
+        for data in data_vals:
+            loc = _append_child(self._root, tag)
+            for section, div in zip(location_sections, data):
+                if section[0]['element'] == u'mods:url':
+                    _set_child_text(loc, _mods_tag(u'mods:url'), section[0]['data'] or div)
+                elif section[0]['element'] == u'mods:physicalLocation':
+                    physical = _get_or_create_child(loc, _mods_tag(u'mods:physicalLocation'))
+                    physical.clear()
+                    physical.text = section[0]['data'] or div
+                elif section[0]['element'] == u'mods:holdingSimple':
+                    if section[1]['element'] == u'mods:copyInformation':
+                        if section[2]['element'] == u'mods:note':
+                            hs = _get_or_create_child(loc, _mods_tag(u'mods:holdingSimple'))
+                            hs.clear()
+                            ci = etree.SubElement(hs, _mods_tag(u'mods:copyInformation'))
+                            etree.SubElement(ci, _mods_tag(u'mods:note')).text = div
+
+    def _add_related_item(self, base_element, location_sections, data_vals):
+        tag = _mods_tag(u'mods:relatedItem')
+        self._clear(u'related', tag)
+        for data in data_vals:
+            related_item = _append_child(self._root, tag)
+            for attribute in [u'type', u'displayLabel']:
+                if attribute in base_element[u'attributes']:
+                    related_item.set(attribute, base_element[u'attributes'][attribute])
+            if location_sections[0][0][u'element'] == u'mods:titleInfo':
+                if location_sections[0][1][u'element'] == u'mods:title':
+                    title_info = _get_or_create_child(related_item, TITLE_INFO_TAG)
+                    _set_child_text(title_info, _mods_tag(u'mods:title'), data[0])
+
+    def _add_title_data(self, base_element, location_sections, data_vals):
+        for data_divs in data_vals:
+            title = _append_child(self._root, TITLE_INFO_TAG)
+            for attribute in [u'type', u'displayLabel']:
+                if attribute in base_element['attributes']:
+                    title.set(attribute, base_element['attributes'][attribute])
+            for section, div in zip(location_sections, data_divs):
+                for element in section:
+                    if element[u'element'] in (u'mods:title', u'mods:partName', u'mods:partNumber', u'mods:nonSort'):
+                        _set_child_text(title, _mods_tag(element[u'element']), div)
+
+    def _add_name_data(self, base_element, location_sections, data_vals):
+        for data in data_vals:
+            name = _append_child(self._root, NAME_TAG)
+            if u'type' in base_element[u'attributes']:
+                name.set(u'type', base_element[u'attributes'][u'type'])
+            data_divs = data
+            for index, section in enumerate(location_sections):
+                try:
+                    div = data_divs[index].strip()
+                except:
+                    div = None
+                if not div and section[0][u'element'] != u'mods:role':
+                    continue
+                for element in section:
+                    if element['element'] == u'mods:namePart':
+                        np = _append_child(name, NAME_PART_TAG)
+                        np.text = div
+                        if u'type' in element[u'attributes']:
+                            np.set(u'type', element[u'attributes'][u'type'])
+                    elif element['element'] == u'mods:roleTerm':
+                        role_attrs = element['attributes']
+                        text = element[u'data'] or div
+                        if not text:
+                            continue
+                        role = _append_child(name, ROLE_TAG)
+                        role_term = etree.SubElement(role, ROLE_TERM_TAG)
+                        role_term.text = text
+                        if u'type' in role_attrs:
+                            role_term.set(u'type', role_attrs['type'])
+                        if u'authority' in role_attrs:
+                            role_term.set(u'authority', role_attrs[u'authority'])
+
+    def _add_origin_info_data(self, base_element, location_sections, data_vals):
+        if u'displayLabel' in base_element['attributes']:
+            self._root.find(ORIGIN_INFO_TAG).set(u'displayLabel', base_element[u'attributes'][u'displayLabel'])
+        for data in data_vals:
+            divs = data
+            for index, section in enumerate(location_sections):
+                if not divs[index]:
+                    continue
+                try:
+                    handler = self.origin_info_handlers[section[0][u'element']]
+                except KeyError:
+                    raise UnsupportedByLxml('no lxml handler for originInfo element: %s' % section)
+                self._bind_handler(handler)(section, divs[index])
+
+    def _add_origin_info_place(self, section, data):
+        place = _append_child(self._root.find(ORIGIN_INFO_TAG), _mods_tag(u'mods:place'))
+        etree.SubElement(place, _mods_tag(u'mods:placeTerm')).text = data
+
+    def _add_origin_info_publisher(self, section, data):
+        _set_child_text(self._root.find(ORIGIN_INFO_TAG), _mods_tag(u'mods:publisher'), data)
+
+    def _add_origin_info_date(self, section, data):
+        date = _append_child(self._root.find(ORIGIN_INFO_TAG), _mods_tag(section[0][u'element']))
+        date.text = data
+        attributes = section[0][u'attributes']
+        if u'encoding' in attributes:
+            date.set(u'encoding', attributes[u'encoding'])
+        if u'point' in attributes:
+            date.set(u'point', attributes[u'point'])
+        #keyDate is a boolean field in eulxml - any value turns into "yes"
+        if attributes.get(u'keyDate'):
+            date.set(u'keyDate', u'yes')
+
+
+LxmlMapper.mods_element_handlers = {
+    u'mods:mods': '_add_mods_id',
+    u'mods:name': '_add_name',
+    u'mods:namePart': '_add_name_part',
+    u'mods:titleInfo': '_add_title_info',
+    u'mods:language': '_add_language',
+    u'mods:genre': '_add_genre',
+    u'mods:originInfo': '_add_origin_info',
+    u'mods:physicalDescription': '_add_physical_description',
+    u'mods:typeOfResource': '_add_type_of_resource',
+    u'mods:targetAudience': '_add_target_audience',
+    u'mods:abstract': '_add_abstract',
+    u'mods:note': '_add_note',
+    u'mods:subject': '_add_subject',
+    u'mods:identifier': '_add_identifier',
+    u'mods:location': '_add_location',
+    u'mods:relatedItem': '_add_related_item',
+}
+
+LxmlMapper.origin_info_handlers = {
+    u'mods:dateCreated': '_add_origin_info_date',
+    u'mods:dateIssued': '_add_origin_info_date',
+    u'mods:dateCaptured': '_add_origin_info_date',
+    u'mods:dateValid': '_add_origin_info_date',
+    u'mods:dateModified': '_add_origin_info_date',
+    u'mods:copyrightDate': '_add_origin_info_date',
+    u'mods:dateOther': '_add_origin_info_date',
+    u'mods:place': '_add_origin_info_place',
+    u'mods:publisher': '_add_origin_info_publisher',
+}
+
+
+#the ways a record can be turned into XML - see render_record()
+RENDERERS = ('eulxml', 'lxml')
+
+
+def build_record(record, renderer='eulxml', stats=None):
+    '''Map a record, and return the root lxml element of its XML document.
+
+    The lxml renderer builds the same XML as the default eulxml one, but
+    faster; records it can't handle are built by Mapper instead.
+    If stats (a ProcessStats) is passed, the time spent on each element is added to it.'''
+    if renderer == 'lxml':
+        #time the elements separately, so a record that falls back to Mapper isn't counted twice
+        lxml_stats = ProcessStats() if stats is not None else None
+        try:
+            node = _map_record(LxmlMapper, record, lxml_stats).get_xml()
+        except UnsupportedByLxml:
+            #Mapper handles anything LxmlMapper doesn't
+            pass
+        else:
+            if stats is not None:
+                stats.merge(lxml_stats)
+            return node
+    return _map_record(Mapper, record, stats).get_xml().node
+
+
+def _map_record(mapper_class, record, stats=None, parent_mods=None):
+    '''Map a record with mapper_class - one field at a time with timing, if there are stats.'''
+    if stats is None:
+        return mapper_class(record.record_type, record.field_data(), parent_mods=parent_mods)
+    mapper = mapper_class(record.record_type, [], parent_mods=parent_mods)
+    for xml_path, data, mapping in record.fields():
+        start = time.perf_counter()
+        mapper.add_data(xml_path, data, mapping=mapping)
+        stats.add_element_time(mapping.get_base_element()['element'], time.perf_counter() - start)
+    return mapper
+
+
+def serialize_document(node):
+    '''Serialize the whole document of node as UTF-8 XML bytes, the same
+    way as eulxml's serializeDocument(pretty=True).'''
+    return etree.tostring(node.getroottree(), encoding='UTF-8', pretty_print=True, xml_declaration=True)
+
+
+def render_record(record, renderer='eulxml'):
+    '''Map a record and serialize it as UTF-8 XML bytes.'''
+    return serialize_document(build_record(record, renderer))
+
+
+def _check_record(record, node, validate):
+    '''With validate, the schema errors for a MODS record (an empty list if
+    it's valid, or if it isn't MODS).'''
+    if validate and record.record_type == 'mods':
+        schema = get_mods_schema()
+        if schema.validate(node):
+            return []
+        #a tree built in memory has no line numbers - report the errors in the document as it'd be written
+        return _schema_errors(schema, etree.fromstring(serialize_document(node)))
+    return []
+
+
+def _render_records(records, renderer='eulxml', validate=False, profile=False):
+    '''Render a chunk of records in a worker process.
+
+    Stops at the first error and returns it in place of that record's bytes,
+    so the records before it can still be written in order. None entries
+    (records that don't need rebuilding) get None back, and with validate,
+    invalid records get their list of schema errors.
+    Returns (results, ProcessStats for the chunk if profile is set, or None).'''
+    results = []
+    stats = ProcessStats() if profile else None
+    for record in records:
+        if record is None:
+            #unchanged since the last run - nothing to render
+            results.append(None)
+            continue
+        try:
+            if stats is not None:
+                stats.start()
+            node = build_record(record, renderer, stats)
+            if stats is not None:
+                stats.lap('map')
+            errors = _check_record(record, node, validate)
+            if stats is not None:
+                stats.lap('validate')
+            results.append(errors or serialize_document(node))
+            if stats is not None:
+                stats.lap('serialize')
+        except Exception as e:
+            results.append(e)
+            break
+    return results, stats
+
+
+def _iter_record_chunks(records, chunk_size):
+    '''Group records into lists, yielding (chunk, error) - if reading the
+    records fails, the error is yielded with the records read before it.'''
+    chunk = []
+    try:
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == chunk_size:
+                yield chunk, None
+                chunk = []
+    except Exception as e:
+        yield chunk, e
+        return
+    if chunk:
+        yield chunk, None
+
+
+class ProcessStats:
+    '''Timers & counters for a process() run - pass one in as process(stats=...).
+
+    times has the seconds spent in each of STAGES: 'read' is opening the
+    spreadsheet & reading its rows, apart from 'dates' (normalizing the date
+    columns); 'map' is building the XML (broken down by base element in
+    element_times & element_counts); with background writing, 'write' is
+    the time spent waiting for the writer threads. With workers, 'map', 'validate' &
+    'serialize' are added up across the worker processes, so they can add up
+    to more than total_time.'''
+
+    STAGES = ('read', 'dates', 'map', 'validate', 'serialize', 'write')
+
+    def __init__(self):
+        self.times = dict.fromkeys(self.STAGES, 0.0)
+        self.total_time = 0.0
+        self.records = 0
+        self.cells = 0
+        self.unchanged = 0
+        self.invalid = 0
+        self.written = 0
+        self.bytes_written = 0
+        self.element_times = collections.defaultdict(float)
+        self.element_counts = collections.Counter()
+        self._lap_start = None
+
+    def start(self):
+        '''Start timing the next lap().'''
+        self._lap_start = time.perf_counter()
+
+    def lap(self, stage):
+        '''Add the time since the last lap (or start()) to stage.'''
+        now = time.perf_counter()
+        self.times[stage] += now - self._lap_start
+        self._lap_start = now
+
+    def add_time(self, stage, seconds):
+        self.times[stage] += seconds
+
+    def add_element_time(self, element, seconds):
+        self.element_times[element] += seconds
+        self.element_counts[element] += 1
+
+    def merge(self, other):
+        '''Add the stage & element times of other (eg. from a worker process).'''
+        for stage, seconds in other.times.items():
+            self.times[stage] += seconds
+        for element, seconds in other.element_times.items():
+            self.element_times[element] += seconds
+        self.element_counts.update(other.element_counts)
+
+    def to_dict(self):
+        return {
+            'total_time': self.total_time,
+            'times': dict(self.times),
+            'records': self.records,
+            'cells': self.cells,
+            'unchanged': self.unchanged,
+            'invalid': self.invalid,
+            'written': self.written,
+            'bytes_written': self.bytes_written,
+            'elements': dict((element, {'time': self.element_times[element], 'count': count})
+                    for element, count in self.element_counts.items()),
+        }
+
+    def save(self, path):
+        '''Write the stats to a JSON file.'''
+        with open(path, 'wt', encoding='utf8') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+
+class Manifest:
+    '''Hashes of the records written by a run, for incremental regeneration.
+
+    The manifest is a JSON file mapping each output filename (<xml_id>.<type>.xml)
+    to a hash of the record's mapping & data and the generator version. Records
+    whose hash hasn't changed since the last run (and whose file is still there)
+    don't need to be rebuilt.'''
+
+    def __init__(self, path, xml_files_dir, copy_parent_to_children=False):
+        self.path = path
+        self.xml_files_dir = xml_files_dir
+        self._copy_parent_to_children = copy_parent_to_children
+        self.previous_records = {}
+        if os.path.exists(path):
+            with open(path, 'rt', encoding='utf8') as f:
+                self.previous_records = json.load(f)['records']
+        self.records = {}
+
+    def record_hash(self, record):
+        fields = [[xml_path, data] for xml_path, data, mapping in record.fields()]
+        parent_hash = None
+        if self._copy_parent_to_children:
+            #a child has to be rebuilt if its parent changed
+            parent_hash = self.records.get(_get_filename(record.group_id, record.record_type))
+        data = [__version__, record.record_type, parent_hash, fields]
+        return hashlib.sha256(json.dumps(data, ensure_ascii=False).encode('utf8')).hexdigest()
+
+    def is_unchanged(self, record):
+        '''Add the record to the manifest, and check whether it's the same as last time.'''
+        filename = _get_filename(record.xml_id, record.record_type)
+        record_hash = self.record_hash(record)
+        self.records[filename] = record_hash
+        return (self.previous_records.get(filename) == record_hash
+                and os.path.exists(os.path.join(self.xml_files_dir, filename)))
+
+    def invalidate(self, record):
+        '''Make sure the record is rebuilt next time (eg. it wasn't written).'''
+        self.records[_get_filename(record.xml_id, record.record_type)] = None
+
+    def delete_vanished(self):
+        '''Delete the files of records that were in the last run, but not this one.'''
+        deleted = []
+        for filename in self.previous_records:
+            if filename not in self.records:
+                full_path = os.path.join(self.xml_files_dir, filename)
+                if os.path.exists(full_path):
+                    os.remove(full_path)
+                    deleted.append(filename)
+        return deleted
+
+    def save(self):
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'wt', encoding='utf8') as f:
+            json.dump({'generator_version': __version__, 'records': self.records}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def get_shard(group_id, shard_count):
+    '''The shard (0 to shard_count - 1) that a group's records go in.
+
+    This is a hash of the group_id, so it's the same on every node (unlike
+    hash()), and a parent & its children always go in the same shard.'''
+    digest = hashlib.sha256(group_id.encode('utf8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+def parse_shard(spec):
+    '''Parse an INDEX/COUNT shard spec (eg. 0/4 for the first of 4 shards) into (index, count).'''
+    try:
+        index, count = [int(part) for part in spec.split('/')]
+    except ValueError:
+        raise ValueError('shard must be INDEX/COUNT, eg. 0/4: %s' % spec)
+    if not 0 <= index < count:
+        raise ValueError('shard index must be from 0 to %s: %s' % (count - 1, spec))
+    return index, count
+
+
+class ShardManifest:
+    '''The records in one shard of a run that's split across several nodes
+    (see process(shard=...)).
+
+    Each node saves its shard manifest, and merge_shard_manifests() checks
+    that all the shards are there, and that no xml_id was used in more than
+    one of them.'''
+
+    def __init__(self, index, count):
+        if not 0 <= index < count:
+            raise ValueError('shard index must be from 0 to %s: %s' % (count - 1, index))
+        self.index = index
+        self.count = count
+        #[file, xml_id, group_id] for each record in the shard
+        self.records = []
+
+    def filter(self, records):
+        '''Generate the records that are in this shard, noting each one.'''
+        for record in records:
+            if get_shard(record.group_id, self.count) == self.index:
+                self.records.append([_get_filename(record.xml_id, record.record_type), record.xml_id, record.group_id])
+                yield record
+
+    def save(self, path, invalid=()):
+        '''Write the shard manifest - invalid is the list of invalid records that weren't written.'''
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'wt', encoding='utf8') as f:
+            json.dump({
+                'generator_version': __version__,
+                'shard': self.index,
+                'shard_count': self.count,
+                'records': self.records,
+                'invalid': [record['file'] for record in invalid],
+            }, f, indent=1)
+        os.replace(tmp_path, path)
+
+
+def merge_shard_manifests(paths):
+    '''Check the shard manifests of a run against each other.
+
+    Returns a dict of the shard_count, the number of records, the
+    missing_shards (a list of indexes), and the duplicates: each xml_id
+    (as its filename) that's in more than one record, with the list of
+    shards it's in.'''
+    shards = {}
+    shard_counts = set()
+    files = collections.defaultdict(list)
+    for path in paths:
+        with open(path, 'rt', encoding='utf8') as f:
+            manifest = json.load(f)
+        shard_counts.add(manifest['shard_count'])
+        if manifest['shard'] in shards:
+            raise DataError('shard %s is in both %s and %s' % (manifest['shard'], shards[manifest['shard']], path))
+        shards[manifest['shard']] = path
+        for filename, xml_id, group_id in manifest['records']:
+            files[filename].append(manifest['shard'])
+    if len(shard_counts) > 1:
+        raise DataError('the manifests are from runs with different shard counts: %s' % sorted(shard_counts))
+    shard_count = shard_counts.pop() if shard_counts else 0
+    return {
+        'shard_count': shard_count,
+        'records': sum(len(in_shards) for in_shards in files.values()),
+        'missing_shards': [index for index in range(shard_count) if index not in shards],
+        'duplicates': dict((filename, in_shards) for filename, in_shards in files.items() if len(in_shards) > 1),
+    }
+
+
+class ParentCache:
+    '''LRU cache of parsed parent records, for copy_parent_to_children.
+
+    Parents are looked up by group_id: first in memory (parents written
+    earlier in the run are added with add()), then in xml_files_dir. A group
+    without a parent is cached as well (as None), so xml_files_dir is only
+    checked once for it. get() hands out a copy, so each child can change its own.'''
+
+    def __init__(self, xml_files_dir, max_size=PARENT_CACHE_SIZE):
+        self.xml_files_dir = xml_files_dir
+        self.max_size = max_size
+        self._parents = collections.OrderedDict()
+
+    def __contains__(self, group_id):
+        '''Whether group_id has been looked up (or added) - it may not have a parent.'''
+        return group_id in self._parents
+
+    def get(self, group_id):
+        '''A copy of the parent Mods for group_id, or None if there isn't one.'''
+        try:
+            parent = self._parents[group_id]
+            self._parents.move_to_end(group_id)
+        except KeyError:
+            parent_filename = os.path.join(self.xml_files_dir, _get_filename(group_id, 'mods'))
+            parent = None
+            if os.path.exists(parent_filename):
+                parent = load_xmlobject_from_file(parent_filename, mods.Mods)
+            #a parent written later in the run replaces the None
+            self.add(group_id, parent)
+        if parent is None:
+            return None
+        return mods.Mods(copy.deepcopy(parent.node))
+
+    def add(self, group_id, parent):
+        '''Cache parent (a Mods object that won't change anymore) for group_id.'''
+        self._parents[group_id] = parent
+        self._parents.move_to_end(group_id)
+        while len(self._parents) > self.max_size:
+            self._parents.popitem(last=False)
+
+
+class DirectoryWriter:
+    '''Write each record to its own file in a directory.
+
+    fsync is one of FSYNC_POLICIES - with 'file' or 'close', the directory is
+    fsynced as well when the writer is closed. write() can be called from
+    several threads at once (see BackgroundWriter).'''
+
+    def __init__(self, xml_files_dir, fsync='none'):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('unknown fsync policy: %s' % fsync)
+        #make sure we have a directory to put the mods files in
+        os.makedirs(xml_files_dir, exist_ok=True)
+        self.xml_files_dir = xml_files_dir
+        self.fsync = fsync
+        self._unsynced = []
+
+    def write(self, filename, xml_bytes):
+        path = os.path.join(self.xml_files_dir, filename)
+        with open(path, 'wb') as f:
+            f.write(xml_bytes)
+            if self.fsync == 'file':
+                f.flush()
+                os.fsync(f.fileno())
+        if self.fsync == 'close':
+            self._unsynced.append(path)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.fsync == 'close':
+            for path in self._unsynced:
+                _fsync_path(path)
+            self._unsynced = []
+        if self.fsync != 'none' and hasattr(os, 'O_DIRECTORY'):
+            #make the new directory entries durable too
+            _fsync_path(self.xml_files_dir, os.O_DIRECTORY)
+
+
+def _fsync_path(path, flags=0):
+    fd = os.open(path, os.O_RDONLY | flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BackgroundWriter:
+    '''Hand the writes to another writer off to a pool of threads, so slow
+    disk (or NFS) writes overlap with mapping & serializing the next records.
+
+    At most max_pending writes wait in the queue - write() blocks until the
+    oldest one is done when it's full. A failed write raises its error from a
+    later write(), or from flush() or close(). Writes finish in the order
+    they were made if there's one thread (which archive writers need).'''
+
+    def __init__(self, writer, threads=WRITER_THREADS, max_pending=WRITER_QUEUE_SIZE):
+        self._writer = writer
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self._pending = collections.deque()
+        self.max_pending = max_pending
+
+    def write(self, filename, xml_bytes):
+        #collect the finished writes (raising any errors), & wait for the oldest if the queue is full
+        while self._pending and (self._pending[0].done() or len(self._pending) >= self.max_pending):
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(self._writer.write, filename, xml_bytes))
+
+    def flush(self):
+        '''Wait for all the queued writes to be done.'''
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown()
+            self._writer.close()
+
+
+class ZipArchiveWriter:
+    '''Stream all the records into one zip file.'''
+
+    def __init__(self, path, compress=False):
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self._zip_file = zipfile.ZipFile(path, 'w', compression=compression)
+
+    def write(self, filename, xml_bytes):
+        info = zipfile.ZipInfo(filename, date_time=time.localtime()[:6])
+        info.compress_type = self._zip_file.compression
+        self._zip_file.writestr(info, xml_bytes)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._zip_file.close()
+
+
+class TarArchiveWriter:
+    '''Stream all the records into one tar file.
+
+    The compression comes from the extension (.tar.gz, .tgz, .tar.bz2, .tar.xz),
+    or compress=True gzips a plain .tar path. With fileobj (a binary stream,
+    eg. stdout), the tar is streamed to that instead of a path.'''
+
+    def __init__(self, path, compress=False, fileobj=None):
+        self._fileobj = fileobj
+        if fileobj is not None:
+            #a stream can't seek back, so use tarfile's stream mode
+            self._tar_file = tarfile.open(fileobj=fileobj, mode='w|gz' if compress else 'w|')
+            return
+        mode = 'w'
+        for extensions, compression in [(('.tar.gz', '.tgz'), 'gz'), (('.tar.bz2', '.tbz2'), 'bz2'), (('.tar.xz', '.txz'), 'xz')]:
+            if path.lower().endswith(extensions):
+                mode = 'w:%s' % compression
+        if mode == 'w' and compress:
+            mode = 'w:gz'
+        self._tar_file = tarfile.open(path, mode)
+
+    def write(self, filename, xml_bytes):
+        info = tarfile.TarInfo(filename)
+        info.size = len(xml_bytes)
+        info.mtime = time.time()
+        info.mode = 0o644
+        self._tar_file.addfile(info, io.BytesIO(xml_bytes))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._tar_file.close()
+        if self._fileobj is not None:
+            #tarfile doesn't close (or flush) a file object it was given
+            self._fileobj.flush()
+
+
+class StreamWriter:
+    '''Write the records one after another to a binary stream (eg. stdout).
+
+    framing is 'nul' (each document is followed by a NUL byte, which can't
+    be in an XML document) or 'length' (each document is preceded by a
+    "<length in bytes> <filename>\\n" line). The stream is flushed, but not
+    closed, when the writer is closed.'''
+
+    def __init__(self, stream, framing='nul'):
+        if framing not in ('nul', 'length'):
+            raise ValueError('unknown stream framing: %s' % framing)
+        self._stream = stream
+        self.framing = framing
+
+    def write(self, filename, xml_bytes):
+        if self.framing == 'length':
+            self._stream.write(('%s %s\n' % (len(xml_bytes), filename)).encode('utf8'))
+            self._stream.write(xml_bytes)
+        else:
+            self._stream.write(xml_bytes)
+            self._stream.write(b'\0')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._stream.flush()
+
+
+def open_archive_writer(path, compress=False):
+    '''Get the writer for an archive path (.zip, or .tar with optional compression).'''
+    lower_path = path.lower()
+    if lower_path.endswith('.zip'):
+        return ZipArchiveWriter(path, compress=compress)
+    if lower_path.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')):
+        return TarArchiveWriter(path, compress=compress)
+    raise ValueError('archive must be a .zip or .tar file: %s' % path)
+
+
+def open_stream_writer(stream, stream_format='tar', compress=False):
+    '''Get the writer for a binary stream, in one of STREAM_FORMATS (compress gzips a tar stream).'''
+    if stream_format == 'tar':
+        return TarArchiveWriter(None, compress=compress, fileobj=stream)
+    if stream_format not in STREAM_FORMATS:
+        raise ValueError('unknown stream format: %s' % stream_format)
+    if compress:
+        raise ValueError('only a tar stream can be compressed')
+    return StreamWriter(stream, framing=stream_format)
+
+
+def _get_filename(xml_id, record_type):
+    return '%s.%s.xml' % (xml_id, record_type)
+
+
+def _get_output_filename(filenames, record):
+    '''Get the filename for the record, checking it against the set of filenames
+    already used in this run (and adding it).'''
+    filename = _get_filename(record.xml_id, record.record_type)
+    if filename in filenames:
+        raise DataError('%s file already exists from previous record! Possible duplicate %s IDs?' % (filename, record.xml_id))
+    filenames.add(filename)
+    return filename
+
+
+def _process_in_workers(records, writer, workers, manifest=None, chunk_size=WORKER_CHUNK_SIZE, renderer='eulxml',
+        validate=False, stats=None):
+    '''Map & serialize chunks of records in a process pool, writing the results in order.
+
+    Errors are raised at the same point as in the serial loop: after all the
+    records before the failing one have been written. Returns the invalid
+    records (see process()).'''
+    pending = collections.deque()
+    invalid = []
+    filenames = set()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            chunks = _iter_record_chunks(records, chunk_size)
+            while True:
+                #keep a couple of chunks per worker in flight, so memory stays bounded
+                while len(pending) < workers * 2:
+                    if stats is not None:
+                        start = time.perf_counter()
+                    try:
+                        chunk, error = next(chunks)
+                    except StopIteration:
+                        break
+                    finally:
+                        if stats is not None:
+                            stats.add_time('read', time.perf_counter() - start)
+                    to_render = [None if manifest and manifest.is_unchanged(record) else record for record in chunk]
+                    future = executor.submit(_render_records, to_render, renderer, validate, stats is not None)
+                    pending.append((chunk, future, error))
+                    if error:
+                        break
+                if not pending:
+                    break
+                chunk, future, error = pending.popleft()
+                results, chunk_stats = future.result()
+                if chunk_stats is not None:
+                    stats.merge(chunk_stats)
+                for record, xml_bytes in zip(chunk, results):
+                    filename = _get_output_filename(filenames, record)
+                    if isinstance(xml_bytes, Exception):
+                        raise xml_bytes
+                    if stats is not None:
+                        stats.records += 1
+                        stats.cells += len(record)
+                    if isinstance(xml_bytes, list):
+                        _add_invalid_record(invalid, filename, record, xml_bytes, manifest)
+                    elif xml_bytes is not None:
+                        if stats is not None:
+                            start = time.perf_counter()
+                        writer.write(filename, xml_bytes)
+                        if stats is not None:
+                            stats.add_time('write', time.perf_counter() - start)
+                            stats.written += 1
+                            stats.bytes_written += len(xml_bytes)
+                    elif stats is not None:
+                        stats.unchanged += 1
+                if error:
+                    raise error
+        finally:
+            for chunk, future, error in pending:
+                future.cancel()
+    return invalid
+
+
+def _add_invalid_record(invalid, filename, record, errors, manifest=None):
+    invalid.append({'file': filename, 'xml_id': record.xml_id, 'errors': errors})
+    if manifest:
+        #the record wasn't written, so it needs to be rebuilt next time
+        manifest.invalidate(record)
+
+
+def _process_serially(records, writer, xml_files_dir, copy_parent_to_children, manifest=None,
+        renderer='eulxml', parent_cache_size=PARENT_CACHE_SIZE, validate=False, stats=None):
+    '''Map, serialize & write the records one at a time. Returns the invalid
+    records (see process()).'''
+    filenames = set()
+    invalid = []
+    if copy_parent_to_children:
+        parents = ParentCache(xml_files_dir, max_size=parent_cache_size)
+    if stats is not None:
+        stats.start()
+    for record in records:
+        if stats is not None:
+            stats.lap('read')
+            stats.records += 1
+            stats.cells += len(record)
+        filename = _get_output_filename(filenames, record)
+        if manifest and manifest.is_unchanged(record):
+            if stats is not None:
+                stats.unchanged += 1
+            continue
+        parent = None
+        if copy_parent_to_children and record.record_type == 'mods' and record.xml_id == record.group_id:
+            #a parent - keep it for its children (once it's valid)
+            parent = _map_record(Mapper, record, stats).get_xml()
+            node = parent.node
+        elif copy_parent_to_children and record.record_type == 'mods':
+            #start from a copy of the parent mods object (if it exists)
+            if record.group_id not in parents:
+                #it may be read from xml_files_dir - make sure it's been written
+                writer.flush()
+            parent_xml = parents.get(record.group_id)
+            if parent_xml is None:
+                node = build_record(record, renderer, stats)
+            else:
+                node = _map_record(Mapper, record, stats, parent_mods=parent_xml).get_xml().node
+        else:
+            node = build_record(record, renderer, stats)
+        if stats is not None:
+            stats.lap('map')
+        errors = _check_record(record, node, validate)
+        if stats is not None:
+            stats.lap('validate')
+        if errors:
+            _add_invalid_record(invalid, filename, record, errors, manifest)
+            continue
+        if parent is not None:
+            #an invalid parent isn't written, so its children don't get it from the cache either
+            parents.add(record.group_id, parent)
+        xml_bytes = serialize_document(node)
+        if stats is not None:
+            stats.lap('serialize')
+        writer.write(filename, xml_bytes)
+        if stats is not None:
+            stats.lap('write')
+            stats.written += 1
+            stats.bytes_written += len(xml_bytes)
+    return invalid
+
+
 def process(spreadsheet, xml_files_dir, sheet=1, control_row=None, force_dates=False,
-        object_type='parent', input_encoding='utf8', copy_parent_to_children=False):
-    '''Function to go through all the data and process it.'''
-    #make sure we have a directory to put the mods files in
-    os.makedirs(xml_files_dir, exist_ok=True)
+        object_type='parent', input_encoding='utf8', copy_parent_to_children=False, workers=1,
+        archive=None, compress=False, check_duplicates=False, manifest=None, delete_vanished=False,
+        renderer='eulxml', parent_cache_size=PARENT_CACHE_SIZE, validate=False, stats=None,
+        writer_threads=WRITER_THREADS, fsync='none', columnar=False, shard=None, shard_manifest=None,
+        csv_dialect=None, stream=None, stream_format='tar'):
+    '''Function to go through all the data and process it.
+
+    With workers > 1, records are mapped & serialized in that many processes.
+    If archive is a .zip or .tar path, all the records are written into that
+    archive (with the same names they'd have in xml_files_dir) instead.
+    If stream is a binary file object (eg. sys.stdout.buffer), the records
+    are written to it instead, in stream_format (one of STREAM_FORMATS - see
+    open_stream_writer()).
+    With csv_dialect, the spreadsheet is read as CSV in that dialect - it
+    can be a stream, like sys.stdin.buffer (see DataHandler).
+    With check_duplicates, all the records are checked for duplicate IDs
+    before anything is written.
+    If manifest is a path, only the records that changed since the run that
+    wrote that manifest are rebuilt (and with delete_vanished, the files of
+    records that aren't in the spreadsheet anymore are deleted).
+    renderer is one of RENDERERS - 'lxml' gives the same output as the
+    default 'eulxml', faster.
+    With copy_parent_to_children, up to parent_cache_size parsed parent
+    records are kept in memory, so a family's parent is only read once.
+    With validate, each MODS record is checked against the bundled schema
+    before it's written, and invalid records aren't written.
+    The records are written by writer_threads background threads (one for
+    an archive, or none with writer_threads=0), so the writes overlap with
+    building the next records; a failed write is still raised from here.
+    fsync is one of FSYNC_POLICIES, for the files written to xml_files_dir.
+    With columnar, the spreadsheet is read a batch of columns at a time (see DataHandler).
+    shard is an (index, count) pair, to only process the records whose
+    group_id hashes to that shard (see get_shard()) - each node of a run can
+    process one shard of the same spreadsheet. With shard_manifest (a path),
+    the shard's records are listed there, for merge_shard_manifests().
+    If stats is a ProcessStats, the time spent in each stage, and counts of
+    the records, cells & bytes written, are added to it (without it, nothing
+    is timed).
+
+    Returns a list of the invalid records (file, xml_id & the schema errors),
+    which is always empty without validate.'''
+    if renderer not in RENDERERS:
+        raise ValueError('unknown renderer: %s' % renderer)
+    if workers > 1 and copy_parent_to_children:
+        raise ValueError('copy_parent_to_children can only be used with one worker')
+    if archive and stream is not None:
+        raise ValueError('the records can be written to an archive or a stream, not both')
+    if (archive or stream is not None) and copy_parent_to_children:
+        raise ValueError('copy_parent_to_children needs the records written to xml_files_dir')
+    if (archive or stream is not None) and manifest:
+        raise ValueError('incremental regeneration (manifest) needs the records written to xml_files_dir')
+    if (archive or stream is not None) and fsync != 'none':
+        raise ValueError('the fsync policy is for the records written to xml_files_dir')
+    if shard is not None:
+        shard = ShardManifest(*shard)
+    elif shard_manifest:
+        raise ValueError('a shard manifest needs a shard')
+    if stats is not None:
+        start = time.perf_counter()
+        dates_time = stats.times['dates']
     data_handler = DataHandler(spreadsheet, sheet=sheet, control_row=control_row, force_dates=force_dates,
-            object_type=object_type, input_encoding=input_encoding)
-    index = 1
-    for record in data_handler.get_xml_records():
-        filename = '%s.%s.xml' % (record.xml_id, record.record_type)
-        full_path = os.path.join(xml_files_dir, filename)
-        if os.path.exists(full_path):
-            raise DataError('%s file already exists from previous record! Possible duplicate %s IDs?' % (filename, record.xml_id))
-        if copy_parent_to_children:
-            #load parent mods object if desired (& it exists)
-            parent_filename = os.path.join(xml_files_dir, u'%s.%s' % (record.group_id, record.record_type))
-            parent_xml = None
-            if os.path.exists(parent_filename):
-                parent_xml = load_xmlobject_from_file(parent_filename, mods.Mods)
-                mapper = Mapper(record.record_type, record.field_data(), parent_mods=parent_xml)
+            object_type=object_type, input_encoding=input_encoding, columnar=columnar, csv_dialect=csv_dialect)
+    try:
+        if check_duplicates:
+            duplicates = data_handler.find_duplicate_ids()
+            if duplicates:
+                msg = ', '.join('%s (%s records)' % (xml_id, count) for xml_id, count in duplicates.items())
+                raise DataError('duplicate IDs: %s' % msg)
+        if stats is not None:
+            stats.add_time('read', time.perf_counter() - start)
+            data_handler.stats = stats
+        if archive or stream is not None:
+            if archive:
+                writer = open_archive_writer(archive, compress=compress)
+            else:
+                writer = open_stream_writer(stream, stream_format, compress=compress)
+            #an archive (or stream) has to be written in order, from one thread
+            writer_threads = min(writer_threads, 1)
         else:
-            mapper = Mapper(record.record_type, record.field_data())
-        xml_obj = mapper.get_xml()
-        xml_bytes = xml_obj.serializeDocument(pretty=True) #serializes as UTF-8
-        with open(full_path, 'wb') as f:
-            f.write(xml_bytes)
-        index = index + 1
+            writer = DirectoryWriter(xml_files_dir, fsync=fsync)
+        if writer_threads > 0:
+            writer = BackgroundWriter(writer, threads=writer_threads)
+        if manifest:
+            manifest = Manifest(manifest, xml_files_dir, copy_parent_to_children=copy_parent_to_children)
+        records = data_handler.iter_xml_records()
+        if shard is not None:
+            records = shard.filter(records)
+        try:
+            if workers > 1:
+                invalid = _process_in_workers(records, writer, workers, manifest=manifest,
+                        renderer=renderer, validate=validate, stats=stats)
+            else:
+                invalid = _process_serially(records, writer, xml_files_dir,
+                        copy_parent_to_children, manifest, renderer=renderer, parent_cache_size=parent_cache_size,
+                        validate=validate, stats=stats)
+        except BaseException:
+            #close the writer without letting a failed write replace the error we're raising
+            try:
+                writer.close()
+            except Exception:
+                pass
+            raise
+        if stats is not None:
+            close_start = time.perf_counter()
+        writer.close()
+        if stats is not None:
+            stats.add_time('write', time.perf_counter() - close_start)
+    finally:
+        data_handler.close()
+    if manifest:
+        if delete_vanished:
+            manifest.delete_vanished()
+        manifest.save()
+    if shard_manifest:
+        shard.save(shard_manifest, invalid)
+    if stats is not None:
+        #the dates were normalized while the rows were being read
+        stats.times['read'] -= stats.times['dates'] - dates_time
+        stats.invalid += len(invalid)
+        stats.total_time += time.perf_counter() - start
+    return invalid
+
+
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemas')
+
+#schemas imported by mods-3-4.xsd -> the copies bundled in SCHEMA_DIR, so
+#   validation doesn't need the network
+SCHEMA_LOCATIONS = {
+    'http://www.loc.gov/mods/xml.xsd': 'xml.xsd',
+    'http://www.loc.gov/standards/xlink/xlink.xsd': 'xlink.xsd',
+}
+
+MODS_ROOT_TAG = u'{%s}mods' % mods.MODS_NAMESPACE
+
+
+class _BundledSchemaResolver(etree.Resolver):
+
+    def resolve(self, url, pubid, context):
+        if url in SCHEMA_LOCATIONS:
+            return self.resolve_filename(os.path.join(SCHEMA_DIR, SCHEMA_LOCATIONS[url]), context)
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_mods_schema():
+    '''The bundled mods-3-4.xsd, compiled once (per process).'''
+    parser = etree.XMLParser(no_network=True)
+    parser.resolvers.add(_BundledSchemaResolver())
+    return etree.XMLSchema(etree.parse(os.path.join(SCHEMA_DIR, 'mods-3-4.xsd'), parser))
+
+
+def _schema_errors(schema, node):
+    if schema.validate(node):
+        return []
+    return [{'line': e.line, 'column': e.column, 'message': e.message} for e in schema.error_log]
+
+
+def validate_xml(xml_bytes):
+    '''Validate one XML document against the MODS schema.
+
+    Returns a dict with the status ('valid', 'invalid', 'skipped' for
+    documents that aren't MODS - eg. DarwinCore records - or 'error' if it
+    isn't well-formed XML) and a list of errors (line, column & message).'''
+    try:
+        root = etree.fromstring(xml_bytes)
+    except etree.XMLSyntaxError as e:
+        return {'status': 'error', 'errors': [{'line': e.lineno, 'column': e.offset, 'message': e.msg}]}
+    if root.tag != MODS_ROOT_TAG:
+        return {'status': 'skipped', 'errors': []}
+    errors = _schema_errors(get_mods_schema(), root)
+    return {'status': 'invalid' if errors else 'valid', 'errors': errors}
+
+
+def _iter_output_documents(path):
+    '''Yield (name, path or bytes) for the XML files in a directory, or in a
+    .zip/.tar archive written by process().'''
+    if os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith('.xml'):
+                yield filename, os.path.join(path, filename)
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zip_file:
+            for name in zip_file.namelist():
+                if name.endswith('.xml'):
+                    yield name, zip_file.read(name)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, 'r:*') as tar_file:
+            for member in tar_file:
+                if member.isfile() and member.name.endswith('.xml'):
+                    yield member.name, tar_file.extractfile(member).read()
+    else:
+        raise ValueError('%s is not a directory or a .zip/.tar archive' % path)
+
+
+def _validate_documents(documents):
+    '''Validate a chunk of (name, path or bytes) documents, in a worker process.'''
+    results = []
+    for name, source in documents:
+        if isinstance(source, bytes):
+            xml_bytes = source
+        else:
+            with open(source, 'rb') as f:
+                xml_bytes = f.read()
+        result = validate_xml(xml_bytes)
+        result['file'] = name
+        results.append(result)
+    return results
+
+
+def validate_output(path, workers=1, chunk_size=WORKER_CHUNK_SIZE):
+    '''Validate all the records in an output directory or archive.
 
+    Returns a list with a validate_xml() result (plus the file name) for
+    each file. With workers > 1, the files are validated in that many
+    processes.'''
+    documents = _iter_output_documents(path)
+    if workers <= 1:
+        return _validate_documents(documents)
+    results = []
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            #keep a couple of chunks per worker in flight, so memory stays bounded
+            while len(pending) < workers * 2:
+                chunk = list(itertools.islice(documents, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_validate_documents, chunk))
+            if not pending:
+                break
+            results.extend(pending.popleft().result())
+    return results
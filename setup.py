@@ -3,9 +3,16 @@ from setuptools import setup, find_packages
 setup(name='mods_generator',
     version='0.1',
     packages=find_packages(),
+    package_data={
+        'mods_generator': ['schemas/*.xsd'],
+    },
     install_requires=[
         'bdrxml',
         'xlrd<2.0.0',
-    ]
+    ],
+    extras_require={
+        'xlsx': ['openpyxl'],
+        'arrow': ['pyarrow'],
+    }
 )
 
@@ -1,12 +1,28 @@
 #!/usr/bin/env python
+import csv
+import datetime
 import io
+import json
 import os
+import pickle
+import re
+import tarfile
 import tempfile
 import unittest
+import zipfile
+from unittest.mock import patch
 
 from bdrxml.mods import Mods
 from bdrxml.darwincore import SimpleDarwinRecord
-from mods_generator import ControlRowError, ModsMappingError, DataError, ModsMappingParser, DataHandler, Mapper, process_text_date, process
+import mods_generator
+from mods_generator import ControlRowError, ModsMappingError, DataError, ModsMappingParser, DataHandler, Mapper, LxmlMapper, ProcessStats, STREAM_FORMATS, format_xldate, process_text_date, process_text_dates, process, render_record, validate_xml, validate_output
+
+
+class UnseekableBytesIO(io.BytesIO):
+    '''Like stdin - the data can only be read once.'''
+
+    def seekable(self):
+        return False
 
 
 class TestModsMappingParser(unittest.TestCase):
@@ -131,6 +147,118 @@ class TestDataHandler(unittest.TestCase):
         self.assertEqual(mods_records[1].group_id, 'test1')
         self.assertEqual(mods_records[1].xml_id, 'test1_2')
 
+    @unittest.skipUnless(mods_generator.openpyxl, 'openpyxl is not installed')
+    def test_xlsx_streaming(self):
+        dh = DataHandler(os.path.join('test_files', 'data.xlsx'), object_type='child')
+        self.assertEqual(dh.data_type, 'xlsx')
+        records = dh.get_xml_records()
+        #same values as reading the whole workbook with xlrd
+        with patch('mods_generator.openpyxl', None):
+            xlrd_dh = DataHandler(os.path.join('test_files', 'data.xlsx'), object_type='child')
+            self.assertEqual(xlrd_dh.data_type, 'xlrd')
+            xlrd_records = xlrd_dh.get_xml_records()
+        self.assertEqual([r.xml_id for r in records], [r.xml_id for r in xlrd_records])
+        for record, xlrd_record in zip(records, xlrd_records):
+            self.assertEqual([(f['xml_path'], f['data']) for f in record.field_data()],
+                    [(f['xml_path'], f['data']) for f in xlrd_record.field_data()])
+        self.assertEqual(dh.get_row(3), xlrd_dh.get_row(3))
+        with open(os.path.join('test_files', 'data.xlsx'), 'rb') as f:
+            self.assertEqual(len(DataHandler(f).get_xml_records()), 2)
+        #the read-only workbook keeps the file open until it's closed
+        dh.close()
+        self.assertIsNone(dh.book._archive.fp)
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch.object(DataHandler, 'close', autospec=True, side_effect=DataHandler.close) as close_mock:
+                process(spreadsheet=os.path.join('test_files', 'data.xlsx'), xml_files_dir=tmp)
+            self.assertEqual(close_mock.call_count, 1)
+
+    @unittest.skipUnless(mods_generator.openpyxl, 'openpyxl is not installed')
+    def test_xlsx_no_dimension(self):
+        #some writers leave out the <dimension> element, so openpyxl doesn't know the width of the sheet
+        book = mods_generator.openpyxl.Workbook()
+        book.active.append(['ID', '<mods:titleInfo><mods:title>', '<mods:originInfo><mods:dateCreated>'])
+        book.active.append(['r1', 'T1'])
+        with_dimension = io.BytesIO()
+        book.save(with_dimension)
+        without_dimension = io.BytesIO()
+        with zipfile.ZipFile(with_dimension) as zip_in, zipfile.ZipFile(without_dimension, 'w') as zip_out:
+            for name in zip_in.namelist():
+                data = zip_in.read(name)
+                if name == 'xl/worksheets/sheet1.xml':
+                    data = re.sub(b'<dimension [^>]*/>', b'', data)
+                zip_out.writestr(name, data)
+        for columnar in [False, True]:
+            with self.subTest(columnar=columnar):
+                records = DataHandler(without_dimension, control_row=1, columnar=columnar).get_xml_records()
+                self.assertEqual([(r.xml_id, [(f['xml_path'], f['data']) for f in r.field_data()]) for r in records],
+                        [('r1', [('<mods:titleInfo><mods:title>', 'T1')])])
+
+    @unittest.skipUnless(mods_generator.pyarrow, 'pyarrow is not installed')
+    def test_arrow(self):
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        def write_files(table, tmp):
+            parquet_path = os.path.join(tmp, 'data.parquet')
+            pyarrow.parquet.write_table(table, parquet_path, row_group_size=1)
+            arrow_path = os.path.join(tmp, 'data.arrow')
+            with pyarrow.ipc.new_file(arrow_path, table.schema) as writer:
+                writer.write_table(table, max_chunksize=1)
+            return [parquet_path, arrow_path]
+
+        def field_values(records):
+            return [(r.group_id, r.xml_id, [(f['xml_path'], f['data']) for f in r.field_data()]) for r in records]
+
+        with open(os.path.join('test_files', 'data.csv'), 'rt', encoding='utf8', newline='') as f:
+            rows = list(csv.reader(f))
+        expected = field_values(DataHandler(os.path.join('test_files', 'data.csv')).get_xml_records())
+        #the column names are row 1, and the control row is the first row of data
+        columns = [pyarrow.array([row[i] for row in rows[1:]]) for i in range(len(rows[0]))]
+        table = pyarrow.Table.from_arrays(columns, names=rows[0])
+        with tempfile.TemporaryDirectory() as tmp:
+            for path in write_files(table, tmp):
+                for columnar in [False, True]:
+                    with self.subTest(path=path, columnar=columnar):
+                        dh = DataHandler(path, columnar=columnar)
+                        self.assertEqual(dh.data_type, 'arrow')
+                        self.assertEqual(field_values(dh.get_xml_records()), expected)
+                        self.assertEqual(dh.get_row(3), DataHandler(os.path.join('test_files', 'data.csv')).get_row(3))
+                        dh.close()
+                        if path.endswith('.arrow'):
+                            self.assertTrue(dh._arrow_file.closed)
+                with open(path, 'rb') as f:
+                    self.assertEqual(field_values(DataHandler(f).get_xml_records()), expected)
+        #the control row in the metadata, and typed columns
+        table = pyarrow.table({
+            'id': ['1', '2', None],
+            'number': pyarrow.array([12, None, 3], pyarrow.int64()),
+            'price': [1.0, 2.5, None],
+            'created': [datetime.date(2005, 10, 21), datetime.date(2008, 1, 2), None],
+            'text_date': ['10/21/2005', '', '1/2/2008'],
+        }).replace_schema_metadata({'mods_generator.control_row': json.dumps({'id': 'ID', 'number': '<mods:identifier>',
+                'price': '<mods:note>', 'created': '<mods:originInfo><mods:dateCreated>', 'text_date': '<mods:originInfo><mods:dateIssued>'})})
+        with tempfile.TemporaryDirectory() as tmp:
+            for path in write_files(table, tmp):
+                for columnar in [False, True]:
+                    with self.subTest(path=path, columnar=columnar):
+                        records = DataHandler(path, columnar=columnar).get_xml_records()
+                        self.assertEqual(field_values(records), [
+                            ('1', '1', [('<mods:identifier>', '12'), ('<mods:note>', '1'),
+                                ('<mods:originInfo><mods:dateCreated>', '2005-10-21'), ('<mods:originInfo><mods:dateIssued>', '2005-10-21')]),
+                            ('2', '2', [('<mods:note>', '2.5'), ('<mods:originInfo><mods:dateCreated>', '2008-01-02')]),
+                        ])
+        #the control row asked for (generate_mods.py's default is 2) is ignored - with the control row
+        #   in the metadata, or as the column names
+        mapped_table = pyarrow.table({'ID': ['1', '2'], '<mods:note>': ['note 1', 'note 2']})
+        for table in [table, mapped_table]:
+            with tempfile.TemporaryDirectory() as tmp:
+                for path in write_files(table, tmp):
+                    with self.subTest(path=path, columns=table.schema.names):
+                        xml_files_dir = path + '_files'
+                        process(spreadsheet=path, xml_files_dir=xml_files_dir, control_row=2)
+                        self.assertEqual(sorted(os.listdir(xml_files_dir)), ['1.mods.xml', '2.mods.xml'])
+
     def test_csv(self):
         dh = DataHandler(os.path.join('test_files', 'data.csv'))
         mods_records = dh.get_xml_records()
@@ -184,6 +312,101 @@ class TestDataHandler(unittest.TestCase):
         self.assertEqual(xml_records[2].field_data()[4]['xml_path'], '<dwc:acceptedNameUsage>')
         self.assertEqual(xml_records[2].field_data()[4]['data'], 'Genus3 species3 Species3 Author')
 
+    def test_csv_streaming(self):
+        csv_info = 'ID,<mods:note>,<mods:originInfo><mods:dateCreated>\n1,asdf,5/14/2000\n2,"jkl\nqwer",\n'
+        csv_file = io.BytesIO(csv_info.encode('utf8'))
+        dh = DataHandler(csv_file)
+        records = dh.iter_xml_records()
+        first = next(records)
+        self.assertEqual(first.field_data()[1]['data'], '2000-05-14')
+        self.assertEqual(next(records).field_data()[0]['data'], 'jkl\nqwer')
+        self.assertEqual(list(records), [])
+        #the file object we were given is still open, and rows can be read again
+        self.assertFalse(csv_file.closed)
+        self.assertEqual(dh.get_row(2), ['1', 'asdf', '5/14/2000'])
+        self.assertEqual(len(dh.get_xml_records()), 2)
+
+    def test_date_columns(self):
+        csv_info = 'ID,<mods:originInfo><mods:dateCreated>,<dwc:verbatimEventDate>,<mods:note>\n1,5/14/2000,5/14/2000,5/14/2000\n'
+        dh = DataHandler(io.BytesIO(csv_info.encode('utf8')))
+        control_row_values = dh.get_row(1)
+        self.assertEqual(dh._get_date_columns(control_row_values), [1])
+        self.assertIs(dh._get_date_columns(control_row_values), dh._get_date_columns(control_row_values))
+        self.assertEqual(dh.get_row(2, control_row_values=control_row_values), ['1', '2000-05-14', '5/14/2000', '5/14/2000'])
+        self.assertEqual(dh.get_row(2, control_row_values=['ID', 'DATE', 'date', 'verbatim date']), ['1', '2000-05-14', '2000-05-14', '5/14/2000'])
+
+    def test_date_column_batches(self):
+        csv_info = 'ID,<mods:originInfo><mods:dateCreated>\n' + ''.join('%s,5/%s/2000\n' % (i, i % 40) for i in range(2500))
+        dh = DataHandler(io.BytesIO(csv_info.encode('utf8')))
+        records = dh.get_xml_records()
+        self.assertEqual(len(records), 2500)
+        for i, record in enumerate(records):
+            self.assertEqual(record.field_data()[0]['data'], process_text_date('5/%s/2000' % (i % 40)))
+
+    def test_iter_xml_records(self):
+        dh = DataHandler(os.path.join('test_files', 'data.xlsx'), object_type='child')
+        records = dh.iter_xml_records()
+        self.assertFalse(isinstance(records, list))
+        first = next(records)
+        self.assertEqual(first.xml_id, 'test1_1')
+        self.assertEqual(first.field_data()[4]['data'], '2005-10-21')
+        self.assertEqual([r.xml_id for r in records], ['test1_2'])
+
+    def test_mapping_plan(self):
+        dh = DataHandler(os.path.join('test_files', 'data.csv'))
+        mods_records = dh.get_xml_records()
+        self.assertEqual(dh.mapping_plan[7].get_base_element()['element'], 'mods:titleInfo')
+        self.assertEqual(dh.mapping_plan[7].get_sections()[0][0]['element'], 'mods:title')
+        #each column's mapping is parsed once and shared by all the records
+        self.assertIs(mods_records[0].field_data()[2]['mapping'], dh.mapping_plan[7])
+        self.assertIs(mods_records[1].field_data()[2]['mapping'], dh.mapping_plan[7])
+        dh = DataHandler(os.path.join('test_files', 'data_dwc.csv'))
+        dwc_records = dh.get_xml_records()
+        self.assertIs(dwc_records[0].field_data()[6]['mapping'], dwc_records[2].field_data()[4]['mapping'])
+
+    def test_compact_records(self):
+        csv_info = 'ID,<mods:note>,<mods:titleInfo><mods:title>\n1,asdf,Title 1\n2,jkl,Title 2\n3,,Title 3\n'
+        dh = DataHandler(io.BytesIO(csv_info.encode('utf8')))
+        records = dh.get_xml_records()
+        self.assertFalse(hasattr(records[0], '__dict__'))
+        self.assertEqual([len(r) for r in records], [2, 2, 1])
+        self.assertEqual(list(records[2].fields()), [('<mods:titleInfo><mods:title>', 'Title 3', dh.mapping_plan[2])])
+        #records with the same columns filled in share their field indexes
+        self.assertIs(records[0]._indexes, records[1]._indexes)
+        self.assertIs(records[0]._table, dh.field_table)
+        copied = pickle.loads(pickle.dumps(records[0]))
+        self.assertEqual([(f['xml_path'], f['data']) for f in copied.field_data()],
+                [('<mods:note>', 'asdf'), ('<mods:titleInfo><mods:title>', 'Title 1')])
+        self.assertEqual((copied.group_id, copied.xml_id, copied.record_type), ('1', '1', 'mods'))
+        #records can still be made from field_data dicts
+        record = mods_generator.XmlRecord('1', '1', [{'xml_path': '<dwc:genus>', 'data': 'Genus'}])
+        self.assertEqual(record.record_type, 'dwc')
+        self.assertEqual(record.field_data()[0]['mapping'].get_base_element()['element'], 'dwc:genus')
+        with self.assertRaises(DataError):
+            mods_generator.XmlRecord('1', '1', [])
+
+    def test_columnar(self):
+        def field_values(records):
+            return [(r.group_id, r.xml_id, r.record_type, [(f['xml_path'], f['data']) for f in r.field_data()]) for r in records]
+        for filename in ['data.csv', 'data.xls', 'data.xlsx', 'data_dwc.csv']:
+            for force_dates in [False, True]:
+                with self.subTest(filename=filename, force_dates=force_dates):
+                    path = os.path.join('test_files', filename)
+                    records = DataHandler(path, force_dates=force_dates).get_xml_records()
+                    columnar_records = DataHandler(path, force_dates=force_dates, columnar=True).get_xml_records()
+                    self.assertEqual(field_values(columnar_records), field_values(records))
+        #the columns are converted in batches - a batch with a short row is handled row by row
+        csv_info = 'ID,<mods:note>,,<mods:originInfo><mods:dateCreated>\n1,"a",x,12/20/2003\n2,"b"\n3,,,12/2005\n'
+        with patch('mods_generator.DATE_BATCH_SIZE', 1):
+            dh = DataHandler(io.BytesIO(csv_info.encode('utf8')), columnar=True)
+            records = dh.iter_xml_records()
+            self.assertEqual(next(records).field_data()[1]['data'], '2003-12-20')
+            with self.assertRaises(IndexError):
+                next(records)
+        dh = DataHandler(io.BytesIO(csv_info.replace('2,"b"', '2,"b",,').encode('utf8')), columnar=True)
+        self.assertEqual(field_values(dh.get_xml_records())[1:],
+                [('2', '2', 'mods', [('<mods:note>', 'b')]), ('3', '3', 'mods', [('<mods:originInfo><mods:dateCreated>', '2005-12')])])
+
     def test_csv_small(self):
         dh = DataHandler(os.path.join('test_files', 'data-small.csv'))
         mods_records = dh.get_xml_records()
@@ -235,6 +458,33 @@ class TestOther(unittest.TestCase):
         self.assertEqual(process_text_date('5/4/99', True), '1999-05-04')
         self.assertEqual(process_text_date('5/17/99', True), '1999-05-17')
 
+        #invalid days, leap years, and two-digit year centuries are handled like strptime
+        self.assertEqual(process_text_date('2/29/2000'), '2000-02-29')
+        self.assertEqual(process_text_date('2/29/1900'), '2/29/1900')
+        self.assertEqual(process_text_date('4/31/2000'), '4/31/2000')
+        self.assertEqual(process_text_date('0/12/2000'), '0/12/2000')
+        self.assertEqual(process_text_date('1/1/0000'), '1/1/0000')
+        self.assertEqual(process_text_date('2/29/68', True), '2068-02-29')
+        self.assertEqual(process_text_date('12/31/69', True), '1969-12-31')
+        self.assertEqual(process_text_date('5/14/2000\n'), '5/14/2000\n')
+        self.assertEqual(process_text_date('5/14-2000'), '5/14-2000')
+        #results are cached, but force_dates is part of the key
+        self.assertEqual(process_text_date('5/4/99'), '5/4/99')
+        self.assertEqual(process_text_date('5/4/99', True), '1999-05-04')
+
+    def test_process_text_dates(self):
+        dates = ['5/14/2000', '5/4/99', '', '5/14/2000', 1, None, '6-1912', '5/4/99']
+        self.assertEqual(process_text_dates(dates), [process_text_date(d) for d in dates])
+        self.assertEqual(process_text_dates(dates, True), [process_text_date(d, True) for d in dates])
+        self.assertEqual(process_text_dates([]), [])
+
+    def test_format_xldate(self):
+        self.assertEqual(format_xldate(38646.0, 0), '2005-10-21')
+        self.assertEqual(format_xldate(38646.5, 0), '2005-10-21 12:00:00')
+        self.assertEqual(format_xldate(0.75, 0), '18:00:00')
+        #1904 date system
+        self.assertEqual(format_xldate(37184.0, 1), '2005-10-21')
+
     def test_process(self):
         with tempfile.TemporaryDirectory() as tmp:
             file_path = os.path.join('test_files', 'data.xls')
@@ -278,6 +528,403 @@ class TestOther(unittest.TestCase):
             with self.assertRaises(DataError):
                 process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp)
 
+    def test_process_workers(self):
+        csv_info = 'ID,<mods:note>,<mods:titleInfo><mods:title>\n' + ''.join('%s,note %s,title %s\n' % (i, i, i) for i in range(120))
+        with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as workers_dir:
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=serial_dir)
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=workers_dir, workers=2)
+            self.assertEqual(sorted(os.listdir(workers_dir)), sorted(os.listdir(serial_dir)))
+            for filename in os.listdir(serial_dir):
+                with open(os.path.join(serial_dir, filename), 'rb') as f1, open(os.path.join(workers_dir, filename), 'rb') as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+    def test_process_workers_errors(self):
+        #records before the error are written, just like the serial path
+        csv_info = 'ID,<mods:note>\n1,asdf\n2,qwer\n1,jkl\n3,zxcv\n'
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(DataError):
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, workers=2)
+            self.assertEqual(sorted(os.listdir(tmp)), ['1.mods.xml', '2.mods.xml'])
+        csv_info = 'ID,<mods:note>\n1,asdf\n2,\n3,jkl'
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(DataError):
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, workers=2)
+            self.assertEqual(os.listdir(tmp), ['1.mods.xml'])
+        csv_info = 'ID,<mods:note>,<mods:unknownElement>\n1,asdf,\n2,jkl,qwer'
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(RuntimeError):
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, workers=2)
+            self.assertEqual(os.listdir(tmp), ['1.mods.xml'])
+
+    def test_process_writer_threads(self):
+        csv_info = 'ID,<mods:note>\n' + ''.join('%s,note %s\n' % (i, i) for i in range(100))
+        with tempfile.TemporaryDirectory() as tmp:
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, writer_threads=0)
+            expected = {}
+            for filename in os.listdir(tmp):
+                with open(os.path.join(tmp, filename), 'rb') as f:
+                    expected[filename] = f.read()
+            for writer_threads in [1, 4]:
+                for fsync in mods_generator.FSYNC_POLICIES:
+                    with self.subTest(writer_threads=writer_threads, fsync=fsync):
+                        xml_files_dir = os.path.join(tmp, '%s_%s' % (writer_threads, fsync))
+                        process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=xml_files_dir,
+                                writer_threads=writer_threads, fsync=fsync)
+                        output = {}
+                        for filename in os.listdir(xml_files_dir):
+                            with open(os.path.join(xml_files_dir, filename), 'rb') as f:
+                                output[filename] = f.read()
+                        self.assertEqual(output, expected)
+            with self.assertRaises(ValueError):
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, fsync='sometimes')
+            with self.assertRaises(ValueError):
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=None,
+                        archive=os.path.join(tmp, 'out.zip'), fsync='file')
+
+    def test_process_writer_errors(self):
+        csv_info = 'ID,<mods:note>\n' + ''.join('%s,note %s\n' % (i, i) for i in range(100))
+        write = mods_generator.DirectoryWriter.write
+        def failing_write(writer, filename, xml_bytes):
+            if filename == '50.mods.xml':
+                raise OSError('disk full')
+            write(writer, filename, xml_bytes)
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                with tempfile.TemporaryDirectory() as tmp:
+                    with patch('mods_generator.DirectoryWriter.write', failing_write):
+                        with self.assertRaises(OSError):
+                            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, workers=workers)
+                    self.assertNotIn('50.mods.xml', os.listdir(tmp))
+        #a write that fails after the main loop has failed doesn't hide the loop's error
+        csv_info += '0,duplicate\n'
+        def failing_last_write(writer, filename, xml_bytes):
+            if filename == '99.mods.xml':
+                raise OSError('disk full')
+            write(writer, filename, xml_bytes)
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                with tempfile.TemporaryDirectory() as tmp:
+                    with patch('mods_generator.DirectoryWriter.write', failing_last_write):
+                        with self.assertRaises(DataError) as cm:
+                            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, workers=workers)
+                    self.assertIsNone(cm.exception.__context__)
+
+    def test_process_writer_parents(self):
+        #with no parents cached, the children read their parent from disk - after it's been written
+        csv_info = 'Group ID,ID,<mods:note>,<mods:titleInfo><mods:title>\n'
+        csv_info += ''.join('p%s,p%s,parent %s,Parent\np%s,p%s_1,,Child\n' % ((i,) * 5) for i in range(50))
+        with tempfile.TemporaryDirectory() as tmp:
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, copy_parent_to_children=True,
+                    parent_cache_size=0, writer_threads=4)
+            for i in range(50):
+                with open(os.path.join(tmp, 'p%s_1.mods.xml' % i), 'rb') as f:
+                    self.assertIn(b'parent %s<' % str(i).encode('utf8'), f.read())
+
+    def test_process_shards(self):
+        csv_info = 'Group ID,ID,<mods:note>\n'
+        csv_info += ''.join('g%s,g%s,parent\ng%s,g%s_1,child\n' % ((i,) * 4) for i in range(30))
+        with tempfile.TemporaryDirectory() as tmp:
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=os.path.join(tmp, 'all'))
+            manifests = []
+            shard_files = []
+            for index in range(3):
+                xml_files_dir = os.path.join(tmp, 'shard%s' % index)
+                manifests.append(os.path.join(tmp, 'shard-%s-of-3.json' % index))
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=xml_files_dir, shard=(index, 3),
+                        shard_manifest=manifests[-1])
+                shard_files.append(set(os.listdir(xml_files_dir)))
+                #families stay together
+                for filename in shard_files[-1]:
+                    self.assertEqual(mods_generator.get_shard(filename.split('_')[0].split('.')[0], 3), index)
+                    self.assertIn(filename.replace('_1.', '.') if '_1.' in filename else filename.replace('.', '_1.', 1),
+                            shard_files[-1])
+                with open(manifests[-1], 'rt', encoding='utf8') as f:
+                    self.assertEqual(sorted(r[0] for r in json.load(f)['records']), sorted(shard_files[-1]))
+            self.assertEqual(set.union(*shard_files), set(os.listdir(os.path.join(tmp, 'all'))))
+            self.assertEqual(sum(len(files) for files in shard_files), 60)
+            self.assertTrue(all(shard_files))
+            result = mods_generator.merge_shard_manifests(manifests)
+            self.assertEqual(result, {'shard_count': 3, 'records': 60, 'missing_shards': [], 'duplicates': {}})
+            self.assertEqual(mods_generator.merge_shard_manifests(manifests[:2])['missing_shards'], [2])
+            #an xml_id used in two shards
+            with open(manifests[0], 'rt', encoding='utf8') as f:
+                manifest = json.load(f)
+            with open(manifests[1], 'rt', encoding='utf8') as f:
+                manifest['records'].append(json.load(f)['records'][0])
+            with open(manifests[0], 'wt', encoding='utf8') as f:
+                json.dump(manifest, f)
+            duplicates = mods_generator.merge_shard_manifests(manifests)['duplicates']
+            self.assertEqual(list(duplicates.values()), [[0, 1]])
+            with self.assertRaises(DataError):
+                mods_generator.merge_shard_manifests([manifests[0], manifests[0]])
+        self.assertEqual(mods_generator.parse_shard('1/4'), (1, 4))
+        for spec in ['4/4', '1', 'a/4', '-1/4']:
+            with self.assertRaises(ValueError):
+                mods_generator.parse_shard(spec)
+
+    def test_process_check_duplicates(self):
+        csv_info = 'ID,<mods:note>\n1,asdf\n2,qwer\n1,jkl\n3,zxcv\n2,uiop\n1,vbnm\n'
+        dh = DataHandler(io.BytesIO(csv_info.encode('utf8')))
+        self.assertEqual(list(dh.find_duplicate_ids().items()), [('1', 3), ('2', 2)])
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(DataError) as cm:
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, check_duplicates=True)
+            self.assertIn('1 (3 records), 2 (2 records)', str(cm.exception))
+            #nothing was written
+            self.assertEqual(os.listdir(tmp), [])
+        csv_info = 'ID,<mods:note>\n1,asdf\n2,qwer\n'
+        self.assertEqual(DataHandler(io.BytesIO(csv_info.encode('utf8'))).find_duplicate_ids(), {})
+        with tempfile.TemporaryDirectory() as tmp:
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, check_duplicates=True)
+            self.assertEqual(sorted(os.listdir(tmp)), ['1.mods.xml', '2.mods.xml'])
+
+    def test_process_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            xml_files_dir = os.path.join(tmp, 'xml_files')
+            manifest = os.path.join(tmp, 'manifest.json')
+            csv_info = 'ID,<mods:note>\n1,asdf\n2,qwer\n3,jkl\n'
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=xml_files_dir, manifest=manifest)
+            self.assertEqual(sorted(os.listdir(xml_files_dir)), ['1.mods.xml', '2.mods.xml', '3.mods.xml'])
+            #mark the files, so we can tell which ones get rewritten
+            for filename in os.listdir(xml_files_dir):
+                with open(os.path.join(xml_files_dir, filename), 'wb') as f:
+                    f.write(b'unchanged')
+            for workers in [1, 2]:
+                with self.subTest(workers=workers):
+                    csv_info = 'ID,<mods:note>\n1,asdf\n2,changed %s\n' % workers
+                    process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=xml_files_dir, manifest=manifest,
+                            delete_vanished=True, workers=workers)
+                    self.assertEqual(sorted(os.listdir(xml_files_dir)), ['1.mods.xml', '2.mods.xml'])
+                    with open(os.path.join(xml_files_dir, '1.mods.xml'), 'rb') as f:
+                        self.assertEqual(f.read(), b'unchanged')
+                    with open(os.path.join(xml_files_dir, '2.mods.xml'), 'rb') as f:
+                        self.assertIn(('changed %s' % workers).encode('utf8'), f.read())
+            #a missing file gets rebuilt, even if the record didn't change
+            os.remove(os.path.join(xml_files_dir, '1.mods.xml'))
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=xml_files_dir, manifest=manifest)
+            self.assertTrue(os.path.exists(os.path.join(xml_files_dir, '1.mods.xml')))
+
+    def test_process_copy_parent_to_children(self):
+        csv_info = 'Group ID,ID,<mods:note>,<mods:titleInfo><mods:title>\np1,p1,parent note,Parent title\np1,p1_1,,Child 1\np1,p1_2,,Child 2\np2,p2_1,,Orphan\n'
+        with tempfile.TemporaryDirectory() as tmp:
+            load = mods_generator.load_xmlobject_from_file
+            with patch('mods_generator.load_xmlobject_from_file', wraps=load) as load_mock:
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, copy_parent_to_children=True)
+            #the parent was built in this run, so it's not read from disk
+            self.assertEqual(load_mock.call_count, 0)
+            for child_id in ['p1_1', 'p1_2']:
+                with open(os.path.join(tmp, '%s.mods.xml' % child_id), 'rb') as f:
+                    child = f.read()
+                self.assertIn(b'parent note', child)
+                self.assertNotIn(b'Parent title', child)
+                self.assertIn(('Child %s' % child_id[-1]).encode('utf8'), child)
+            with open(os.path.join(tmp, 'p2_1.mods.xml'), 'rb') as f:
+                self.assertNotIn(b'parent note', f.read())
+            #the writes aren't waited for again for each child of a group without a parent
+            csv_info_orphans = 'Group ID,ID,<mods:titleInfo><mods:title>\np3,p3_1,Child 1\np3,p3_2,Child 2\np3,p3_3,Child 3\n'
+            with patch.object(mods_generator.BackgroundWriter, 'flush', autospec=True,
+                    side_effect=mods_generator.BackgroundWriter.flush) as flush_mock:
+                process(spreadsheet=io.BytesIO(csv_info_orphans.encode('utf8')), xml_files_dir=tmp, copy_parent_to_children=True)
+            self.assertEqual(flush_mock.call_count, 2)
+            #now the parent is only on disk, and is read once for all the children
+            csv_info = 'Group ID,ID,<mods:titleInfo><mods:title>\np1,p1_3,Child 3\np1,p1_4,Child 4\n'
+            with patch('mods_generator.load_xmlobject_from_file', wraps=load) as load_mock:
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, copy_parent_to_children=True)
+            self.assertEqual(load_mock.call_count, 1)
+            with open(os.path.join(tmp, 'p1_4.mods.xml'), 'rb') as f:
+                child = f.read()
+            self.assertIn(b'parent note', child)
+            self.assertNotIn(b'Child 3', child)
+
+    def test_process_copy_invalid_parent(self):
+        #an invalid parent isn't written, so none of its children get it (however many parents are cached)
+        csv_info = 'Group ID,ID,<mods:note>,<mods:typeOfResource>\np1,p1,parent note,not a type\np2,p2,other parent,text\n'
+        csv_info += 'p1,p1_1,child 1,\np2,p2_1,child 2,\np1,p1_2,child 3,\n'
+        for parent_cache_size in [1, 10]:
+            with self.subTest(parent_cache_size=parent_cache_size):
+                with tempfile.TemporaryDirectory() as tmp:
+                    invalid = process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, copy_parent_to_children=True,
+                            validate=True, parent_cache_size=parent_cache_size)
+                    self.assertEqual([r['xml_id'] for r in invalid], ['p1'])
+                    for child_id in ['p1_1', 'p1_2']:
+                        with open(os.path.join(tmp, '%s.mods.xml' % child_id), 'rb') as f:
+                            self.assertNotIn(b'typeOfResource', f.read())
+                    with open(os.path.join(tmp, 'p2_1.mods.xml'), 'rb') as f:
+                        self.assertIn(b'<mods:typeOfResource>text</mods:typeOfResource>', f.read())
+
+    def test_parent_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = mods_generator.ParentCache(tmp, max_size=2)
+            self.assertEqual(cache.get('p1'), None)
+            for group_id in ['p1', 'p2']:
+                parent = Mapper('mods', [{'xml_path': '<mods:note>', 'data': group_id}]).get_xml()
+                cache.add(group_id, parent)
+            #each get is a separate copy
+            copy1 = cache.get('p1')
+            copy1.notes[0].text = 'changed'
+            self.assertEqual(cache.get('p1').notes[0].text, 'p1')
+            #p2 is the least recently used now
+            cache.add('p3', Mapper('mods', []).get_xml())
+            self.assertNotIn('p2', cache)
+            self.assertEqual(cache.get('p1').notes[0].text, 'p1')
+            #a group without a parent is only looked for on disk once
+            with patch('os.path.exists', wraps=os.path.exists) as exists_mock:
+                self.assertEqual(cache.get('p4'), None)
+                self.assertIn('p4', cache)
+                self.assertEqual(cache.get('p4'), None)
+            self.assertEqual(exists_mock.call_count, 1)
+            cache.add('p4', Mapper('mods', [{'xml_path': '<mods:note>', 'data': 'p4'}]).get_xml())
+            self.assertEqual(cache.get('p4').notes[0].text, 'p4')
+
+    def test_validate_xml(self):
+        valid = Mapper('mods', [{'xml_path': '<mods:note>', 'data': 'note'}]).get_xml().serializeDocument()
+        self.assertEqual(validate_xml(valid), {'status': 'valid', 'errors': []})
+        invalid = b'<mods:mods xmlns:mods="http://www.loc.gov/mods/v3"><mods:bogus/></mods:mods>'
+        result = validate_xml(invalid)
+        self.assertEqual(result['status'], 'invalid')
+        self.assertEqual(result['errors'][0]['line'], 1)
+        self.assertIn('bogus', result['errors'][0]['message'])
+        dwc = Mapper('dwc', []).get_xml().serializeDocument()
+        self.assertEqual(validate_xml(dwc), {'status': 'skipped', 'errors': []})
+        self.assertEqual(validate_xml(b'<mods:mods')['status'], 'error')
+
+    def test_validate_output(self):
+        csv_info = 'ID,<mods:note>,<mods:typeOfResource>\n1,asdf,text\n2,jkl,not a type\n3,qwer,\n'
+        with tempfile.TemporaryDirectory() as tmp:
+            xml_files_dir = os.path.join(tmp, 'xml_files')
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=xml_files_dir)
+            archive = os.path.join(tmp, 'out.tar.gz')
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=None, archive=archive)
+            for path in [xml_files_dir, archive]:
+                for workers in [1, 2]:
+                    with self.subTest(path=path, workers=workers):
+                        results = validate_output(path, workers=workers, chunk_size=1)
+                        self.assertEqual([(r['file'], r['status']) for r in results],
+                                [('1.mods.xml', 'valid'), ('2.mods.xml', 'invalid'), ('3.mods.xml', 'valid')])
+            with self.assertRaises(ValueError):
+                validate_output(os.path.join('test_files', 'data.csv'))
+
+    def test_process_validate(self):
+        csv_info = 'ID,<mods:note>,<mods:typeOfResource>\n1,asdf,text\n2,jkl,not a type\n3,qwer,\n'
+        for workers in [1, 2]:
+            for renderer in ['eulxml', 'lxml']:
+                with self.subTest(workers=workers, renderer=renderer):
+                    with tempfile.TemporaryDirectory() as tmp:
+                        manifest = os.path.join(tmp, 'manifest.json')
+                        invalid = process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, validate=True,
+                                workers=workers, renderer=renderer, manifest=manifest)
+                        self.assertEqual([(r['file'], r['xml_id']) for r in invalid], [('2.mods.xml', '2')])
+                        self.assertIn('typeOfResource', invalid[0]['errors'][0]['message'])
+                        self.assertEqual(sorted(f for f in os.listdir(tmp) if f.endswith('.xml')), ['1.mods.xml', '3.mods.xml'])
+                        #the invalid record isn't marked as done in the manifest
+                        invalid = process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, validate=True,
+                                workers=workers, renderer=renderer, manifest=manifest)
+                        self.assertEqual(len(invalid), 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp), [])
+            self.assertEqual(len(os.listdir(tmp)), 3)
+            #the errors are where validating the written file finds them
+            with open(os.path.join(tmp, '2.mods.xml'), 'rb') as f:
+                expected = validate_xml(f.read())['errors']
+            self.assertGreater(expected[0]['line'], 1)
+            for workers in [1, 2]:
+                invalid = process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, validate=True, workers=workers)
+                self.assertEqual(invalid[0]['errors'], expected)
+
+    def test_process_stats(self):
+        csv_info = 'ID,<mods:note>,<mods:originInfo><mods:dateCreated>,<mods:typeOfResource>\n1,asdf,1/2/2000,text\n2,jkl,,not a type\n3,qwer,,\n'
+        for workers in [1, 2]:
+            for renderer in ['eulxml', 'lxml']:
+                with self.subTest(workers=workers, renderer=renderer):
+                    with tempfile.TemporaryDirectory() as tmp:
+                        stats = ProcessStats()
+                        invalid = process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp, validate=True,
+                                workers=workers, renderer=renderer, stats=stats)
+                        self.assertEqual(len(invalid), 1)
+                        self.assertEqual((stats.records, stats.cells, stats.invalid, stats.written), (3, 6, 1, 2))
+                        self.assertEqual(stats.bytes_written, sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp)))
+                        self.assertEqual(stats.element_counts, {'mods:note': 3, 'mods:originInfo': 1, 'mods:typeOfResource': 2})
+                        self.assertTrue(all(stats.times[stage] >= 0 for stage in ProcessStats.STAGES))
+                        self.assertGreater(stats.times['map'], 0)
+                        self.assertGreater(stats.times['dates'], 0)
+                        self.assertGreater(stats.total_time, 0)
+                        report = os.path.join(tmp, 'profile.json')
+                        stats.save(report)
+                        with open(report, 'rt', encoding='utf8') as f:
+                            self.assertEqual(json.load(f)['elements']['mods:note']['count'], 3)
+        #the records are the same with stats
+        with tempfile.TemporaryDirectory() as tmp:
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp)
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=os.path.join(tmp, 'stats'), stats=ProcessStats())
+            for filename in ['1.mods.xml', '2.mods.xml', '3.mods.xml']:
+                with open(os.path.join(tmp, filename), 'rb') as f1, open(os.path.join(tmp, 'stats', filename), 'rb') as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+    def test_process_archive(self):
+        csv_info = 'ID,<mods:note>\n1,asdf\n2,jkl\n'
+        with tempfile.TemporaryDirectory() as tmp:
+            process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=tmp)
+            with open(os.path.join(tmp, '1.mods.xml'), 'rb') as f:
+                expected = f.read()
+            for archive_name, compress in [('out.zip', False), ('out.zip', True), ('out.tar', False), ('out.tar.gz', False), ('out.tar', True)]:
+                with self.subTest(archive=archive_name, compress=compress):
+                    archive = os.path.join(tmp, archive_name)
+                    process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=None, archive=archive, compress=compress)
+                    if archive_name.endswith('.zip'):
+                        with zipfile.ZipFile(archive) as zip_file:
+                            self.assertEqual(zip_file.namelist(), ['1.mods.xml', '2.mods.xml'])
+                            self.assertEqual(zip_file.read('1.mods.xml'), expected)
+                    else:
+                        with tarfile.open(archive) as tar_file:
+                            self.assertEqual(tar_file.getnames(), ['1.mods.xml', '2.mods.xml'])
+                            self.assertEqual(tar_file.extractfile('1.mods.xml').read(), expected)
+
+    def test_process_archive_duplicate_ids(self):
+        csv_info = 'ID,<mods:note>\n1,asdf\n2,qwer\n1,jkl\n'
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, 'out.zip')
+            with self.assertRaises(DataError):
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=None, archive=archive)
+            #the records before the duplicate are still in the archive
+            with zipfile.ZipFile(archive) as zip_file:
+                self.assertEqual(zip_file.namelist(), ['1.mods.xml', '2.mods.xml'])
+            with self.assertRaises(ValueError):
+                process(spreadsheet=io.BytesIO(csv_info.encode('utf8')), xml_files_dir=None, archive=os.path.join(tmp, 'out.rar'))
+
+    def test_process_stream(self):
+        tsv_info = 'a title row\nID\t<mods:note>\t<mods:originInfo><mods:dateCreated>\n1\tasdf, "a"\t12/20/2003\n\n2\tjkl\t\n'
+        with tempfile.TemporaryDirectory() as tmp:
+            process(spreadsheet=io.BytesIO(tsv_info.encode('utf8')), xml_files_dir=tmp, control_row=2, csv_dialect='excel-tab')
+            expected = {}
+            for filename in ['1.mods.xml', '2.mods.xml']:
+                with open(os.path.join(tmp, filename), 'rb') as f:
+                    expected[filename] = f.read()
+        self.assertIn(b'<mods:dateCreated>2003-12-20</mods:dateCreated>', expected['1.mods.xml'])
+        for stream_format in STREAM_FORMATS:
+            with self.subTest(stream_format=stream_format):
+                output = io.BytesIO()
+                process(spreadsheet=UnseekableBytesIO(tsv_info.encode('utf8')), xml_files_dir=None, control_row=2,
+                        csv_dialect='excel-tab', stream=output, stream_format=stream_format)
+                output = output.getvalue()
+                if stream_format == 'nul':
+                    self.assertEqual(output, expected['1.mods.xml'] + b'\0' + expected['2.mods.xml'] + b'\0')
+                elif stream_format == 'length':
+                    header = ('%s 1.mods.xml\n' % len(expected['1.mods.xml'])).encode('utf8')
+                    self.assertTrue(output.startswith(header + expected['1.mods.xml']))
+                    self.assertEqual(len(output.split(b'\n', 1)[0]), len(header) - 1)
+                else:
+                    with tarfile.open(fileobj=io.BytesIO(output)) as tar_file:
+                        self.assertEqual(tar_file.getnames(), ['1.mods.xml', '2.mods.xml'])
+                        self.assertEqual(tar_file.extractfile('2.mods.xml').read(), expected['2.mods.xml'])
+        #a stream can only be read once
+        data_handler = DataHandler(UnseekableBytesIO(tsv_info.encode('utf8')), control_row=2, csv_dialect='excel-tab')
+        self.assertEqual(len(data_handler.get_xml_records()), 2)
+        with self.assertRaises(RuntimeError):
+            data_handler.get_xml_records()
+        with self.assertRaises(ValueError):
+            process(spreadsheet=io.BytesIO(tsv_info.encode('utf8')), xml_files_dir=None, csv_dialect='excel-tab',
+                    stream=io.BytesIO(), stream_format='nul', compress=True)
+
 
 class TestControlRow(unittest.TestCase):
 
@@ -482,6 +1129,14 @@ class TestMapper(unittest.TestCase):
         #this does assume that the attributes will always be written out in the same order
         self.assertEqual(mods_data, self.FULL_MODS)
 
+    def test_mapping_plan_output(self):
+        dh = DataHandler(os.path.join('test_files', 'data.csv'))
+        for record in dh.get_xml_records():
+            parsed_each_time = [{'xml_path': f['xml_path'], 'data': f['data']} for f in record.field_data()]
+            expected = Mapper(record.record_type, parsed_each_time).get_xml().serializeDocument(pretty=True)
+            mods = Mapper(record.record_type, record.field_data()).get_xml()
+            self.assertEqual(mods.serializeDocument(pretty=True), expected)
+
     def test_get_data_divs(self):
         m = Mapper('mods', [])
         self.assertEqual(m._get_data_divs('part1#part2#part3', False), ['part1#part2#part3'])
@@ -520,6 +1175,153 @@ class TestMapper(unittest.TestCase):
         self.assertEqual(dwc.record_number, '2')
         self.assertEqual(dwc.municipality, 'Muni')
 
+    def test_register_elements(self):
+        class LocalMapper(Mapper):
+            pass
+        def add_extension(mapper, base_element, location_sections, data_vals):
+            mapper.get_xml().create_abstract()
+            mapper.get_xml().abstract.text = 'extension: %s' % data_vals[0][0]
+        LocalMapper.register_mods_element('mods:extension', add_extension)
+        LocalMapper.register_dwc_element('dwc:eventRemarks', 'event_date')
+        m = LocalMapper('mods', [])
+        m.add_data('<mods:extension>', 'local data')
+        self.assertEqual(m.get_xml().abstract.text, 'extension: local data')
+        m = LocalMapper('dwc', [])
+        m.add_data('<dwc:eventRemarks>', 'remarks')
+        self.assertEqual(m.get_xml().simple_darwin_record.event_date, 'remarks')
+        #registering on a subclass doesn't change Mapper
+        with self.assertRaises(RuntimeError):
+            Mapper('mods', []).add_data('<mods:extension>', 'local data')
+        with self.assertRaises(RuntimeError):
+            Mapper('dwc', []).add_data('<dwc:eventRemarks>', 'remarks')
+
+    def test_override_handlers(self):
+        #the built-in handlers are looked up on the mapper, so a subclass can override them
+        class LocalMapper(Mapper):
+            def _add_note(self, base_element, location_sections, data_vals):
+                super()._add_note(base_element, location_sections, [[data[0].upper()] for data in data_vals])
+
+            def _add_origin_info_publisher(self, section, data):
+                super()._add_origin_info_publisher(section, 'Published by %s' % data)
+        m = LocalMapper('mods', [])
+        m.add_data('<mods:note>', 'local note')
+        m.add_data('<mods:originInfo><mods:publisher>', 'Someone')
+        self.assertEqual(m.get_xml().notes[0].text, 'LOCAL NOTE')
+        self.assertEqual(m.get_xml().origin_info.publisher, 'Published by Someone')
+        m = Mapper('mods', [])
+        m.add_data('<mods:note>', 'local note')
+        self.assertEqual(m.get_xml().notes[0].text, 'local note')
+
+
+class TestLxmlMapper(unittest.TestCase):
+    #the LxmlMapper output has to be byte-for-byte the same as Mapper's
+
+    FIELDS = [
+        ('<mods:mods ID="">', 'mods000'),
+        ('<mods:identifier type="local" displayLabel="Original no.">', '1591'),
+        ('<mods:subject><mods:topic>', 'Recursion'),
+        ('<mods:physicalDescription><mods:extent>#<mods:digitalOrigin>#<mods:note>', '1 video file#reformatted digital#note 1'),
+        ('<mods:titleInfo><mods:title>#<mods:partName>#<mods:partNumber>', 'é. 1 Test#part \#1#1'),
+        ('<mods:titleInfo type="alternative" displayLabel="display"><mods:title>#<mods:nonSort>', 'Alt Title#The'),
+        ('<mods:genre authority="aat">', 'Programming Tests'),
+        ('<mods:originInfo><mods:publisher>', 'Publisher'),
+        ('<mods:originInfo><mods:place><mods:placeTerm>', 'USA'),
+        ('<mods:originInfo displayLabel="Date Ądded to Colléction"><mods:dateOther encoding="w3cdtf" keyDate="yes">', '2010-01-31'),
+        ('<mods:subject><mods:topic>', 'PROGRĄMMING || Testing'),
+        ('<mods:subject><mods:topic>#<mods:topic>', 'Software#Testing'),
+        ('<mods:subject authority="local"><mods:temporal>', '1990s'),
+        ('<mods:subject><mods:geographic>', 'United States'),
+        ('<mods:subject><mods:hierarchicalGeographic><mods:country>United States</mods:country><mods:state>', 'Pennsylvania'),
+        ('<mods:name type="personal"><mods:namePart>#<mods:role><mods:roleTerm>', 'Smith#creator || Jones, T.'),
+        ('<mods:namePart type="date">', '1799-1889'),
+        ('<mods:name type="personal"><mods:namePart>#<mods:role><mods:roleTerm type="text">winner', 'Bob'),
+        ('<mods:name type="personal"><mods:namePart>#<mods:namePart type="date">#<mods:namePart type="termsOfAddress">', 'Fob, Bob || Smith, Ted#1900-2013#Sir'),
+        ('<mods:originInfo><mods:dateCreated encoding="w3cdtf">#<mods:dateCreated encoding="w3cdtf" point="start" keyDate="yes">#<mods:dateCreated encoding="w3cdtf" point="end">', '1972-10-1973-07-07#1972-10#1973-07-07'),
+        ('<mods:note displayLabel="note label">', 'Note 1&2'),
+        ('<mods:typeOfResource>', 'video'),
+        ('<mods:location><mods:physicalLocation>zzz#<mods:url>#<mods:holdingSimple><mods:copyInformation><mods:note>', '#http://www.example.com#Note 1'),
+        ('<mods:note>', 'another note'),
+        ('<mods:targetAudience>', 'adult'),
+        ('<mods:abstract>', 'An abstract'),
+        ('<mods:typeOfResource>', 'text'),
+        ('<mods:language><mods:languageTerm authority="iso639-2b" type="code">', 'eng'),
+        ('<mods:relatedItem type="related item" displayLabel="display"><mods:titleInfo><mods:title>', 'Some related item display title'),
+        ('<mods:originInfo><mods:copyrightDate>', '1978-01-##'),
+    ]
+
+    def assertSameOutput(self, record_type, field_data):
+        expected = Mapper(record_type, field_data).get_xml().serializeDocument(pretty=True)
+        self.assertEqual(LxmlMapper(record_type, field_data).serializeDocument(pretty=True), expected)
+
+    def test_all_elements(self):
+        field_data = [{'xml_path': xml_path, 'data': data} for xml_path, data in self.FIELDS]
+        self.assertSameOutput('mods', field_data)
+        #order matters (eg. a repeated element goes after the last one of its kind)
+        self.assertSameOutput('mods', list(reversed(field_data)))
+        #each element on its own (a namePart needs a name before it)
+        for field in field_data:
+            if not field['xml_path'].startswith('<mods:namePart'):
+                self.assertSameOutput('mods', [field])
+
+    def test_odd_data(self):
+        self.assertSameOutput('mods', [
+            {'xml_path': '<mods:titleInfo><mods:title>#<mods:partName>#<mods:title>', 'data': 'a##b'},
+            {'xml_path': '<mods:name><mods:role><mods:roleTerm authority="marcrelator">#<mods:namePart>', 'data': '#Name'},
+            {'xml_path': '<mods:originInfo><mods:dateCreated keyDate="no">#<mods:dateIssued keyDate="">', 'data': '2000#2001'},
+            {'xml_path': '<mods:physicalDescription><mods:extent>#<mods:digitalOrigin>born digital', 'data': '1 file'},
+            {'xml_path': '<mods:location><mods:physicalLocation>#<mods:physicalLocation>', 'data': 'one#two'},
+            {'xml_path': '<mods:note type="">', 'data': ' || x&y<z> || '},
+        ])
+
+    def test_dwc(self):
+        self.assertSameOutput('dwc', [
+            {'xml_path': '<dwc:scientificName>', 'data': 'Scientific Name'},
+            {'xml_path': '<dc:type>', 'data': 'not a field on the record'},
+            {'xml_path': '<dwc:recordedBy>', 'data': 'Sci Entist || Phy Sycist'},
+            {'xml_path': '<dwc:scientificName>', 'data': 'Other Name'},
+        ])
+
+    def test_test_files(self):
+        for filename, control_row in [('data.csv', 2), ('data.xls', 2), ('data-small.csv', None), ('data_dwc.csv', None)]:
+            dh = DataHandler(os.path.join('test_files', filename), control_row=control_row)
+            for record in dh.get_xml_records():
+                self.assertSameOutput(record.record_type, record.field_data())
+
+    def test_fallback(self):
+        #elements without an lxml handler are rendered by Mapper
+        field_data = [{'xml_path': '<mods:note>', 'data': 'note'}, {'xml_path': '<mods:extension>', 'data': 'data'}]
+        with self.assertRaises(mods_generator.UnsupportedByLxml):
+            LxmlMapper('mods', field_data)
+        record = mods_generator.XmlRecord('test1', 'test1', field_data)
+        with self.assertRaises(RuntimeError):
+            render_record(record, 'lxml')
+        #the elements of a record that falls back are only timed once
+        record = mods_generator.XmlRecord('test1', 'test1', [{'xml_path': '<mods:note>', 'data': 'note'},
+                {'xml_path': '<mods:genre>', 'data': 'genre'}])
+        with patch.dict(LxmlMapper.mods_element_handlers):
+            del LxmlMapper.mods_element_handlers['mods:genre']
+            stats = ProcessStats()
+            node = mods_generator.build_record(record, 'lxml', stats)
+        self.assertEqual(mods_generator.serialize_document(node), render_record(record))
+        self.assertEqual(dict(stats.element_counts), {'mods:note': 1, 'mods:genre': 1})
+        #bad data raises the same error as with Mapper
+        record = mods_generator.XmlRecord('test1', 'test1', [{'xml_path': '<mods:namePart>', 'data': 'part'}])
+        with self.assertRaises(IndexError):
+            render_record(record, 'lxml')
+
+    def test_process_renderer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            eulxml_dir = os.path.join(tmp, 'eulxml')
+            lxml_dir = os.path.join(tmp, 'lxml')
+            process(spreadsheet=os.path.join('test_files', 'data.xls'), xml_files_dir=eulxml_dir)
+            process(spreadsheet=os.path.join('test_files', 'data.xls'), xml_files_dir=lxml_dir, renderer='lxml')
+            self.assertEqual(sorted(os.listdir(lxml_dir)), sorted(os.listdir(eulxml_dir)))
+            for filename in os.listdir(eulxml_dir):
+                with open(os.path.join(eulxml_dir, filename), 'rb') as f1, open(os.path.join(lxml_dir, filename), 'rb') as f2:
+                    self.assertEqual(f2.read(), f1.read())
+            with self.assertRaises(ValueError):
+                process(spreadsheet=os.path.join('test_files', 'data.xls'), xml_files_dir=lxml_dir, renderer='other')
+
 
 if __name__ == '__main__':
     runner = unittest.TextTestRunner(verbosity=2)
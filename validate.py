@@ -1,24 +1,38 @@
 #!/usr/bin/env python
+'''Validate the MODS files written by generate_mods.py against the
+mods-3-4.xsd schema bundled with mods_generator (no network needed).
 
-#validate output files as much as possible
-import os
+Pass the output directory (default xml_files) or a .zip/.tar archive made
+with --archive. Non-MODS files (eg. DarwinCore records) are skipped.
+Run './validate.py --help' to see the options.
+'''
+import json
 import sys
-import time
+from argparse import ArgumentParser
+from mods_generator import validate_output
 
-#list all the files in mods_files
-for f in os.listdir('mods_files'):
-    #run xmllint on each one
-    filename = './mods_files/' + f
-    print('Validating %s...' % f)
-    #xmllint --noout --schema "http://www.loc.gov/standards/mods/v3/mods-3-4.xsd" 00001817.mods
-    #args = ['/usr/bin/xmllint',  '--noout', '--schema', 
-    #    './mods-3-4.xsd.nice', './mods_files/' + f]
-    #p = Popen(args)
-    cmd = '/usr/bin/xmllint --noout --schema "http://www.loc.gov/standards/mods/v3/mods-3-4.xsd" %s' % filename
-    result = os.system(cmd)
-    if result != 0:
-        print 'Error'
-    time.sleep(3)
-
-sys.exit()
 
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('path', nargs='?', default='xml_files',
+                    help='directory or archive of XML files (default is xml_files)')
+    parser.add_argument('-w', '--workers',
+                    action='store', dest='workers', default=1,
+                    help='number of processes to validate files in (default is 1)')
+    parser.add_argument('--report',
+                    action='store', dest='report', default=None,
+                    help='write the result for each file to this JSON file')
+    args = parser.parse_args()
+    results = validate_output(args.path, workers=int(args.workers))
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        for error in result['errors']:
+            print('%s:%s:%s: %s' % (result['file'], error['line'], error['column'], error['message']))
+    if args.report:
+        with open(args.report, 'wt', encoding='utf8') as f:
+            json.dump({'summary': counts, 'files': results}, f, indent=2)
+    print(', '.join('%s %s' % (counts.get(status, 0), status) for status in ['valid', 'invalid', 'error', 'skipped']))
+    if counts.get('invalid') or counts.get('error'):
+        sys.exit(1)
+    sys.exit()